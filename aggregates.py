@@ -0,0 +1,114 @@
+import logging
+import threading
+from utils import file_signature, write_csv, journal_growth
+from events import publish
+
+# Aggregates notified of every write to the files they are derived from
+_registry = []
+
+class FileAggregate:
+    """
+    In-memory aggregate derived from one or more CSV files.
+
+    It is rebuilt from scratch whenever a source file changed behind its back
+    (another worker, a script) and updated incrementally for the changes this
+    process makes, which are passed to it through notify_change(). Rows other
+    processes only appended to a table's journal, or appended and then
+    flushed into its months, are applied as inserts instead of rebuilding.
+    Subclasses set `sources` and implement `rebuild()` and `apply()`.
+    """
+    sources = ()
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._signatures = None
+        _registry.append(self)
+
+    def rebuild(self):
+        """Recompute the aggregate from the source files."""
+        raise NotImplementedError
+
+    def apply(self, file_path, before, after):
+        """Apply one row change (before/after are row dicts, None for insert/delete)."""
+        raise NotImplementedError
+
+    def ensure_current(self):
+        """Rebuild the aggregate if any source file changed since it was last brought up to date."""
+        with self._lock:
+            signatures = tuple(file_signature(path) for path in self.sources)
+            if signatures == self._signatures:
+                return
+            if all(self._catch_up(index, signature) for index, signature in enumerate(signatures)):
+                return
+            self.rebuild()
+            # A write during the rebuild may or may not be in it, so rows appended since can't be applied on top
+            if tuple(file_signature(path) for path in self.sources) != signatures:
+                signatures = None
+            self._signatures = signatures
+
+    def _catch_up(self, index, signature):
+        """Apply the rows appended to a source's journal since its last signature; False if anything else changed."""
+        if self._signatures is None:
+            return False
+        if self._signatures[index] == signature:
+            return True
+        file_path = self.sources[index]
+        rows = journal_growth(file_path, self._signatures[index], signature)
+        if rows is None:
+            return False
+        for row in rows:
+            self.apply(file_path, None, row)
+        signatures = list(self._signatures)
+        signatures[index] = signature
+        self._signatures = tuple(signatures)
+        return True
+
+    def on_change(self, file_path, previous_signature, changes):
+        """Apply changes written to file_path, if the aggregate was current before that write."""
+        if file_path not in self.sources:
+            return
+        with self._lock:
+            index = self.sources.index(file_path)
+            if not self._catch_up(index, previous_signature):
+                # Missed an earlier change; rebuild on the next read instead
+                self._signatures = None
+                return
+            for before, after in changes:
+                self.apply(file_path, before, after)
+            signatures = list(self._signatures)
+            signatures[index] = file_signature(file_path)
+            self._signatures = tuple(signatures)
+
+def notify_change(file_path, previous_signature, changes):
+    """
+    Tell every aggregate about rows written to a CSV file.
+
+    Args:
+        file_path: The CSV file that was written
+        previous_signature: file_signature() of the file before the write
+        changes: List of (before, after) row dicts; before is None for an
+                 insert and after is None for a delete
+    """
+    for aggregate in _registry:
+        try:
+            aggregate.on_change(file_path, previous_signature, changes)
+        except Exception as e:
+            logging.error(f"Error updating {type(aggregate).__name__}: {e}")
+            aggregate._signatures = None
+
+def write_csv_with_changes(df, file_path, changes, partition=None):
+    """
+    Write a DataFrame to a CSV file and pass the row changes it contains on to the aggregates.
+
+    For a partitioned table, `partition` is the YYYY-MM month df holds (see utils.write_csv()).
+    """
+    previous_signature = file_signature(file_path)
+    if not write_csv(df, file_path, partition):
+        return False
+    notify_write(file_path, previous_signature, changes)
+    return True
+
+def notify_write(file_path, previous_signature, changes):
+    """Pass the changes of a write to the aggregates (see notify_change()), then publish them as change events (see events.py)."""
+    notify_change(file_path, previous_signature, changes)
+    publish(file_path, changes)
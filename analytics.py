@@ -1,155 +1,97 @@
-import pandas as pd
-import numpy as np
 import json
+import logging
+import threading
 from datetime import datetime, timedelta
 from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, session
-from utils import read_csv, get_students_count, get_today_attendance_count, format_date
+from utils import read_csv, format_date, lazy_import, data_version, conditional_get
 from config import STUDENTS_CSV, ATTENDANCE_CSV, MENU_CSV, MEAL_PREPARATION_CSV, MEAL_TYPES, DAYS_OF_WEEK
 from auth import login_required
-from prediction import predict_meal_attendance, train_prediction_model, train_food_prediction_model, predict_food_quantity_for_week
+from rollups import daily_rollups
+from student_stats import student_stats
+from history import student_directory
+from events import subscribe
+from snapshots import read_columns
+from metrics import record_cache
+from cache import get_cache
+from prediction import ATTENDANCE_MODEL_PATH, predict_meal_attendance, train_prediction_model, train_food_prediction_model, predict_food_quantity_for_week
+
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
 
 analytics_bp = Blueprint('analytics', __name__)
 
 @analytics_bp.route('/dashboard')
 @login_required
 def dashboard():
-    """Display the main dashboard."""
-    # Get basic metrics
-    total_students = get_students_count()
-    breakfast_count = get_today_attendance_count('Breakfast')
-    lunch_count = get_today_attendance_count('Lunch')
-    dinner_count = get_today_attendance_count('Dinner')
-    
+    """Display the main dashboard; its widgets are filled in from /api/dashboard."""
     # Get current date in a readable format
     today = format_date(datetime.now().strftime("%Y-%m-%d"))
     
-    # Check if there are any predictions available
-    predictions_available = False
-    tomorrow = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
-    attendance_prediction = predict_meal_attendance(tomorrow)
-    if attendance_prediction and any(attendance_prediction.values()):
-        predictions_available = True
-    
-    return render_template('dashboard.html',
-                          total_students=total_students,
-                          breakfast_count=breakfast_count,
-                          lunch_count=lunch_count,
-                          dinner_count=dinner_count,
-                          today=today,
-                          predictions_available=predictions_available)
+    return render_template('dashboard.html', today=today)
 
 @analytics_bp.route('/analytics')
 @login_required
 def analytics():
     """Display the analytics page."""
-    # Read data from CSV files
-    students_df = read_csv(STUDENTS_CSV)
-    attendance_df = read_csv(ATTENDANCE_CSV)
-    menu_df = read_csv(MENU_CSV)
-    meal_prep_df = read_csv(MEAL_PREPARATION_CSV)
+    # Daily (date, meal_type) rollups, maintained incrementally on every write
+    rollups = daily_rollups.query()
     
     # Check if data is available
-    data_available = not (students_df.empty or attendance_df.empty)
+    data_available = bool(student_directory.all()) and any(row['attendance_count'] > 0 for row in rollups)
     
-    # Calculate total wastage statistics
+    # Calculate total wastage statistics over meals that have both attendance and preparation data
     wastage_stats = {}
-    if not (attendance_df.empty or meal_prep_df.empty):
-        # First, extract meal_type from meal_name in meal_prep_df
-        def extract_meal_type(meal_name):
-            if 'Break' in meal_name:
-                return 'Breakfast'
-            elif 'Lunch' in meal_name:
-                return 'Lunch'
-            elif 'Dinner' in meal_name:
-                return 'Dinner'
-            return 'Unknown'
+    wastage_by_meal = [
+        {
+            'date': row['date'],
+            'meal_type': row['meal_type'],
+            'leftover_weight': row['leftover_sum'],
+            'quantity_prepared': row['quantity_prepared'],
+            'expected_students': row['expected_students'],
+            'wastage_percentage': (row['leftover_sum'] / row['quantity_prepared'] * 100) if row['quantity_prepared'] else 0
+        }
+        for row in rollups if row['attendance_count'] > 0 and row['preparations'] > 0
+    ]
+    
+    if wastage_by_meal:
+        # Total wastage
+        total_wastage = sum(row['leftover_weight'] for row in wastage_by_meal)
+        total_prepared = sum(row['quantity_prepared'] for row in wastage_by_meal)
+        wastage_percentage = (total_wastage / total_prepared * 100) if total_prepared > 0 else 0
         
-        meal_prep_df['meal_type'] = meal_prep_df['meal_name'].apply(extract_meal_type)
-        
-        # Now merge attendance with meal preparation data
-        merged_data = pd.merge(
-            attendance_df,
-            meal_prep_df,
-            left_on=['date', 'meal_type'],
-            right_on=['date', 'meal_type'],
-            how='inner'
-        )
-        
-        if not merged_data.empty:
-            # Calculate total wastage per meal
-            wastage_by_meal = merged_data.groupby(['date', 'meal_type']).agg({
-                'leftover_weight': 'sum',
-                'quantity_prepared': 'first',
-                'expected_students': 'first'
-            }).reset_index()
-            
-            wastage_by_meal['wastage_percentage'] = (wastage_by_meal['leftover_weight'] / 
-                                                    wastage_by_meal['quantity_prepared'] * 100)
-            
-            # Total wastage
-            total_wastage = wastage_by_meal['leftover_weight'].sum()
-            total_prepared = wastage_by_meal['quantity_prepared'].sum()
-            wastage_percentage = (total_wastage / total_prepared * 100) if total_prepared > 0 else 0
-            
-            wastage_stats = {
-                'total_wastage': f"{total_wastage:.2f} kg",
-                'total_prepared': f"{total_prepared:.2f} kg",
-                'wastage_percentage': f"{wastage_percentage:.2f}%",
-                'wastage_by_meal': wastage_by_meal.to_dict('records')
-            }
-    
-    # Student wastage statistics
-    student_wastage = []
-    if not (attendance_df.empty or students_df.empty):
-        # Merge attendance with student data
-        student_data = pd.merge(
-            attendance_df,
-            students_df,
-            left_on='student_id',
-            right_on='id',
-            how='inner'
-        )
-        
-        if not student_data.empty:
-            # Calculate total wastage per student
-            student_wastage_data = student_data.groupby(['student_id', 'name', 'roll_number']).agg({
-                'leftover_weight': 'sum'
-            }).reset_index()
-            
-            # Sort by wastage (highest first)
-            student_wastage_data = student_wastage_data.sort_values('leftover_weight', ascending=False)
-            
-            student_wastage = student_wastage_data.head(10).to_dict('records')
+        wastage_stats = {
+            'total_wastage': f"{total_wastage:.2f} kg",
+            'total_prepared': f"{total_prepared:.2f} kg",
+            'wastage_percentage': f"{wastage_percentage:.2f}%",
+            'wastage_by_meal': wastage_by_meal
+        }
+    
+    # Student wastage statistics, from the incrementally maintained per-student table
+    student_wastage = [
+        {
+            'name': row['name'],
+            'roll_number': row['roll_number'],
+            'leftover_weight': row['total_leftover'],
+            'rolling_leftover': row['rolling_leftover'],
+            'last_seen': row['last_seen'],
+        }
+        for row in student_stats.top_k(10, 'total_leftover')
+    ]
     
     # Calculate meal type wastage for pie chart
-    meal_type_wastage = []
-    if not attendance_df.empty:
-        meal_wastage = attendance_df.groupby('meal_type').agg({
-            'leftover_weight': 'sum'
-        }).reset_index()
-        
-        meal_type_wastage = meal_wastage.to_dict('records')
+    meal_type_totals = {}
+    for row in rollups:
+        if row['attendance_count'] > 0:
+            meal_type_totals[row['meal_type']] = meal_type_totals.get(row['meal_type'], 0) + row['leftover_sum']
+    meal_type_wastage = [
+        {'meal_type': meal_type, 'leftover_weight': leftover}
+        for meal_type, leftover in sorted(meal_type_totals.items())
+    ]
     
     # Historical wastage data for line chart (last 30 days)
-    dates = []
-    wastage_values = []
-    
-    if not attendance_df.empty:
-        # Get date range
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=30)
-        
-        # Filter data within date range
-        date_range = [
-            (start_date + timedelta(days=i)).strftime("%Y-%m-%d")
-            for i in range(31)
-        ]
-        
-        # Calculate daily wastage
-        for date in date_range:
-            daily_wastage = attendance_df[attendance_df['date'] == date]['leftover_weight'].sum()
-            dates.append(date)
-            wastage_values.append(float(daily_wastage))
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=30)
+    dates, wastage_values = daily_rollups.daily_leftover(start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"))
     
     # Tomorrow's predictions
     tomorrow = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
@@ -180,15 +122,63 @@ def generate_predictions():
 
 @analytics_bp.route('/api/food_waste_data')
 @login_required
+@conditional_get(ATTENDANCE_CSV)
 def food_waste_data():
     """API endpoint for food waste data."""
-    attendance_df = read_csv(ATTENDANCE_CSV)
+    return jsonify(food_waste_summary(read_csv(ATTENDANCE_CSV, recent_attendance_start())))
+
+@analytics_bp.route('/api/todays_waste_analysis')
+@login_required
+@conditional_get(ATTENDANCE_CSV, MEAL_PREPARATION_CSV)
+def todays_waste_analysis():
+    """API endpoint for today's waste analysis."""
+    today = datetime.now().strftime("%Y-%m-%d")
+    return jsonify(todays_waste_summary(read_csv(ATTENDANCE_CSV, today, today),
+                                        read_csv(MEAL_PREPARATION_CSV, today, today), today))
+
+@analytics_bp.route('/api/dashboard')
+@login_required
+@conditional_get(STUDENTS_CSV, ATTENDANCE_CSV, MEAL_PREPARATION_CSV, ATTENDANCE_MODEL_PATH)
+def dashboard_data():
+    """API endpoint with every dashboard widget, computed from one read of each data file."""
+    today = datetime.now().strftime("%Y-%m-%d")
+    students_df = read_csv(STUDENTS_CSV)
+    # Only the months holding today and the last 7 days with attendance are read
+    attendance_df = read_csv(ATTENDANCE_CSV, recent_attendance_start())
+    meal_prep_df = read_csv(MEAL_PREPARATION_CSV, today, today)
     
+    today_attendance = attendance_df[attendance_df['date'] == today] if not attendance_df.empty else attendance_df
+    meal_counts = today_attendance['meal_type'].value_counts() if not today_attendance.empty else {}
+    
+    tomorrow = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
+    attendance_prediction = predict_meal_attendance(tomorrow)
+    
+    return jsonify({
+        'today': format_date(today),
+        'total_students': len(students_df),
+        'meal_counts': {meal_type: int(meal_counts.get(meal_type, 0)) for meal_type in MEAL_TYPES},
+        'total_waste': float(today_attendance['leftover_weight'].sum()) if not today_attendance.empty else 0.0,
+        'food_waste': food_waste_summary(attendance_df),
+        'todays_waste': todays_waste_summary(attendance_df, meal_prep_df, today),
+        'predictions': {
+            'available': bool(attendance_prediction and any(attendance_prediction.values())),
+            'date': tomorrow,
+            'attendance': attendance_prediction or {},
+        },
+    })
+
+def recent_attendance_start(days=7):
+    """Get the first of the last `days` dates with attendance (or today, if earlier), to read just the rows food_waste_summary() needs."""
+    dates = sorted({row['date'] for row in daily_rollups.query() if row['attendance_count'] > 0})
+    return min(dates[-days:][:1] + [datetime.now().strftime("%Y-%m-%d")])
+
+def food_waste_summary(attendance_df):
+    """Total leftover weight per day for the last 7 days with attendance data."""
     if attendance_df.empty:
-        return jsonify({
+        return {
             'dates': [],
             'values': []
-        })
+        }
     
     # Get all unique dates from attendance data
     attendance_dates = attendance_df['date'].unique()
@@ -211,35 +201,30 @@ def food_waste_data():
     # Format dates for display
     formatted_dates = [format_date(date) for date in dates]
     
-    return jsonify({
+    return {
         'dates': dates,
         'formatted_dates': formatted_dates,
         'values': values
-    })
+    }
 
-@analytics_bp.route('/api/todays_waste_analysis')
-@login_required
-def todays_waste_analysis():
-    """API endpoint for today's waste analysis."""
-    attendance_df = read_csv(ATTENDANCE_CSV)
-    meal_prep_df = read_csv(MEAL_PREPARATION_CSV)
-    
-    today = datetime.now().strftime("%Y-%m-%d")
+def todays_waste_summary(attendance_df, meal_prep_df, today=None):
+    """Today's leftover weight per meal type, with the prepared quantity and wastage percentage where known."""
+    today = today or datetime.now().strftime("%Y-%m-%d")
     
-    if attendance_df.empty or meal_prep_df.empty:
-        return jsonify({
+    if attendance_df.empty:
+        return {
             'available': False,
             'message': 'No waste data available for today'
-        })
+        }
     
     # Today's attendance with leftover weights
     today_attendance = attendance_df[attendance_df['date'] == today]
     
     if today_attendance.empty:
-        return jsonify({
+        return {
             'available': False,
             'message': 'No waste data available for today'
-        })
+        }
     
     # Calculate waste by meal type
     waste_by_meal = today_attendance.groupby('meal_type').agg({
@@ -247,22 +232,10 @@ def todays_waste_analysis():
     }).reset_index()
     
     # Merge with meal preparation if available
-    today_prep = meal_prep_df[meal_prep_df['date'] == today]
+    today_prep = meal_prep_df[meal_prep_df['date'] == today].copy() if not meal_prep_df.empty else meal_prep_df
     
     if not today_prep.empty:
-        # Extract meal_type from meal_name
-        def extract_meal_type(meal_name):
-            if 'Break' in meal_name:
-                return 'Breakfast'
-            elif 'Lunch' in meal_name:
-                return 'Lunch'
-            elif 'Dinner' in meal_name:
-                return 'Dinner'
-            return 'Unknown'
-        
-        today_prep['meal_type'] = today_prep['meal_name'].apply(extract_meal_type)
-        
-        # Now merge
+        # Merge on the meal type stored with each preparation record
         merged_data = pd.merge(
             waste_by_meal,
             today_prep,
@@ -284,11 +257,14 @@ def todays_waste_analysis():
                                                   merged_data['quantity_prepared'] * 100)
                 waste_by_meal = merged_data[['meal_type', 'leftover_weight', 'quantity_prepared', 'wastage_percentage']]
     
-    return jsonify({
+    # Meals without a preparation record have no quantity; send null rather than NaN
+    waste_by_meal = waste_by_meal.astype(object).where(waste_by_meal.notna(), None)
+    
+    return {
         'available': True,
         'waste_by_meal': waste_by_meal.to_dict('records'),
-        'total_waste': today_attendance['leftover_weight'].sum()
-    })
+        'total_waste': float(today_attendance['leftover_weight'].sum())
+    }
 
 @analytics_bp.route('/weekly_food_predictions')
 @login_required
@@ -344,40 +320,114 @@ def generate_food_predictions():
 @login_required
 def analysis_dashboard():
     """Display comprehensive analytics dashboard with charts and insights."""
-    # Read data from CSV files
-    students_df = read_csv(STUDENTS_CSV)
-    attendance_df = read_csv(ATTENDANCE_CSV)
-    menu_df = read_csv(MENU_CSV)
-    meal_prep_df = read_csv(MEAL_PREPARATION_CSV)
+    # Chart payloads are precomputed and refreshed in the background when the data changes
+    payload = get_analysis_payload()
     
-    # Check if data is available
-    data_available = not (students_df.empty or attendance_df.empty or meal_prep_df.empty)
-    
-    if not data_available:
+    if not payload['data_available']:
         flash('Insufficient data for analytics dashboard. Please record student attendance and meal preparation data.', 'warning')
         return render_template('analysis_dashboard.html', data_available=False)
     
-    # Process data for different sections
-    attendance_data = process_attendance_data(attendance_df)
-    consumption_data = process_consumption_data(meal_prep_df)
-    prediction_data = process_prediction_data(meal_prep_df, attendance_df)
-    
     # Return all data for rendering in template
     return render_template('analysis_dashboard.html',
-                         data_available=data_available,
-                         attendance_data=json.dumps(attendance_data),
-                         consumption_data=json.dumps(consumption_data),
-                         prediction_data=json.dumps(prediction_data),
+                         data_available=True,
+                         attendance_data=payload['attendance_data'],
+                         consumption_data=payload['consumption_data'],
+                         prediction_data=payload['prediction_data'],
                          meal_types=MEAL_TYPES)
 
+# Sources of the analysis dashboard payload
+ANALYSIS_SOURCES = (STUDENTS_CSV, ATTENDANCE_CSV, MEAL_PREPARATION_CSV)
+
+# Latest materialized payload; refreshed by at most one background thread at a time per process
+_analysis_payload = {'version': None, 'payload': None}
+
+# The latest payload of any worker (or a previous run), shared through the configured backend
+analysis_cache = get_cache('analysis')
+_analysis_refresh_lock = threading.Lock()
+
+def analysis_data_version():
+    """Get the version the analysis payload depends on: its source files and today's date (for the 30-day windows)."""
+    return data_version(*ANALYSIS_SOURCES)
+
+def compute_analysis_payload():
+    """Compute the JSON chart payloads of the analysis dashboard from the CSV files."""
+    version = analysis_data_version()
+    students_df = read_columns(STUDENTS_CSV, ['id'])
+    # The charts cover the last 30 days, so only the months overlapping them are read, and only the columns charted
+    start_date = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
+    attendance_df = read_columns(ATTENDANCE_CSV, ['date', 'meal_type'], start_date)
+    meal_prep_df = read_columns(MEAL_PREPARATION_CSV, ['date', 'meal_type', 'quantity_prepared', 'expected_students',
+                                                       'leftover_weight'], start_date)
+    # Whole-history figures come from the daily rollups
+    rollups = daily_rollups.query()
+    
+    payload = {'data_available': not students_df.empty
+               and any(row['attendance_count'] > 0 for row in rollups)
+               and any(row['preparations'] > 0 for row in rollups)}
+    if payload['data_available']:
+        payload['attendance_data'] = json.dumps(process_attendance_data(attendance_df))
+        payload['consumption_data'] = json.dumps(process_consumption_data(meal_prep_df))
+        payload['prediction_data'] = json.dumps(process_prediction_data(meal_prep_df, weekly_attendance_counts(rollups)))
+    return version, payload
+
+def refresh_analysis_payload():
+    """Recompute the analysis payload and store it in memory and in the shared cache."""
+    version, payload = compute_analysis_payload()
+    _analysis_payload['version'] = version
+    _analysis_payload['payload'] = payload
+    analysis_cache.set('dashboard', {'version': version, 'payload': payload})
+    return payload
+
+def _refresh_in_background():
+    try:
+        refresh_analysis_payload()
+    except Exception as e:
+        logging.error(f"Error refreshing analysis payload: {e}")
+    finally:
+        _analysis_refresh_lock.release()
+
+def schedule_analysis_refresh():
+    """Start recomputing the analysis payload in a background thread, unless one is already running."""
+    if _analysis_refresh_lock.acquire(blocking=False):
+        threading.Thread(target=_refresh_in_background, daemon=True).start()
+
+@subscribe(tables=ANALYSIS_SOURCES)
+def _refresh_analysis_on_write(events):
+    schedule_analysis_refresh()
+
+def get_analysis_payload():
+    """
+    Get the analysis dashboard payload, stale-while-revalidate.
+    
+    A payload matching the current data version is served as is. An outdated
+    one is still served while a background refresh runs. Only when there is
+    no payload at all (not in memory or in the shared cache) is it computed
+    inline.
+    """
+    version = analysis_data_version()
+    if _analysis_payload['version'] != version:
+        # Pick up a payload materialized by another worker or a previous run
+        stored = analysis_cache.get('dashboard')
+        if stored is not None and (_analysis_payload['payload'] is None or stored['version'] == version):
+            _analysis_payload['version'] = stored['version']
+            _analysis_payload['payload'] = stored['payload']
+    
+    payload = _analysis_payload['payload']
+    record_cache('analysis_payload', payload is not None and _analysis_payload['version'] == version)
+    if payload is None:
+        with _analysis_refresh_lock:
+            if _analysis_payload['payload'] is None:
+                refresh_analysis_payload()
+        return _analysis_payload['payload']
+    if _analysis_payload['version'] != version:
+        schedule_analysis_refresh()
+    return payload
+
 def process_attendance_data(attendance_df):
-    """Process attendance data for charts and analysis."""
+    """Process attendance data, as loaded by read_columns(), for charts and analysis."""
     attendance_data = {}
     
     if not attendance_df.empty:
-        # Convert date to datetime
-        attendance_df['date'] = pd.to_datetime(attendance_df['date'])
-        
         # Add day of week
         attendance_df['day_of_week'] = attendance_df['date'].dt.dayofweek
         attendance_df['day_name'] = attendance_df['day_of_week'].apply(lambda x: DAYS_OF_WEEK[x])
@@ -400,7 +450,7 @@ def process_attendance_data(attendance_df):
 
 def process_daily_attendance(recent_attendance):
     """Process daily attendance data for line chart."""
-    daily_attendance = recent_attendance.groupby(['date', 'meal_type']).size().reset_index(name='count')
+    daily_attendance = recent_attendance.groupby(['date', 'meal_type'], observed=True).size().reset_index(name='count')
     attendance_pivot = daily_attendance.pivot(index='date', columns='meal_type', values='count').reset_index()
     attendance_pivot = attendance_pivot.fillna(0)
     
@@ -413,7 +463,7 @@ def process_daily_attendance(recent_attendance):
 
 def process_avg_attendance_by_day(recent_attendance):
     """Process average attendance by day of week for bar chart."""
-    avg_by_day = recent_attendance.groupby(['day_name', 'meal_type']).size().reset_index(name='count')
+    avg_by_day = recent_attendance.groupby(['day_name', 'meal_type'], observed=True).size().reset_index(name='count')
     avg_by_day_pivot = avg_by_day.pivot(index='day_name', columns='meal_type', values='count').reset_index()
     avg_by_day_pivot = avg_by_day_pivot.fillna(0)
     
@@ -430,13 +480,10 @@ def process_avg_attendance_by_day(recent_attendance):
     }
 
 def process_consumption_data(meal_prep_df):
-    """Process meal preparation and consumption data for charts."""
+    """Process meal preparation and consumption data, as loaded by read_columns(), for charts."""
     consumption_data = {}
     
     if not meal_prep_df.empty:
-        # Convert date to datetime
-        meal_prep_df['date'] = pd.to_datetime(meal_prep_df['date'])
-        
         # Add day of week
         meal_prep_df['day_of_week'] = meal_prep_df['date'].dt.dayofweek
         meal_prep_df['day_name'] = meal_prep_df['day_of_week'].apply(lambda x: DAYS_OF_WEEK[x])
@@ -444,7 +491,6 @@ def process_consumption_data(meal_prep_df):
         # Calculate actual consumption
         if 'leftover_weight' in meal_prep_df.columns:
             meal_prep_df['consumed'] = meal_prep_df['quantity_prepared'] - meal_prep_df['leftover_weight']
-            meal_prep_df['meal_type'] = meal_prep_df['meal_name'].apply(extract_meal_type)
             
             # Get last 30 days data
             end_date = datetime.now()
@@ -483,7 +529,7 @@ def process_daily_consumption(recent_prep):
 
 def process_meal_type_consumption(recent_prep):
     """Process meal type consumption data for bar chart."""
-    meal_type_consumption = recent_prep.groupby('meal_type').agg({
+    meal_type_consumption = recent_prep.groupby('meal_type', observed=True).agg({
         'quantity_prepared': 'sum',
         'consumed': 'sum',
         'leftover_weight': 'sum'
@@ -506,14 +552,14 @@ def process_meal_type_consumption(recent_prep):
 
 def process_consumption_heatmap(recent_prep):
     """Process consumption data for heatmap visualization."""
-    day_consumption = recent_prep.groupby(['day_name', 'meal_type']).agg({
+    day_consumption = recent_prep.groupby(['day_name', 'meal_type'], observed=True).agg({
         'consumed': 'mean',
         'quantity_prepared': 'mean',
         'leftover_weight': 'mean'
     }).reset_index()
     
     day_consumption['efficiency'] = (day_consumption['consumed'] / day_consumption['quantity_prepared'] * 100)
-    day_consumption = day_consumption.fillna(0)
+    day_consumption['efficiency'] = day_consumption['efficiency'].fillna(0)
     
     efficiency_pivot = day_consumption.pivot(index='day_name', columns='meal_type', values='efficiency')
     
@@ -541,8 +587,17 @@ def process_consumption_heatmap(recent_prep):
         'heatmap_data': heatmap_data
     }
 
-def process_prediction_data(meal_prep_df, attendance_df):
-    """Process prediction and trend data for charts."""
+def weekly_attendance_counts(rollups):
+    """Get {ISO week number: attendance count} over the whole history, from daily rollup rows."""
+    weeks = {}
+    for row in rollups:
+        if row['attendance_count'] > 0:
+            week = datetime.strptime(row['date'], "%Y-%m-%d").isocalendar()[1]
+            weeks[week] = weeks.get(week, 0) + row['attendance_count']
+    return weeks
+
+def process_prediction_data(meal_prep_df, weekly_attendance):
+    """Process prediction and trend data for charts; weekly_attendance comes from weekly_attendance_counts()."""
     prediction_data = {}
     
     if not meal_prep_df.empty and 'expected_students' in meal_prep_df.columns:
@@ -579,21 +634,8 @@ def process_prediction_data(meal_prep_df, attendance_df):
             prediction_data['consumption_rate_counts'] = hist.tolist()
             
             # Process weekly attendance trends
-            if not attendance_df.empty:
-                attendance_df['week'] = attendance_df['date'].dt.isocalendar().week
-                weekly_attendance = attendance_df.groupby('week').size().reset_index(name='count')
-                
-                prediction_data['weeks'] = weekly_attendance['week'].tolist()
-                prediction_data['weekly_counts'] = weekly_attendance['count'].tolist()
+            if weekly_attendance:
+                prediction_data['weeks'] = sorted(weekly_attendance)
+                prediction_data['weekly_counts'] = [weekly_attendance[week] for week in prediction_data['weeks']]
     
     return prediction_data
-
-def extract_meal_type(meal_name):
-    """Extract meal type from meal name."""
-    if 'Break' in meal_name:
-        return 'Breakfast'
-    elif 'Lunch' in meal_name:
-        return 'Lunch'
-    elif 'Dinner' in meal_name:
-        return 'Dinner'
-    return 'Unknown'
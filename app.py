@@ -3,31 +3,12 @@ import logging
 from datetime import datetime
 from flask import Flask, session, redirect, url_for, render_template
 from werkzeug.middleware.proxy_fix import ProxyFix
-
-# Create and configure the Flask app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "mess_management_secret_key")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
-
-# Import all necessary modules
-from auth import auth_bp
-from student import student_bp
-from menu import menu_bp
-from attendance import attendance_bp
-from analytics import analytics_bp
-
-# Register blueprints
-app.register_blueprint(auth_bp)
-app.register_blueprint(student_bp)
-app.register_blueprint(menu_bp)
-app.register_blueprint(attendance_bp)
-app.register_blueprint(analytics_bp)
-
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+from config import WARM_UP_ON_START
+from metrics import init_metrics
+from events import init_events
+from startup import STARTUP_TIMINGS, startup_phase, log_startup_timings, warm_up
 
 # Home route
-@app.route('/')
 def home():
     # Check if the user is logged in
     username = session.get('username')
@@ -38,20 +19,79 @@ def home():
     return render_template('home.html')
 
 # Error handlers
-@app.errorhandler(404)
 def page_not_found(e):
     return render_template('base.html', error="Page not found", now=datetime.now()), 404
 
-@app.errorhandler(500)
 def internal_server_error(e):
     return render_template('base.html', error="Internal server error", now=datetime.now()), 500
 
 # Add a context processor to make datetime available in all templates
-@app.context_processor
 def inject_now():
     return {'now': datetime.now()}
 
-# Initialize data files on startup
-with app.app_context():
-    from utils import init_data_files
-    init_data_files()
+def create_app(warm=WARM_UP_ON_START):
+    """
+    Create and configure the Flask app.
+
+    Heavy dependencies are imported lazily, so this only wires up routes.
+    Pass warm=True (or set WARM_UP_ON_START=1) to load them before returning.
+    """
+    with startup_phase('create_app'):
+        app = Flask(__name__)
+        app.secret_key = os.environ.get("SESSION_SECRET", "mess_management_secret_key")
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+
+    # Import all necessary modules
+    with startup_phase('import_blueprints'):
+        from auth import auth_bp
+        from student import student_bp
+        from menu import menu_bp
+        from attendance import attendance_bp
+        from analytics import analytics_bp
+        from profiler import profiler_bp
+        from live import live_bp
+        from exports import export_bp
+
+    # Register blueprints
+    with startup_phase('register_routes'):
+        app.register_blueprint(auth_bp)
+        app.register_blueprint(student_bp)
+        app.register_blueprint(menu_bp)
+        app.register_blueprint(attendance_bp)
+        app.register_blueprint(analytics_bp)
+        app.register_blueprint(profiler_bp)
+        app.register_blueprint(live_bp)
+        app.register_blueprint(export_bp)
+
+        app.add_url_rule('/', 'home', home)
+        app.register_error_handler(404, page_not_found)
+        app.register_error_handler(500, internal_server_error)
+        app.context_processor(inject_now)
+        init_metrics(app)
+        init_events(app)
+
+    # Initialize data files on startup
+    with startup_phase('init_data_files'):
+        from utils import init_data_files
+        init_data_files()
+    with startup_phase('run_migrations'):
+        from migrations import run_migrations
+        run_migrations()
+    with startup_phase('flush_journals'):
+        from journal import flush_all
+        flush_all()
+    with startup_phase('compact_partitions'):
+        from partitions import compact_all
+        compact_all()
+
+    if warm:
+        warm_up()
+    log_startup_timings()
+
+    app.config['STARTUP_TIMINGS'] = STARTUP_TIMINGS
+    return app
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+
+app = create_app()
@@ -1,14 +1,27 @@
 import os
-import pandas as pd
+import logging
+import json
+import base64
+import binascii
+from datetime import datetime, timedelta
 from flask import Blueprint, request, render_template, redirect, url_for, flash, session, jsonify
 from utils import (
-    read_csv, write_csv, get_next_id, get_current_date, get_current_time, 
+    read_csv, write_csv, get_current_date, get_current_time, 
     get_current_meal_type, get_current_day_of_week, get_current_day_meal,
-    get_meal_name_from_menu
+    lazy_import, conditional_get, file_lock, partition_key, read_partition
 )
-from config import STUDENTS_CSV, ATTENDANCE_CSV, STUDENT_IMAGES_DIR, MEAL_TYPES
+from config import STUDENTS_CSV, ATTENDANCE_CSV, STUDENT_IMAGES_DIR, MEAL_TYPES, HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE
 from face_recognition_utils import detect_face, recognize_face, decode_base64_image
 from auth import login_required
+from metrics import start_stage_timing, stage_timer
+from aggregates import write_csv_with_changes
+from journal import append_rows, flush_journal_locked
+from history import attendance_index, student_directory
+from rollups import attendance_cube
+from menu_index import get_meal_name_from_menu
+from attendance_bitmap import attendance_bitmap
+
+pd = lazy_import('pandas')
 
 attendance_bp = Blueprint('attendance', __name__)
 
@@ -25,194 +38,218 @@ def take_attendance():
     # Get the corresponding meal name from the menu
     current_meal_name = get_meal_name_from_menu(current_day, current_meal)
     
+    def render_page(**result):
+        with stage_timer('render'):
+            return render_template('attendance.html', 
+                                  meal_types=meal_types, 
+                                  current_meal=current_meal,
+                                  current_day=current_day,
+                                  current_meal_name=current_meal_name,
+                                  **result)
+    
     if request.method == 'POST':
+        start_stage_timing('attendance')
         image_data = request.form.get('image_data')
         meal_type = request.form.get('meal_type', current_meal)
         leftover_weight = request.form.get('leftover_weight', '0')
         
         if not image_data:
             flash('Please capture an image', 'danger')
-            return render_template('attendance.html', 
-                                  meal_types=meal_types, 
-                                  current_meal=current_meal,
-                                  current_day=current_day,
-                                  current_meal_name=current_meal_name)
+            return render_page()
         
         # Try to convert leftover weight to float
         try:
             leftover_weight = float(leftover_weight)
         except ValueError:
             flash('Leftover weight must be a number', 'danger')
-            return render_template('attendance.html', 
-                                  meal_types=meal_types, 
-                                  current_meal=current_meal,
-                                  current_day=current_day,
-                                  current_meal_name=current_meal_name)
+            return render_page()
         
         # Decode base64 image
         img = decode_base64_image(image_data)
         if img is None:
             flash('Error processing the captured image', 'danger')
-            return render_template('attendance.html', 
-                                  meal_types=meal_types, 
-                                  current_meal=current_meal,
-                                  current_day=current_day,
-                                  current_meal_name=current_meal_name)
+            return render_page()
         
         # Detect face in the image
         face_img, face_rect = detect_face(img)
         if face_img is None:
             flash('No face detected in the image. Please try again.', 'danger')
-            return render_template('attendance.html', 
-                                  meal_types=meal_types, 
-                                  current_meal=current_meal,
-                                  current_day=current_day,
-                                  current_meal_name=current_meal_name)
+            return render_page()
         
         # Recognize the face
         student_id = recognize_face(face_img, STUDENT_IMAGES_DIR)
         if not student_id:
             flash('Student not recognized. Please try again or register the student.', 'danger')
-            return render_template('attendance.html', 
-                                  meal_types=meal_types, 
-                                  current_meal=current_meal,
-                                  current_day=current_day,
-                                  current_meal_name=current_meal_name)
+            return render_page()
         
         # Get student information
         students_df = read_csv(STUDENTS_CSV)
         if students_df.empty:
             flash('Error: No students registered in the system', 'danger')
-            return render_template('attendance.html', 
-                                  meal_types=meal_types, 
-                                  current_meal=current_meal,
-                                  current_day=current_day,
-                                  current_meal_name=current_meal_name)
+            return render_page()
         
         student = students_df[students_df['id'] == int(student_id)]
         if student.empty:
             flash('Error: Student not found in the database', 'danger')
-            return render_template('attendance.html', 
-                                  meal_types=meal_types, 
-                                  current_meal=current_meal,
-                                  current_day=current_day,
-                                  current_meal_name=current_meal_name)
+            return render_page()
         
         student_name = student.iloc[0]['name']
         student_roll = student.iloc[0]['roll_number']
         
-        # Read attendance data
-        attendance_df = read_csv(ATTENDANCE_CSV)
-        
-        # Check if student already attended this meal today
+        # Check, insert or update under the file lock, so two workers cannot record the same meal twice
         today = get_current_date()
-        if not attendance_df.empty:
-            existing_attendance = attendance_df[
-                (attendance_df['student_id'] == int(student_id)) & 
-                (attendance_df['date'] == today) & 
-                (attendance_df['meal_type'] == meal_type)
-            ]
+        with file_lock(ATTENDANCE_CSV):
+            existing_id = attendance_index.find(int(student_id), today, meal_type)
             
-            if not existing_attendance.empty:
+            if existing_id is not None:
+                # Only this month's partition is read and written back, once the record is flushed into it
+                flush_journal_locked(ATTENDANCE_CSV)
+                month = partition_key(today)
+                attendance_df = read_partition(ATTENDANCE_CSV, month)
+                matches = attendance_df.index[attendance_df['id'] == existing_id] if not attendance_df.empty else []
+                if len(matches) == 0:
+                    # The index was behind a delete: the meal is not recorded, so record it as new
+                    logging.error(f"Attendance record {existing_id} not found in {month}, recording a new one")
+                    existing_id = None
+            
+            if existing_id is not None:
                 flash(f'{student_name} already attended {meal_type} today. Updating leftover weight.', 'warning')
                 
                 # Update leftover weight
-                idx = existing_attendance.index[0]
+                idx = matches[0]
+                before = attendance_df.loc[idx].to_dict()
                 attendance_df.at[idx, 'leftover_weight'] = leftover_weight
                 
-                if write_csv(attendance_df, ATTENDANCE_CSV):
-                    flash(f'Updated leftover weight for {student_name}', 'success')
-                else:
-                    flash('Error updating attendance record', 'danger')
+                after = attendance_df.loc[idx].to_dict()
+                updated = write_csv_with_changes(attendance_df, ATTENDANCE_CSV, [(before, after)], month)
+            else:
+                # Create new attendance record
+                new_attendance = {
+                    'id': attendance_index.next_id(),
+                    'student_id': int(student_id),
+                    'date': today,
+                    'time': get_current_time(),
+                    'meal_type': meal_type,
+                    'leftover_weight': leftover_weight
+                }
                 
-                return render_template('attendance.html', 
-                                      meal_types=meal_types, 
-                                      current_meal=current_meal,
-                                      current_day=current_day,
-                                      current_meal_name=current_meal_name,
-                                      student_name=student_name, 
-                                      student_roll=student_roll)
-        
-        # Create new attendance record
-        attendance_id = get_next_id(ATTENDANCE_CSV)
-        current_time = get_current_time()
-        
-        new_attendance = {
-            'id': attendance_id,
-            'student_id': int(student_id),
-            'date': today,
-            'time': current_time,
-            'meal_type': meal_type,
-            'leftover_weight': leftover_weight
-        }
-        
-        # Add to dataframe
-        if attendance_df.empty:
-            attendance_df = pd.DataFrame([new_attendance])
-        else:
-            attendance_df = pd.concat([attendance_df, pd.DataFrame([new_attendance])], ignore_index=True)
+                # Acknowledged once it is in the journal; the flusher moves it into this month's partition
+                recorded = append_rows(ATTENDANCE_CSV, [new_attendance])
         
-        # Save to CSV
-        if write_csv(attendance_df, ATTENDANCE_CSV):
+        if existing_id is not None:
+            if updated:
+                flash(f'Updated leftover weight for {student_name}', 'success')
+            else:
+                flash('Error updating attendance record', 'danger')
+        elif recorded:
             flash(f'Attendance recorded for {student_name} ({student_roll}) for {meal_type}', 'success')
         else:
             flash('Error recording attendance', 'danger')
         
-        return render_template('attendance.html', 
-                              meal_types=meal_types, 
-                              current_meal=current_meal,
-                              current_day=current_day,
-                              current_meal_name=current_meal_name,
-                              student_name=student_name, 
-                              student_roll=student_roll)
+        return render_page(student_name=student_name, student_roll=student_roll)
     
-    return render_template('attendance.html', 
-                          meal_types=meal_types, 
-                          current_meal=current_meal,
-                          current_day=current_day,
-                          current_meal_name=current_meal_name)
+    return render_page()
 
 @attendance_bp.route('/attendance/history')
 @login_required
 def attendance_history():
-    """View attendance history."""
-    attendance_df = read_csv(ATTENDANCE_CSV)
-    students_df = read_csv(STUDENTS_CSV)
-    
-    if attendance_df.empty or students_df.empty:
-        return render_template('attendance_history.html', attendance_records=[])
-    
-    # Join attendance with student information
-    merged_df = pd.merge(
-        attendance_df,
-        students_df[['id', 'name', 'roll_number']],
-        left_on='student_id',
-        right_on='id',
-        suffixes=('', '_student')
-    )
+    """View attendance history; only the first page is rendered, the table loads the rest from the API."""
+    try:
+        filters = history_filters(request.args)
+    except ValueError:
+        flash('Invalid filter values', 'danger')
+        return redirect(url_for('attendance.attendance_history'))
     
-    # Sort by date and time (newest first)
-    merged_df = merged_df.sort_values(by=['date', 'time'], ascending=[False, False])
+    records, next_cursor, total = history_page(filters, HISTORY_PAGE_SIZE)
     
-    attendance_records = merged_df.to_dict('records')
+    return render_template('attendance_history.html',
+                          attendance_records=records,
+                          next_cursor=next_cursor,
+                          total_records=total,
+                          all_records=attendance_index.count(),
+                          filters=filters,
+                          students=student_directory.all(),
+                          meal_types=MEAL_TYPES,
+                          page_size=HISTORY_PAGE_SIZE)
+
+@attendance_bp.route('/api/attendance/history')
+@login_required
+@conditional_get(ATTENDANCE_CSV, STUDENTS_CSV)
+def attendance_history_data():
+    """API endpoint for one page of attendance history, newest first, continuing after ?cursor=."""
+    try:
+        filters = history_filters(request.args)
+        limit = min(int(request.args.get('limit', HISTORY_PAGE_SIZE)), HISTORY_MAX_PAGE_SIZE)
+        cursor = decode_cursor(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'error': 'Invalid filter, limit or cursor'}), 400
     
-    return render_template('attendance_history.html', attendance_records=attendance_records)
+    records, next_cursor, total = history_page(filters, max(1, limit), cursor)
+    return jsonify({
+        'records': records,
+        'next_cursor': next_cursor,
+        'total': total
+    })
+
+def history_filters(args):
+    """Read the date range, meal type and student filters of the history page; raise ValueError if invalid."""
+    filters = {
+        'start_date': args.get('from_date') or None,
+        'end_date': args.get('to_date') or None,
+        'meal_type': args.get('meal_type') or None,
+        'student_id': int(args['student_id']) if args.get('student_id') else None,
+    }
+    for date in (filters['start_date'], filters['end_date']):
+        if date:
+            datetime.strptime(date, "%Y-%m-%d")
+    if filters['meal_type'] and filters['meal_type'] not in MEAL_TYPES:
+        raise ValueError(filters['meal_type'])
+    return filters
+
+def history_page(filters, limit, cursor=None):
+    """Get a page of attendance history with student names, and the cursor of the next page."""
+    rows, next_cursor, total = attendance_index.page(limit, cursor, **filters)
+    for row in rows:
+        row['name'], row['roll_number'] = student_directory.lookup(row['student_id']) or ('Unknown', '')
+    return rows, encode_cursor(next_cursor), total
+
+def encode_cursor(key):
+    """Encode a (date, time, id) history key as an opaque cursor string."""
+    if key is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_cursor(cursor):
+    """Decode a cursor from encode_cursor(); raise ValueError if it is malformed."""
+    if not cursor:
+        return None
+    try:
+        date, time, attendance_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (str(date), str(time), int(attendance_id))
+    except (TypeError, ValueError, binascii.Error) as e:
+        raise ValueError(cursor) from e
 
 @attendance_bp.route('/attendance/delete/<int:attendance_id>', methods=['POST'])
 @login_required
 def delete_attendance(attendance_id):
     """Delete an attendance record."""
-    attendance_df = read_csv(ATTENDANCE_CSV)
-    
-    if attendance_df.empty:
-        flash('No attendance records found', 'danger')
-        return redirect(url_for('attendance.attendance_history'))
-    
-    # Remove the record
-    attendance_df = attendance_df[attendance_df['id'] != attendance_id]
+    with file_lock(ATTENDANCE_CSV):
+        record = attendance_index.get(attendance_id)
+        if record is None:
+            flash('Attendance record not found', 'danger')
+            return redirect(url_for('attendance.attendance_history'))
+        
+        # Remove the record from the partition of its month
+        flush_journal_locked(ATTENDANCE_CSV)
+        month = partition_key(record['date'])
+        attendance_df = read_partition(ATTENDANCE_CSV, month)
+        removed = attendance_df[attendance_df['id'] == attendance_id].to_dict('records')
+        attendance_df = attendance_df[attendance_df['id'] != attendance_id]
+        
+        # Save the updated dataframe
+        deleted = write_csv_with_changes(attendance_df, ATTENDANCE_CSV, [(row, None) for row in removed], month)
     
-    # Save the updated dataframe
-    if write_csv(attendance_df, ATTENDANCE_CSV):
+    if deleted:
         flash('Attendance record deleted successfully', 'success')
     else:
         flash('Error deleting attendance record', 'danger')
@@ -222,36 +259,80 @@ def delete_attendance(attendance_id):
 @attendance_bp.route('/attendance/report')
 @login_required
 def attendance_report():
-    """Generate attendance report."""
-    attendance_df = read_csv(ATTENDANCE_CSV)
-    students_df = read_csv(STUDENTS_CSV)
-    
-    if attendance_df.empty or students_df.empty:
-        return render_template('attendance_report.html', daily_stats=[], student_stats=[])
-    
+    """Generate attendance report from the attendance rollup cube."""
     # Get date range for filtering
     from_date = request.args.get('from_date', get_current_date())
     to_date = request.args.get('to_date', get_current_date())
-    
-    # Filter by date range
-    filtered_df = attendance_df[(attendance_df['date'] >= from_date) & (attendance_df['date'] <= to_date)]
+    try:
+        datetime.strptime(from_date, "%Y-%m-%d")
+        datetime.strptime(to_date, "%Y-%m-%d")
+    except ValueError:
+        flash('Dates must be in YYYY-MM-DD format', 'danger')
+        return redirect(url_for('attendance.attendance_report'))
     
     # Daily statistics
-    daily_stats = filtered_df.groupby(['date', 'meal_type']).size().reset_index(name='count')
-    daily_stats = daily_stats.sort_values(['date', 'meal_type'])
+    daily_stats = [
+        {'date': date, 'meal_type': meal_type, 'count': count, 'leftover_weight': round(leftover, 2)}
+        for date, meal_type, count, leftover in attendance_cube.daily(from_date, to_date)
+    ]
+    
+    # Meal type totals over the whole range
+    meal_stats = [
+        {'meal_type': meal_type, 'count': count, 'leftover_weight': round(leftover, 2)}
+        for meal_type, (count, leftover) in sorted(attendance_cube.totals(from_date, to_date, 'meal_type').items())
+    ]
     
     # Student statistics
-    student_stats = filtered_df.groupby('student_id').size().reset_index(name='attendance_count')
-    student_stats = pd.merge(
-        student_stats,
-        students_df[['id', 'name', 'roll_number']],
-        left_on='student_id',
-        right_on='id'
-    )
-    student_stats = student_stats.sort_values('attendance_count', ascending=False)
+    student_stats = []
+    for student_id, (count, leftover) in attendance_cube.totals(from_date, to_date, 'student_id').items():
+        student = student_directory.lookup(student_id)
+        if student is not None:
+            student_stats.append({'student_id': student_id, 'name': student[0], 'roll_number': student[1],
+                                  'attendance_count': count, 'leftover_weight': round(leftover, 2)})
+    student_stats.sort(key=lambda stat: stat['attendance_count'], reverse=True)
+    
+    # Students who missed every meal in the range
+    students = student_directory.all()
+    absent = set(attendance_bitmap.students_where(from_date, to_date, [student[0] for student in students]))
+    absent_students = [{'student_id': student_id, 'name': name, 'roll_number': roll_number}
+                       for student_id, name, roll_number in students if student_id in absent]
     
     return render_template('attendance_report.html', 
-                          daily_stats=daily_stats.to_dict('records'),
-                          student_stats=student_stats.to_dict('records'),
+                          daily_stats=daily_stats,
+                          meal_stats=meal_stats,
+                          student_stats=student_stats,
+                          absent_students=absent_students,
                           from_date=from_date,
                           to_date=to_date)
+
+@attendance_bp.route('/api/attendance/calendar/<int:student_id>')
+@login_required
+@conditional_get(ATTENDANCE_CSV)
+def attendance_calendar(student_id):
+    """API endpoint for the meals a student attended per day over ?from_date..?to_date (default: last 30 days)."""
+    today = datetime.strptime(get_current_date(), "%Y-%m-%d")
+    to_date = request.args.get('to_date', today.strftime("%Y-%m-%d"))
+    from_date = request.args.get('from_date', (today - timedelta(days=29)).strftime("%Y-%m-%d"))
+    try:
+        start = datetime.strptime(from_date, "%Y-%m-%d")
+        end = datetime.strptime(to_date, "%Y-%m-%d")
+    except ValueError:
+        return jsonify({'error': 'Dates must be in YYYY-MM-DD format'}), 400
+    if end < start or (end - start).days >= 366:
+        return jsonify({'error': 'Date range must be between 1 and 366 days'}), 400
+    
+    calendar = attendance_bitmap.calendar(student_id, from_date, to_date)
+    current_streak, longest_streak = attendance_bitmap.streaks(student_id, from_date, to_date)
+    return jsonify({
+        'student_id': student_id,
+        'from_date': from_date,
+        'to_date': to_date,
+        'meal_types': MEAL_TYPES,
+        'days': [
+            {'date': (start + timedelta(days=day)).strftime("%Y-%m-%d"), 'meals': [bool(meal) for meal in meals]}
+            for day, meals in enumerate(calendar)
+        ],
+        'meals_attended': int(calendar.sum()),
+        'current_streak': current_streak,
+        'longest_streak': longest_streak
+    })
@@ -0,0 +1,208 @@
+from datetime import datetime, timedelta
+from aggregates import FileAggregate
+from utils import read_csv, lazy_import
+from config import ATTENDANCE_CSV, MEAL_TYPES
+
+np = lazy_import('numpy')
+
+SLOTS_PER_DAY = len(MEAL_TYPES)
+
+# Days are added in blocks of 8 so that a block is a whole number of bytes
+DAY_BLOCK = 8
+
+def parse_date(date):
+    return datetime.strptime(date, "%Y-%m-%d").date()
+
+class AttendanceBitmap(FileAggregate):
+    """
+    One bit per (student, date, meal type) slot: set if the student attended that meal.
+
+    Bits are packed per student row (day by day, MEAL_TYPES order within a
+    day), so a year for 5,000 students takes about 0.7 MB. Queries unpack
+    only the days they ask for and work on whole NumPy arrays.
+    """
+    sources = (ATTENDANCE_CSV,)
+
+    def __init__(self):
+        super().__init__()
+        self.origin = None
+        self.days = 0
+        self.rows = {}
+        self.student_ids = []
+        self.bits = None
+
+    def _reset(self, origin, days, students):
+        self.origin = origin
+        self.days = -(-max(days, DAY_BLOCK) // DAY_BLOCK) * DAY_BLOCK
+        self.rows = {}
+        self.student_ids = []
+        self.bits = np.zeros((max(students, 16), self.days * SLOTS_PER_DAY // 8), dtype=np.uint8)
+
+    def _day_index(self, date, grow=False):
+        """Get the column of a date, growing the bitmap to include it if grow is set; None if outside."""
+        day = (parse_date(date) - self.origin).days
+        if 0 <= day < self.days:
+            return day
+        if not grow:
+            return None
+        if day < 0:
+            # Prepend whole blocks of days and move the origin back
+            blocks = -(-(-day) // DAY_BLOCK)
+            padding = np.zeros((self.bits.shape[0], blocks * DAY_BLOCK * SLOTS_PER_DAY // 8), dtype=np.uint8)
+            self.bits = np.hstack([padding, self.bits])
+            self.origin -= timedelta(days=blocks * DAY_BLOCK)
+            self.days += blocks * DAY_BLOCK
+            return day + blocks * DAY_BLOCK
+        days = max(self.days * 2, -(-(day + 1) // DAY_BLOCK) * DAY_BLOCK)
+        padding = np.zeros((self.bits.shape[0], (days - self.days) * SLOTS_PER_DAY // 8), dtype=np.uint8)
+        self.bits = np.hstack([self.bits, padding])
+        self.days = days
+        return day
+
+    def _row(self, student_id, grow=False):
+        row = self.rows.get(student_id)
+        if row is None and grow:
+            row = self.rows[student_id] = len(self.student_ids)
+            self.student_ids.append(student_id)
+            if row >= self.bits.shape[0]:
+                self.bits = np.vstack([self.bits, np.zeros_like(self.bits)])
+        return row
+
+    def rebuild(self):
+        attendance_df = read_csv(ATTENDANCE_CSV)
+        if attendance_df.empty:
+            self._reset(datetime.now().date(), DAY_BLOCK, 16)
+            return
+        attendance_df = attendance_df[attendance_df['meal_type'].isin(MEAL_TYPES)]
+        dates = attendance_df['date'].map(parse_date)
+        origin = dates.min()
+        days = (dates.max() - origin).days + 1
+        student_ids = attendance_df['student_id'].astype(int)
+        self._reset(origin, days, student_ids.nunique())
+
+        for student_id in student_ids.unique():
+            self._row(int(student_id), grow=True)
+        rows = student_ids.map(self.rows).to_numpy()
+        slots = (dates.map(lambda date: (date - origin).days).to_numpy() * SLOTS_PER_DAY
+                 + attendance_df['meal_type'].map(MEAL_TYPES.index).to_numpy())
+        np.bitwise_or.at(self.bits, (rows, slots >> 3), (0x80 >> (slots & 7)).astype(np.uint8))
+
+    def apply(self, file_path, before, after):
+        for row, value in ((before, False), (after, True)):
+            if row is None or row['meal_type'] not in MEAL_TYPES:
+                continue
+            if self.bits is None:
+                self._reset(parse_date(row['date']), DAY_BLOCK, 16)
+            student_row = self._row(int(row['student_id']), grow=True)
+            slot = self._day_index(row['date'], grow=True) * SLOTS_PER_DAY + MEAL_TYPES.index(row['meal_type'])
+            mask = np.uint8(0x80 >> (slot & 7))
+            if value:
+                self.bits[student_row, slot >> 3] |= mask
+            else:
+                self.bits[student_row, slot >> 3] &= ~mask
+
+    def _slots(self, start_date, end_date, rows):
+        """Unpack the bits of some student rows over a date range into a (students, days, meals) bool array."""
+        start = parse_date(start_date)
+        days = (parse_date(end_date) - start).days + 1
+        result = np.zeros((len(rows), max(days, 0), SLOTS_PER_DAY), dtype=bool)
+        if days <= 0 or self.bits is None:
+            return result
+        # Part of the range the bitmap covers
+        first = max(0, (start - self.origin).days)
+        last = min(self.days - 1, (start - self.origin).days + days - 1)
+        if first > last:
+            return result
+        first_bit, end_bit = first * SLOTS_PER_DAY, (last + 1) * SLOTS_PER_DAY
+        unpacked = np.unpackbits(self.bits[np.asarray(rows, dtype=int), first_bit >> 3:-(-end_bit // 8)], axis=1)
+        offset = first_bit - (first_bit >> 3) * 8
+        covered = unpacked[:, offset:offset + end_bit - first_bit].reshape(len(rows), last - first + 1, SLOTS_PER_DAY)
+        skip = first - (start - self.origin).days
+        result[:, skip:skip + covered.shape[1]] = covered
+        return result
+
+    def attended(self, student_id, date, meal_type):
+        """Check whether a student attended one meal."""
+        self.ensure_current()
+        with self._lock:
+            row = self._row(student_id)
+            day = self._day_index(date) if self.bits is not None else None
+            if row is None or day is None or meal_type not in MEAL_TYPES:
+                return False
+            slot = day * SLOTS_PER_DAY + MEAL_TYPES.index(meal_type)
+            return bool(self.bits[row, slot >> 3] & (0x80 >> (slot & 7)))
+
+    def calendar(self, student_id, start_date, end_date):
+        """Get a (days, meals) bool array of the meals a student attended in a date range."""
+        self.ensure_current()
+        with self._lock:
+            row = self._row(student_id)
+            # A student who never attended gets an all-False calendar (row 0 of a zero-filled result)
+            slots = self._slots(start_date, end_date, [row] if row is not None else [])
+            return slots[0] if row is not None else np.zeros(slots.shape[1:], dtype=bool)
+
+    def headcounts(self, start_date, end_date):
+        """Get a (days, meals) int array with the number of students per meal slot in a date range."""
+        self.ensure_current()
+        with self._lock:
+            return self._slots(start_date, end_date, range(len(self.student_ids))).sum(axis=0)
+
+    def students_where(self, start_date, end_date, student_ids=None, meal_types=None, attended='none'):
+        """
+        Select students by their attendance over a date range.
+
+        Args:
+            student_ids: Students to consider (default: every student in the bitmap)
+            meal_types: Meal types to consider (default: all)
+            attended: 'none' for students who attended none of those meals,
+                      'any' for at least one, 'all' for every one of them
+
+        Returns:
+            List of matching student ids
+        """
+        self.ensure_current()
+        with self._lock:
+            candidates = list(self.student_ids) if student_ids is None else list(student_ids)
+            # Students without any attendance have no row; they count as having attended nothing
+            known = [student_id for student_id in candidates if student_id in self.rows]
+            slots = self._slots(start_date, end_date, [self.rows[student_id] for student_id in known])
+        if meal_types:
+            slots = slots[:, :, [MEAL_TYPES.index(meal_type) for meal_type in meal_types]]
+        # Explicit width: -1 cannot be inferred when no candidate has attended anything
+        flat = slots.reshape(len(known), slots.shape[1] * slots.shape[2])
+        if attended == 'any':
+            matches = flat.any(axis=1)
+        elif attended == 'all':
+            matches = flat.all(axis=1) if flat.shape[1] else np.zeros(len(known), dtype=bool)
+        else:
+            matches = ~flat.any(axis=1)
+        selected = {student_id for student_id, match in zip(known, matches) if match}
+        if attended == 'none':
+            selected |= {student_id for student_id in candidates if student_id not in self.rows}
+        return [student_id for student_id in candidates if student_id in selected]
+
+    def combine(self, student_ids, start_date, end_date, operation='and'):
+        """Get the (days, meals) slots attended by all ('and') or any ('or') of several students."""
+        self.ensure_current()
+        with self._lock:
+            rows = [self.rows[student_id] for student_id in student_ids if student_id in self.rows]
+            slots = self._slots(start_date, end_date, rows)
+        if operation == 'or':
+            return slots.any(axis=0)
+        if len(rows) < len(student_ids):
+            # A student who never attended shares no slot with anyone
+            return np.zeros(slots.shape[1:], dtype=bool)
+        return slots.all(axis=0)
+
+    def streaks(self, student_id, start_date, end_date):
+        """Get (current, longest) runs of consecutive days with at least one meal in a date range."""
+        days = self.calendar(student_id, start_date, end_date).any(axis=1)
+        if not days.any():
+            return 0, 0
+        # Run lengths of the True stretches, from the positions where the value changes
+        edges = np.flatnonzero(np.diff(np.concatenate([[False], days, [False]]).astype(np.int8)))
+        lengths = edges[1::2] - edges[::2]
+        current = int(lengths[-1]) if days[-1] else 0
+        return current, int(lengths.max())
+
+attendance_bitmap = AttendanceBitmap()
@@ -3,7 +3,7 @@ import os
 from flask import Blueprint, request, render_template, redirect, url_for, session, flash
 from werkzeug.security import generate_password_hash, check_password_hash
 from config import USERS_CSV
-from utils import read_csv, write_csv
+from utils import read_csv, write_csv, file_lock
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -69,25 +69,26 @@ def change_password():
             flash('New passwords do not match', 'danger')
             return render_template('change_password.html')
         
-        # Read users from CSV
-        users_df = read_csv(USERS_CSV)
-        
-        # Find the user
-        user_idx = users_df.index[users_df['username'] == session['username']].tolist()
-        
-        if not user_idx or not check_password_hash(users_df.iloc[user_idx[0]]['password'], current_password):
-            flash('Current password is incorrect', 'danger')
-            return render_template('change_password.html')
-        
-        # Update password
-        users_df.at[user_idx[0], 'password'] = generate_password_hash(new_password)
-        
-        # Write updated data back to CSV
-        if write_csv(users_df, USERS_CSV):
-            flash('Password changed successfully', 'success')
-            return redirect(url_for('analytics.dashboard'))
-        else:
-            flash('Error changing password', 'danger')
+        with file_lock(USERS_CSV):
+            # Read users from CSV
+            users_df = read_csv(USERS_CSV)
+            
+            # Find the user
+            user_idx = users_df.index[users_df['username'] == session['username']].tolist()
+            
+            if not user_idx or not check_password_hash(users_df.iloc[user_idx[0]]['password'], current_password):
+                flash('Current password is incorrect', 'danger')
+                return render_template('change_password.html')
+            
+            # Update password
+            users_df.at[user_idx[0], 'password'] = generate_password_hash(new_password)
+            
+            # Write updated data back to CSV
+            if write_csv(users_df, USERS_CSV):
+                flash('Password changed successfully', 'success')
+                return redirect(url_for('analytics.dashboard'))
+            else:
+                flash('Error changing password', 'danger')
     
     return render_template('change_password.html')
 
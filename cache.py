@@ -0,0 +1,415 @@
+"""
+Namespaced caches with pluggable backends.
+
+get_cache(namespace) returns the Cache of a namespace, e.g. 'tables' or
+'analysis'. Its backend is set in config.CACHE_NAMESPACES, defaulting to
+config.CACHE_BACKEND:
+
+- 'lru': a dict in each process, dropping the least recently used entries
+  past the namespace's max_entries or max_bytes;
+- 'sqlite': a SQLite database in data/cache, shared by the gunicorn workers
+  of one host and kept under CACHE_MAX_BYTES;
+- 'redis': a Redis server, or anything speaking its protocol, shared by
+  several hosts. The server's maxmemory policy evicts its entries.
+
+Every entry is stored with a version, e.g. the signature of the files it was
+computed from, and get() with any other version is a miss, so callers never
+have to invalidate. Entries may also expire after the namespace's ttl. The
+shared backends pickle values. A backend that fails (Redis down, a locked
+database) logs the error and answers a miss, so the caller recomputes.
+
+Lookups count in cache_requests_total, entries dropped for room or expired in
+cache_evictions_total and backend failures in cache_errors_total, all by
+namespace.
+
+Usage:
+    python cache.py stats                      # entries and bytes per namespace
+    python cache.py clear [--namespace NAME]   # drop the entries of one or every namespace
+"""
+import os
+import time
+import pickle
+import socket
+import sqlite3
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+from metrics import inc_counter, record_cache, register_metric
+from startup import register_after_fork
+from config import (CACHE_BACKEND, CACHE_NAMESPACES, CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_SQLITE_PATH,
+                    CACHE_REDIS_URL, CACHE_REDIS_TIMEOUT, CACHE_KEY_PREFIX)
+
+register_metric('cache_evictions_total', 'counter', 'Cache entries dropped for room or expired, by namespace and reason')
+register_metric('cache_errors_total', 'counter', 'Cache backend failures, answered as misses, by namespace and operation')
+
+# Returned by backends for a missing entry, since None is a valid value
+MISSING = object()
+
+def record_eviction(namespace, reason, count=1):
+    inc_counter('cache_evictions_total', {'namespace': namespace, 'reason': reason}, count)
+
+def value_size(value):
+    """Estimate the bytes a value takes: the memory of a frame or array, the pickled size of anything else."""
+    if hasattr(value, 'memory_usage'):
+        return int(value.memory_usage(deep=True).sum())
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    try:
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return 0
+
+class LRUBackend:
+    """The entries of one namespace in this process, least recently used first."""
+
+    def __init__(self, namespace, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> (entry, size, expiry time or None)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        register_after_fork(self._reset_lock)
+
+    def _reset_lock(self):
+        # The master may have forked while one of its threads held the lock
+        self._lock = threading.Lock()
+
+    def _drop(self, key):
+        self._bytes -= self._entries.pop(key)[1]
+
+    def get(self, namespace, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return MISSING
+            if item[2] is not None and item[2] <= time.time():
+                self._drop(key)
+                record_eviction(namespace, 'expired')
+                return MISSING
+            self._entries.move_to_end(key)
+            return item[0]
+
+    def set(self, namespace, key, entry, ttl):
+        size = value_size(entry[1])
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (entry, size, time.time() + ttl if ttl else None)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                record_eviction(namespace, 'size')
+
+    def delete(self, namespace, key):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def clear(self, namespace=None):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Get {namespace: (entries, bytes)}."""
+        with self._lock:
+            return {self.namespace: (len(self._entries), self._bytes)}
+
+class SQLiteBackend:
+    """The entries of every shared namespace in one SQLite database, for the processes of one host."""
+
+    def __init__(self, path=CACHE_SQLITE_PATH, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        register_after_fork(self._forget_connections)
+
+    def _forget_connections(self):
+        # A connection inherited from the master must not be used by a worker
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            # Readers never wait for a writer, and commits are not fsynced: losing the last entries only costs misses
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS entries (namespace TEXT, key TEXT, value BLOB, size INTEGER, '
+                               'expires REAL, used REAL, PRIMARY KEY (namespace, key))')
+            self._local.connection = connection
+        return connection
+
+    def get(self, namespace, key):
+        connection = self._connection()
+        row = connection.execute('SELECT value, expires, used FROM entries WHERE namespace = ? AND key = ?',
+                                 (namespace, key)).fetchone()
+        if row is None:
+            return MISSING
+        now = time.time()
+        if row[1] is not None and row[1] <= now:
+            connection.execute('DELETE FROM entries WHERE namespace = ? AND key = ? AND expires <= ?', (namespace, key, now))
+            record_eviction(namespace, 'expired')
+            return MISSING
+        if now - row[2] > 1:
+            # Recency only needs to be rough, so a hot entry is not written on every hit
+            connection.execute('UPDATE entries SET used = ? WHERE namespace = ? AND key = ?', (now, namespace, key))
+        return pickle.loads(row[0])
+
+    def set(self, namespace, key, entry, ttl):
+        value = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                               (namespace, key, value, len(value), now + ttl if ttl else None, now))
+            total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total > self.max_bytes:
+                self._evict(connection, total, now)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def _evict(self, connection, total, now):
+        """Drop expired entries, then the least recently used ones, until the database is back under max_bytes."""
+        for namespace, count, size in connection.execute(
+                'SELECT namespace, COUNT(*), SUM(size) FROM entries WHERE expires <= ? GROUP BY namespace', (now,)).fetchall():
+            record_eviction(namespace, 'expired', count)
+            total -= size
+        connection.execute('DELETE FROM entries WHERE expires <= ?', (now,))
+        for namespace, key, size in connection.execute('SELECT namespace, key, size FROM entries ORDER BY used').fetchall():
+            if total <= self.max_bytes:
+                break
+            connection.execute('DELETE FROM entries WHERE namespace = ? AND key = ?', (namespace, key))
+            record_eviction(namespace, 'size')
+            total -= size
+
+    def delete(self, namespace, key):
+        self._connection().execute('DELETE FROM entries WHERE namespace = ? AND key = ?', (namespace, key))
+
+    def clear(self, namespace=None):
+        if namespace is None:
+            self._connection().execute('DELETE FROM entries')
+        else:
+            self._connection().execute('DELETE FROM entries WHERE namespace = ?', (namespace,))
+
+    def stats(self):
+        rows = self._connection().execute('SELECT namespace, COUNT(*), SUM(size) FROM entries GROUP BY namespace')
+        return {namespace: (count, size) for namespace, count, size in rows}
+
+class RedisError(Exception):
+    """An error reply from the Redis server."""
+
+class RedisBackend:
+    """
+    The entries of every shared namespace on a Redis server, for several hosts.
+
+    Speaks the Redis protocol (RESP) itself over one connection per thread,
+    using only GET, SET (with PX), DEL and SCAN, plus AUTH and SELECT when the
+    URL has credentials or a database, so any server implementing those works.
+    """
+
+    def __init__(self, url=CACHE_REDIS_URL, timeout=CACHE_REDIS_TIMEOUT):
+        parsed = urlparse(url)
+        self.address = (parsed.hostname or 'localhost', parsed.port or 6379)
+        self.username = parsed.username
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+        register_after_fork(self._forget_connections)
+
+    def _forget_connections(self):
+        # A socket inherited from the master would interleave the replies of several workers
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            sock = socket.create_connection(self.address, self.timeout)
+            connection = self._local.connection = (sock, sock.makefile('rb'))
+            if self.password:
+                # AUTH with a username needs an ACL user (Redis 6 and later)
+                self.command('AUTH', *([self.username] if self.username else []), self.password)
+            if self.db:
+                self.command('SELECT', self.db)
+        return connection
+
+    def command(self, *args):
+        """Send one command and return its reply; the connection is dropped if it fails, so the next command reconnects."""
+        sock, reader = self._connection()
+        request = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            request.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        try:
+            sock.sendall(b''.join(request))
+            return self._read_reply(reader)
+        except (OSError, ValueError):
+            self._local.connection = None
+            sock.close()
+            raise
+
+    def _read_reply(self, reader):
+        line = reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError("Connection closed by the Redis server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            raise RedisError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError("Connection closed by the Redis server")
+            return data[:-2]
+        if kind == b'*':
+            length = int(rest)
+            return None if length < 0 else [self._read_reply(reader) for _ in range(length)]
+        raise ValueError(f"Unexpected reply from the Redis server: {line!r}")
+
+    def _key(self, namespace, key):
+        return f"{CACHE_KEY_PREFIX}{namespace}:{key}"
+
+    def _scan(self, pattern):
+        """Yield the keys matching a pattern, a batch at a time."""
+        cursor = b'0'
+        while True:
+            cursor, keys = self.command('SCAN', cursor, 'MATCH', pattern, 'COUNT', 500)
+            if keys:
+                yield keys
+            if cursor == b'0':
+                return
+
+    def get(self, namespace, key):
+        value = self.command('GET', self._key(namespace, key))
+        return MISSING if value is None else pickle.loads(value)
+
+    def set(self, namespace, key, entry, ttl):
+        expiry = ['PX', int(ttl * 1000)] if ttl else []
+        self.command('SET', self._key(namespace, key), pickle.dumps(entry, pickle.HIGHEST_PROTOCOL), *expiry)
+
+    def delete(self, namespace, key):
+        self.command('DEL', self._key(namespace, key))
+
+    def clear(self, namespace=None):
+        for keys in self._scan(CACHE_KEY_PREFIX + (f"{namespace}:" if namespace else '') + '*'):
+            self.command('DEL', *keys)
+
+    def stats(self):
+        stats = {}
+        for keys in self._scan(CACHE_KEY_PREFIX + '*'):
+            for key in keys:
+                namespace = key.decode()[len(CACHE_KEY_PREFIX):].split(':', 1)[0]
+                count, size = stats.get(namespace, (0, 0))
+                value = self.command('GET', key)
+                stats[namespace] = (count + 1, size + (len(value) if value is not None else 0))
+        return stats
+
+class Cache:
+    """The entries of one namespace, on its configured backend."""
+
+    def __init__(self, namespace, backend, ttl=None):
+        self.namespace = namespace
+        self.backend = backend
+        self.ttl = ttl
+
+    def _failed(self, operation, error):
+        inc_counter('cache_errors_total', {'namespace': self.namespace, 'operation': operation})
+        logging.error(f"Error in cache {self.namespace} ({operation}): {error}")
+
+    def get(self, key, version=None, default=None):
+        """Get the value stored under a key with this version, or default."""
+        try:
+            entry = self.backend.get(self.namespace, str(key))
+        except Exception as e:
+            self._failed('get', e)
+            entry = MISSING
+        hit = entry is not MISSING and entry[0] == version
+        record_cache(self.namespace, hit)
+        return entry[1] if hit else default
+
+    def set(self, key, value, version=None, ttl=None):
+        """Store a value under a key, replacing any other version; ttl defaults to the namespace's."""
+        try:
+            self.backend.set(self.namespace, str(key), (version, value), ttl or self.ttl)
+        except Exception as e:
+            self._failed('set', e)
+
+    def delete(self, key):
+        try:
+            self.backend.delete(self.namespace, str(key))
+        except Exception as e:
+            self._failed('delete', e)
+
+    def clear(self):
+        try:
+            self.backend.clear(self.namespace)
+        except Exception as e:
+            self._failed('clear', e)
+
+SHARED_BACKENDS = {'sqlite': SQLiteBackend, 'redis': RedisBackend}
+
+_caches = {}
+_shared_backends = {}
+_caches_lock = threading.Lock()
+
+def get_cache(namespace):
+    """Get the cache of a namespace, set up with its configured backend on first use."""
+    with _caches_lock:
+        cache = _caches.get(namespace)
+        if cache is None:
+            settings = CACHE_NAMESPACES.get(namespace, {})
+            name = settings.get('backend', CACHE_BACKEND)
+            if name == 'lru':
+                backend = LRUBackend(namespace, settings.get('max_entries', CACHE_MAX_ENTRIES),
+                                     settings.get('max_bytes', CACHE_MAX_BYTES))
+            elif name in SHARED_BACKENDS:
+                # Connections are only opened on first use
+                backend = _shared_backends.get(name) or _shared_backends.setdefault(name, SHARED_BACKENDS[name]())
+            else:
+                raise ValueError(f"Unknown cache backend {name!r} for namespace {namespace}")
+            cache = _caches[namespace] = Cache(namespace, backend, settings.get('ttl'))
+    return cache
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help='Print the entries and bytes of every namespace on a shared backend')
+    clear = subparsers.add_parser('clear', help='Drop cached entries')
+    clear.add_argument('--namespace', help='Only this namespace (default: all)')
+    args = parser.parse_args()
+
+    caches = [get_cache(namespace) for namespace in ([args.namespace] if getattr(args, 'namespace', None)
+                                                     else CACHE_NAMESPACES)]
+    if args.command == 'clear':
+        for cache in caches:
+            cache.clear()
+        print(f"Cleared {', '.join(cache.namespace for cache in caches)}")
+        return
+    print(f"{'namespace':<20}{'backend':<10}{'entries':>10}{'bytes':>14}")
+    for cache in caches:
+        backend = CACHE_NAMESPACES.get(cache.namespace, {}).get('backend', CACHE_BACKEND)
+        if backend == 'lru':
+            print(f"{cache.namespace:<20}{backend:<10}{'(kept in each process)':>24}")
+            continue
+        entries, size = cache.backend.stats().get(cache.namespace, (0, 0))
+        print(f"{cache.namespace:<20}{backend:<10}{entries:>10}{size:>14,}")
+
+if __name__ == '__main__':
+    main()
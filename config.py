@@ -4,6 +4,10 @@ import os
 DATA_DIR = 'data'
 STUDENT_IMAGES_DIR = 'static/student_images'
 MODEL_DIR = 'data/models'
+PROFILES_DIR = 'data/profiles'
+CACHE_DIR = 'data/cache'
+SNAPSHOT_DIR = 'data/snapshots'
+VERSION_DIR = 'data/versions'
 
 # CSV file paths
 USERS_CSV = os.path.join(DATA_DIR, 'users.csv')
@@ -12,6 +16,14 @@ ATTENDANCE_CSV = os.path.join(DATA_DIR, 'attendance.csv')
 MENU_CSV = os.path.join(DATA_DIR, 'menu.csv')
 MEAL_PREPARATION_CSV = os.path.join(DATA_DIR, 'meal_preparation.csv')
 
+# Tables stored as one CSV per month (e.g. data/attendance/2026-10.csv), keyed by
+# the path the rest of the code uses for them. utils.read_csv() given a date
+# range only opens the months it overlaps.
+PARTITIONED_TABLES = {
+    ATTENDANCE_CSV: os.path.join(DATA_DIR, 'attendance'),
+    MEAL_PREPARATION_CSV: os.path.join(DATA_DIR, 'meal_preparation'),
+}
+
 # OpenCV face detection parameters
 FACE_DETECTION_CONFIDENCE = 0.5
 FACE_RECOGNITION_THRESHOLD = 0.6
@@ -24,3 +36,104 @@ DAYS_OF_WEEK = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturda
 
 # Application settings
 DEBUG = True
+
+# Metrics: snapshot directory shared by gunicorn workers (gunicorn.conf.py defaults it to the
+# app's data/metrics), and bearer token for /metrics, optional in development and required by
+# gunicorn.conf.py in production
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Return face pipeline stage timings in a Server-Timing response header
+STAGE_TIMING_HEADER = os.environ.get('STAGE_TIMING_HEADER', '0') == '1'
+
+# Request profiler: number of profiles kept and seconds between stack samples
+PROFILES_KEEP = 50
+PROFILE_SAMPLE_INTERVAL = 0.005
+
+# Load pandas, OpenCV and scikit-learn when the app is created instead of on first use
+WARM_UP_ON_START = os.environ.get('WARM_UP_ON_START', '0') == '1'
+
+# Live dashboard feed: seconds between keepalive comments, events buffered per stream,
+# check-ins kept for newly connected dashboards, and open streams allowed per process.
+# Every open stream holds one of the GUNICORN_THREADS request threads of its worker, so
+# at most GUNICORN_THREADS - 1 are allowed: one thread is always left for check-ins.
+GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', 4))
+LIVE_FEED_HEARTBEAT = 15
+LIVE_FEED_QUEUE_SIZE = 64
+LIVE_FEED_RECENT_CHECK_INS = 10
+LIVE_FEED_MAX_STREAMS = min(int(os.environ.get('LIVE_FEED_MAX_STREAMS', GUNICORN_THREADS - 1)), GUNICORN_THREADS - 1)
+
+# Attendance history: rows per page, and the most a client may ask for
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+
+# Rows read and sent per chunk by the streaming exports
+EXPORT_CHUNK_ROWS = 5000
+
+# Days covered by the rolling leftover weight of the per-student statistics
+STUDENT_STATS_WINDOW_DAYS = 30
+
+# Declared column types per table, enforced by tables.read_table(). 'date' columns
+# are parsed once into datetime64; 'meal_type' and 'day' are categoricals ordered
+# like MEAL_TYPES and DAYS_OF_WEEK. Weights stay float64: they are summed into
+# report totals and JSON, where float32 rounding would show.
+TABLE_SCHEMAS = {
+    ATTENDANCE_CSV: {
+        'id': 'int32', 'student_id': 'int32', 'date': 'date', 'time': 'category',
+        'meal_type': 'meal_type', 'leftover_weight': 'float64',
+    },
+    MEAL_PREPARATION_CSV: {
+        'id': 'int32', 'meal_name': 'category', 'meal_type': 'meal_type', 'day': 'day', 'date': 'date',
+        'quantity_prepared': 'float64', 'expected_students': 'int32', 'leftover_weight': 'float64',
+    },
+    MENU_CSV: {
+        'id': 'int32', 'day': 'day', 'meal_type': 'meal_type', 'meal_name': 'category', 'description': 'str',
+    },
+    STUDENTS_CSV: {
+        'id': 'int32', 'name': 'str', 'roll_number': 'str', 'image_path': 'str', 'registration_date': 'date',
+    },
+}
+
+# Tables with columnar snapshots for analytics and training (snapshots.py, needs
+# pyarrow), and the Feather compression used: 'uncompressed' files are memory-mapped
+# without a copy, 'lz4' and 'zstd' are smaller but decoded on every read.
+SNAPSHOT_TABLES = (ATTENDANCE_CSV, MEAL_PREPARATION_CSV, STUDENTS_CSV)
+SNAPSHOT_COMPRESSION = 'zstd'
+
+# Group commit of check-ins (journal.py): a flush waits up to JOURNAL_FLUSH_INTERVAL
+# seconds for more rows unless JOURNAL_FLUSH_ROWS are already waiting, and every
+# append is fsynced before the check-in is acknowledged unless JOURNAL_FSYNC is off.
+JOURNAL_FLUSH_INTERVAL = 0.05
+JOURNAL_FLUSH_ROWS = 64
+JOURNAL_FSYNC = True
+
+# Reads of a partitioned table that a write overlapped are retried (utils.consistent_read())
+# up to CONSISTENT_READ_ATTEMPTS times, CONSISTENT_READ_BACKOFF seconds apart.
+CONSISTENT_READ_ATTEMPTS = 10
+CONSISTENT_READ_BACKOFF = 0.005
+
+# Change events (events.py): other workers get them by following EVENT_LOG every
+# EVENT_POLL_INTERVAL seconds; it is rotated to EVENT_LOG + '.1' past EVENT_LOG_MAX_BYTES.
+EVENT_LOG = os.path.join(DATA_DIR, 'events.ndjson')
+EVENT_LOG_MAX_BYTES = 1024 * 1024
+EVENT_POLL_INTERVAL = 0.25
+
+# Caches (cache.py). Each namespace uses CACHE_NAMESPACES[namespace]['backend'], else
+# CACHE_BACKEND: 'lru' (a dict per process), 'sqlite' (CACHE_SQLITE_PATH, shared by the
+# workers of one host) or 'redis' (CACHE_REDIS_URL, shared by several hosts). Entries
+# expire after 'ttl' seconds if set. An LRU namespace keeps at most 'max_entries' entries
+# and 'max_bytes' bytes; the SQLite database keeps CACHE_MAX_BYTES in all.
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'sqlite')
+CACHE_NAMESPACES = {
+    # Looked up on every request and cheap to rebuild, so kept in each worker
+    'tables': {'backend': 'lru', 'max_entries': 64, 'max_bytes': 32 * 1024 * 1024},
+    # Unpickling a model from a shared cache costs as much as from its file
+    'prediction_models': {'backend': 'lru', 'max_entries': 4},
+    'analysis': {'ttl': 24 * 60 * 60},
+}
+CACHE_MAX_ENTRIES = 1024
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_SQLITE_PATH = os.path.join(CACHE_DIR, 'cache.sqlite')
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+CACHE_REDIS_TIMEOUT = 0.5
+CACHE_KEY_PREFIX = 'smartmess:'
@@ -1,7 +1,12 @@
-import csv
 import random
 import pandas as pd
 from datetime import datetime, timedelta
+from utils import read_csv, write_csv, file_lock
+from config import ATTENDANCE_CSV, MEAL_PREPARATION_CSV
+
+# Existing data; both tables are stored as monthly partitions, which read_csv/write_csv handle
+attendance_df = read_csv(ATTENDANCE_CSV)
+meal_prep_df = read_csv(MEAL_PREPARATION_CSV)
 
 # Get current date
 current_date = datetime.now()
@@ -23,7 +28,7 @@ meal_times = {
 
 # Create attendance records for 10 students per meal per day
 attendance_records = []
-next_id = 136  # Continue from our existing data
+next_id = int(attendance_df['id'].max()) + 1 if not attendance_df.empty else 1  # Continue from existing data
 
 for date in dates:
     for meal_type in ['Breakfast', 'Lunch', 'Dinner']:
@@ -41,29 +46,15 @@ for date in dates:
             ])
             next_id += 1
 
-# Read existing attendance data
-existing_attendance = []
-with open('data/attendance.csv', 'r') as f:
-    reader = csv.reader(f)
-    # Skip header
-    header = next(reader)
-    for row in reader:
-        existing_attendance.append(row)
-
 # Add new records to existing data
-with open('data/attendance.csv', 'w', newline='') as f:
-    writer = csv.writer(f)
-    writer.writerow(header)
-    # Write existing records
-    for row in existing_attendance:
-        writer.writerow(row)
-    # Write new records
-    for record in attendance_records:
-        writer.writerow(record)
+attendance_df = pd.concat([attendance_df, pd.DataFrame(attendance_records, columns=[
+    'id', 'student_id', 'date', 'time', 'meal_type', 'leftover_weight'])], ignore_index=True)
+with file_lock(ATTENDANCE_CSV):
+    write_csv(attendance_df, ATTENDANCE_CSV)
 
 # Now update meal preparation records for the current week
 meal_prep_records = []
-next_id = 88  # Continue from existing data
+next_id = int(meal_prep_df['id'].max()) + 1 if not meal_prep_df.empty else 1  # Continue from existing data
 
 for date in dates:
     for meal_type, prefix in [('Breakfast', 'Break'), ('Lunch', 'Lunch'), ('Dinner', 'Dinner')]:
@@ -79,6 +70,8 @@ for date in dates:
         meal_prep_records.append([
             next_id,
             meal_name,
+            meal_type,
+            datetime.strptime(date, '%Y-%m-%d').strftime('%A'),
             date,
             quantity_prepared,
             expected_students,
@@ -86,25 +79,12 @@ for date in dates:
         ])
         next_id += 1
 
-# Read existing meal preparation data
-existing_meal_prep = []
-with open('data/meal_preparation.csv', 'r') as f:
-    reader = csv.reader(f)
-    # Skip header
-    header = next(reader)
-    for row in reader:
-        existing_meal_prep.append(row)
-
 # Add new records to existing data
-with open('data/meal_preparation.csv', 'w', newline='') as f:
-    writer = csv.writer(f)
-    writer.writerow(header)
-    # Write existing records
-    for row in existing_meal_prep:
-        writer.writerow(row)
-    # Write new records
-    for record in meal_prep_records:
-        writer.writerow(record)
+meal_prep_df = pd.concat([meal_prep_df, pd.DataFrame(meal_prep_records, columns=[
+    'id', 'meal_name', 'meal_type', 'day', 'date', 'quantity_prepared', 'expected_students', 'leftover_weight'])],
+    ignore_index=True)
+with file_lock(MEAL_PREPARATION_CSV):
+    write_csv(meal_prep_df, MEAL_PREPARATION_CSV)
 
 print(f"Added {len(attendance_records)} new attendance records")
 print(f"Added {len(meal_prep_records)} new meal preparation records")
\ No newline at end of file
@@ -0,0 +1,166 @@
+"""
+Change events of the data tables.
+
+Every write made through aggregates.write_csv_with_changes() or the journal
+publishes a ChangeEvent for each row it inserted, updated or deleted: the
+table (its path, e.g. config.ATTENDANCE_CSV), the row's key (its id), the
+fields that changed and the whole row (as it was, for a delete). A write that
+changed no row, such as a compaction, publishes one 'write' event without a
+key.
+
+Subscribers register with @subscribe and get the events of one write at a
+time, synchronously in the process that made it. Those registered with
+workers=True (the live feed, the face gallery) also get the events of the
+other gunicorn workers: each write's events are appended to EVENT_LOG as one
+JSON line, and a thread in every worker follows the log. Delivery between
+workers is best effort, within EVENT_POLL_INTERVAL; a subscriber must still
+notice changes it missed itself. A single process has no one to tell, so the
+log is only kept once gunicorn.conf.py calls share_with_workers() for a
+server with several workers. The FileAggregates are kept current by
+aggregates.notify_change() instead, which checks file signatures.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import namedtuple
+from utils import file_lock
+from config import EVENT_LOG, EVENT_LOG_MAX_BYTES, EVENT_POLL_INTERVAL
+
+ChangeEvent = namedtuple('ChangeEvent', ['table', 'op', 'key', 'fields', 'row'])
+
+# (callback, tables or None for all, whether it also gets other workers' events)
+_subscribers = []
+
+# Whether other processes serve the app, so writes go through EVENT_LOG too
+_log = {'shared': False}
+
+def share_with_workers():
+    """Append every write's events to EVENT_LOG and follow the other workers' ones; called in the gunicorn master before forking."""
+    _log['shared'] = True
+
+def subscribe(tables=None, workers=False):
+    """Decorator registering callback(events) for the writes to some tables (default all), optionally of every worker."""
+    def decorator(callback):
+        _subscribers.append((callback, tables, workers))
+        return callback
+    return decorator
+
+def _plain(value):
+    """Turn a numpy scalar from a DataFrame row into the Python value."""
+    return value.item() if hasattr(value, 'item') else value
+
+def _same(a, b):
+    # NaN (a missing value) is never equal to itself
+    return a == b or (a != a and b != b)
+
+def change_events(file_path, changes):
+    """Build the events of a write from its (before, after) row changes."""
+    if not changes:
+        return [ChangeEvent(file_path, 'write', None, {}, None)]
+    events = []
+    for before, after in changes:
+        row = {column: _plain(value) for column, value in (after if after is not None else before).items()}
+        key = int(row['id']) if row.get('id') is not None else None
+        if before is None:
+            events.append(ChangeEvent(file_path, 'insert', key, row, row))
+        elif after is None:
+            events.append(ChangeEvent(file_path, 'delete', key, {}, row))
+        else:
+            fields = {column: value for column, value in row.items() if not _same(_plain(before.get(column)), value)}
+            events.append(ChangeEvent(file_path, 'update', key, fields, row))
+    return events
+
+def publish(file_path, changes):
+    """Publish the row changes of a write to this process's subscribers and, through the event log, to the other workers."""
+    events = change_events(file_path, changes)
+    if _log['shared']:
+        _append_to_log(events)
+    _dispatch(events, remote=False)
+
+def _dispatch(events, remote):
+    table = events[0].table
+    for callback, tables, workers in list(_subscribers):
+        if (tables is None or table in tables) and (workers or not remote):
+            try:
+                callback(events)
+            except Exception as e:
+                logging.error(f"Error in change subscriber {callback.__name__}: {e}")
+
+def _append_to_log(events):
+    # One line per write in a single write() on an O_APPEND descriptor, so lines of
+    # concurrent workers never interleave and followers never see part of a write
+    line = json.dumps({'pid': os.getpid(), 'events': [event._asdict() for event in events]}, default=str) + '\n'
+    try:
+        fd = os.open(EVENT_LOG, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode())
+            size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+        if size > EVENT_LOG_MAX_BYTES:
+            with file_lock(EVENT_LOG):
+                if os.path.getsize(EVENT_LOG) > EVENT_LOG_MAX_BYTES:
+                    os.replace(EVENT_LOG, EVENT_LOG + '.1')
+    except OSError as e:
+        logging.error(f"Error appending to {EVENT_LOG}: {e}")
+
+def _open_log(at_end):
+    try:
+        log = open(EVENT_LOG)
+    except FileNotFoundError:
+        return None
+    if at_end:
+        log.seek(0, os.SEEK_END)
+    return log
+
+def _rotated(log):
+    """Check whether the log was rotated since it was opened, so the rest is in a new file."""
+    try:
+        return os.stat(EVENT_LOG).st_ino != os.fstat(log.fileno()).st_ino
+    except FileNotFoundError:
+        return False
+
+def _receive(line):
+    record = json.loads(line)
+    if record['pid'] != os.getpid():
+        _dispatch([ChangeEvent(**event) for event in record['events']], remote=True)
+
+def _follow_log():
+    # Only writes made from now on matter; anything older is already in the files
+    log = _open_log(at_end=True)
+    pending = ''
+    while True:
+        time.sleep(EVENT_POLL_INTERVAL)
+        try:
+            if log is None:
+                log = _open_log(at_end=False)
+                if log is None:
+                    continue
+            pending += log.read()
+            *lines, pending = pending.split('\n')
+            for line in lines:
+                _receive(line)
+            if not pending and _rotated(log):
+                # The rest of the old file has just been read; carry on with the new one
+                log.close()
+                log = _open_log(at_end=False)
+        except Exception as e:
+            logging.error(f"Error following {EVENT_LOG}: {e}")
+
+_follower = {'pid': None}
+_follower_lock = threading.Lock()
+
+def follow_other_workers():
+    """Start following the event log in this process, once; run before every request so each forked worker starts its own."""
+    if not _log['shared'] or _follower['pid'] == os.getpid():
+        return
+    with _follower_lock:
+        if _follower['pid'] != os.getpid():
+            _follower['pid'] = os.getpid()
+            threading.Thread(target=_follow_log, daemon=True).start()
+
+def init_events(app):
+    """Deliver other workers' events in every process serving the app."""
+    app.before_request(follow_other_workers)
@@ -0,0 +1,102 @@
+import io
+import csv
+import json
+import logging
+from datetime import datetime
+from flask import Blueprint, Response, request, stream_with_context, flash, redirect, url_for
+from utils import iter_csv_chunks
+from config import ATTENDANCE_CSV, MEAL_PREPARATION_CSV, EXPORT_CHUNK_ROWS
+from auth import admin_required
+from history import student_directory
+
+export_bp = Blueprint('exports', __name__)
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+ATTENDANCE_EXPORT_COLUMNS = ['id', 'date', 'time', 'meal_type', 'student_id', 'student_name', 'roll_number', 'leftover_weight']
+MEAL_PREPARATION_EXPORT_COLUMNS = ['id', 'date', 'meal_name', 'meal_type', 'day', 'quantity_prepared', 'expected_students', 'leftover_weight']
+
+def export_records(file_path, columns, from_date, to_date, join=None):
+    """
+    Yield the rows of a CSV file dated within [from_date, to_date], one list of dicts per chunk.
+
+    Only one chunk of the file is in memory at a time, and only the months
+    overlapping the range are read.
+    """
+    for chunk in iter_csv_chunks(file_path, EXPORT_CHUNK_ROWS, from_date, to_date):
+        if join:
+            chunk = join(chunk)
+        # Python scalars and None for missing values, so both encoders can take the records as they are
+        chunk = chunk.reindex(columns=columns).astype(object)
+        yield chunk.where(chunk.notna(), None).to_dict('records')
+
+def join_student(chunk):
+    """Add the student name and roll number columns to a chunk of attendance rows."""
+    student_directory.ensure_current()
+    students = student_directory.students
+    return chunk.assign(
+        student_name=chunk['student_id'].map(lambda student_id: students.get(student_id, (None, None))[0]),
+        roll_number=chunk['student_id'].map(lambda student_id: students.get(student_id, (None, None))[1]),
+    )
+
+def encode_csv(chunks, columns):
+    """Encode chunks of records as CSV text, header first."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns)
+    writer.writeheader()
+    yield buffer.getvalue()
+    for records in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(records)
+        yield buffer.getvalue()
+
+def encode_ndjson(chunks, columns):
+    """Encode chunks of records as newline-delimited JSON."""
+    for records in chunks:
+        yield ''.join(json.dumps(record) + '\n' for record in records)
+
+def streaming_export(name, file_path, columns, join=None):
+    """Build a streaming download of a data file for the date range and format in the query string."""
+    fmt = request.args.get('format', 'csv')
+    from_date = request.args.get('from_date') or None
+    to_date = request.args.get('to_date') or None
+    try:
+        for date in (from_date, to_date):
+            if date:
+                datetime.strptime(date, "%Y-%m-%d")
+    except ValueError:
+        flash('Dates must be in YYYY-MM-DD format', 'danger')
+        return redirect(request.referrer or url_for('analytics.dashboard'))
+    if fmt not in EXPORT_FORMATS:
+        flash('Unsupported export format', 'danger')
+        return redirect(request.referrer or url_for('analytics.dashboard'))
+
+    def generate():
+        chunks = export_records(file_path, columns, from_date, to_date, join)
+        encode = encode_csv if fmt == 'csv' else encode_ndjson
+        try:
+            yield from encode(chunks, columns)
+        except Exception as e:
+            # Headers are already sent; raising aborts the response, so the client sees a failed download, not a short file
+            logging.error(f"Error exporting {name}: {e}")
+            raise
+
+    filename = '_'.join([name] + [date for date in (from_date, to_date) if date]) + '.' + fmt
+    return Response(stream_with_context(generate()), mimetype=EXPORT_FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@export_bp.route('/export/attendance')
+@admin_required
+def export_attendance():
+    """Download attendance joined with student name and roll number as CSV or NDJSON."""
+    return streaming_export('attendance', ATTENDANCE_CSV, ATTENDANCE_EXPORT_COLUMNS, join_student)
+
+@export_bp.route('/export/meal_preparation')
+@admin_required
+def export_meal_preparation():
+    """Download meal preparation records as CSV or NDJSON."""
+    return streaming_export('meal_preparation', MEAL_PREPARATION_CSV, MEAL_PREPARATION_EXPORT_COLUMNS)
@@ -1,15 +1,32 @@
 import os
-import cv2
-import numpy as np
 import logging
-from config import FACE_DETECTION_CONFIDENCE, FACE_RECOGNITION_THRESHOLD, STUDENT_IMAGES_DIR
+import threading
+from config import FACE_DETECTION_CONFIDENCE, FACE_RECOGNITION_THRESHOLD, STUDENT_IMAGES_DIR, STUDENTS_CSV
 import base64
-from PIL import Image
-from io import BytesIO
+from utils import lazy_import
+from events import subscribe
+from startup import register_after_fork
+from metrics import record_cache, stage_timer, set_stage_labels
 
-# Load face detection model (Haar Cascade)
-face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
 
+# Face detection model (Haar Cascade), loaded on first use
+_face_cascade = None
+
+def get_face_cascade():
+    """Return the Haar Cascade face detector, loading it on first use."""
+    global _face_cascade
+    if _face_cascade is None:
+        _face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    return _face_cascade
+
+@register_after_fork
+def _limit_opencv_threads():
+    """Keep each worker on one OpenCV thread; parallelism comes from the worker processes."""
+    cv2.setNumThreads(1)
+
+@stage_timer('detect')
 def detect_face(image_data):
     """
     Detect faces in the given image data.
@@ -26,7 +43,7 @@ def detect_face(image_data):
         gray = cv2.cvtColor(image_data, cv2.COLOR_BGR2GRAY)
         
         # Detect faces
-        faces = face_cascade.detectMultiScale(
+        faces = get_face_cascade().detectMultiScale(
             gray,
             scaleFactor=1.1,
             minNeighbors=5,
@@ -56,6 +73,7 @@ def detect_face(image_data):
         logging.error(f"Error in face detection: {e}")
         return None, None
 
+@stage_timer('storage_write')
 def save_face_image(face_image, student_id):
     """
     Save the face image to the student images directory.
@@ -79,6 +97,7 @@ def save_face_image(face_image, student_id):
         logging.error(f"Error saving face image: {e}")
         return None
 
+@stage_timer('decode')
 def decode_base64_image(base64_data):
     """
     Decode a base64 image to a numpy array.
@@ -102,6 +121,8 @@ def decode_base64_image(base64_data):
         
         # Decode image
         img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        if img is not None:
+            set_stage_labels(resolution=f"{img.shape[1]}x{img.shape[0]}")
         
         return img
     
@@ -137,6 +158,117 @@ def load_and_preprocess_image(image_path):
         logging.error(f"Error preprocessing image {image_path}: {e}")
         return None
 
+# Preprocessed student faces, patched on student change events and rebuilt when the image directory changes otherwise
+_face_gallery = {'signature': None, 'student_ids': [], 'faces': None}
+_face_gallery_lock = threading.Lock()
+
+def _gallery_signature(student_images_dir):
+    """Get the names, mtimes and sizes of the student images, used to detect changes."""
+    try:
+        entries = [
+            (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+            for entry in os.scandir(student_images_dir)
+            if entry.name.startswith("student_") and entry.name.endswith(".jpg")
+        ]
+    except OSError:
+        return None
+    return (student_images_dir, tuple(sorted(entries)))
+
+def load_face_gallery(student_images_dir=STUDENT_IMAGES_DIR):
+    """
+    Load the preprocessed faces of all registered students.
+    
+    Faces are kept in one contiguous float32 matrix so that a preloaded
+    gallery stays shared between forked workers. It is only rebuilt when
+    an image is added, replaced or removed.
+    
+    Args:
+        student_images_dir: Directory containing student face images
+    
+    Returns:
+        tuple: (list of student IDs, numpy.ndarray of shape (n, 100 * 100))
+    """
+    with _face_gallery_lock:
+        signature = _gallery_signature(student_images_dir)
+        hit = signature == _face_gallery['signature'] and _face_gallery['faces'] is not None
+        record_cache('face_gallery', hit)
+        if hit:
+            return _face_gallery['student_ids'], _face_gallery['faces']
+        
+        student_ids = []
+        faces = []
+        for filename, _, _ in (signature[1] if signature else ()):
+            face = _load_gallery_face(os.path.join(student_images_dir, filename))
+            if face is not None:
+                student_ids.append(filename.replace("student_", "").replace(".jpg", ""))
+                faces.append(face)
+        
+        gallery = np.vstack(faces) if faces else np.empty((0, 100 * 100), dtype=np.float32)
+        _face_gallery['student_ids'] = student_ids
+        _face_gallery['faces'] = gallery
+        _face_gallery['signature'] = signature
+        return student_ids, gallery
+
+def _load_gallery_face(image_path):
+    """Load one student image as a gallery row, or None if it cannot be read."""
+    student_gray = load_and_preprocess_image(image_path)
+    if student_gray is None:
+        return None
+    # Resize to the standard size used for comparison
+    return cv2.resize(student_gray, (100, 100)).astype(np.float32).ravel()
+
+@subscribe(tables=(STUDENTS_CSV,), workers=True)
+def _update_face_gallery(events):
+    """
+    Patch the loaded gallery for the students registered, edited or deleted.
+    
+    Only their images are read, instead of every student's. The signature is
+    patched the same way, so a change the events did not cover still makes
+    load_face_gallery() rebuild the gallery.
+    """
+    with _face_gallery_lock:
+        signature = _face_gallery['signature']
+        if _face_gallery['faces'] is None or signature is None or signature[0] != STUDENT_IMAGES_DIR:
+            return
+        entries = {filename: (mtime, size) for filename, mtime, size in signature[1]}
+        student_ids = list(_face_gallery['student_ids'])
+        faces = _face_gallery['faces']
+        for event in events:
+            if event.key is None:
+                continue
+            student_id = str(event.key)
+            filename = f"student_{student_id}.jpg"
+            if student_id in student_ids:
+                index = student_ids.index(student_id)
+                del student_ids[index]
+                faces = np.delete(faces, index, axis=0)
+            entries.pop(filename, None)
+            if event.op == 'delete':
+                continue
+            image_path = os.path.join(STUDENT_IMAGES_DIR, filename)
+            try:
+                # Taken before reading, so an image replaced meanwhile shows up as a change
+                stat = os.stat(image_path)
+            except OSError:
+                continue
+            entries[filename] = (stat.st_mtime_ns, stat.st_size)
+            face = _load_gallery_face(image_path)
+            if face is not None:
+                student_ids.append(student_id)
+                faces = np.vstack([faces, face])
+        _face_gallery['student_ids'] = student_ids
+        _face_gallery['faces'] = faces
+        _face_gallery['signature'] = (STUDENT_IMAGES_DIR, tuple(sorted(
+            (filename, mtime, size) for filename, (mtime, size) in entries.items())))
+
+def gallery_size_bucket(size):
+    """Round a gallery size up to a power of two, to keep metric labels few."""
+    bucket = 1
+    while bucket < size:
+        bucket *= 2
+    return f"<={bucket}" if size else "0"
+
+@stage_timer('recognize')
 def recognize_face(face_image, student_images_dir):
     """
     Recognize a face among the registered students.
@@ -161,34 +293,19 @@ def recognize_face(face_image, student_images_dir):
         # Resize to standard size for comparison
         face_gray = cv2.resize(face_gray, (100, 100))
         
-        best_match = None
-        best_score = float('inf')  # Lower is better for MSE
-        
-        # Check each student's face image
-        for filename in os.listdir(student_images_dir):
-            if filename.startswith("student_") and filename.endswith(".jpg"):
-                student_id = filename.replace("student_", "").replace(".jpg", "")
-                
-                # Load and preprocess student image
-                student_img_path = os.path.join(student_images_dir, filename)
-                student_gray = load_and_preprocess_image(student_img_path)
-                
-                if student_gray is None:
-                    continue
-                
-                # Resize to match face image size
-                student_gray = cv2.resize(student_gray, (100, 100))
-                
-                # Calculate mean squared error for comparison
-                mse = np.sum((face_gray.astype("float") - student_gray.astype("float")) ** 2)
-                mse /= float(face_gray.shape[0] * face_gray.shape[1])
-                
-                # Lower MSE is better
-                if mse < best_score and mse < FACE_RECOGNITION_THRESHOLD * 10000:
-                    best_score = mse
-                    best_match = student_id
-        
-        return best_match
+        student_ids, gallery = load_face_gallery(student_images_dir)
+        set_stage_labels(gallery_size=gallery_size_bucket(len(student_ids)))
+        if not student_ids:
+            return None
+        
+        # Mean squared error against every student's face at once (lower is better)
+        diff = gallery - face_gray.astype(np.float32).ravel()
+        mse = np.einsum('ij,ij->i', diff, diff, dtype=np.float64) / float(face_gray.shape[0] * face_gray.shape[1])
+        
+        best = int(np.argmin(mse))
+        if mse[best] < FACE_RECOGNITION_THRESHOLD * 10000:
+            return student_ids[best]
+        return None
     
     except Exception as e:
         logging.error(f"Error in face recognition: {e}")
@@ -0,0 +1,91 @@
+"""
+Production gunicorn profile.
+
+Run from the project root with:
+
+    gunicorn -c gunicorn.conf.py
+
+The app is imported once in the master (preload_app), the face gallery,
+menu index and prediction models are loaded there before any worker forks,
+and workers inherit them copy-on-write. Every setting can be overridden
+with the GUNICORN_* environment variables below.
+"""
+import gc
+import os
+import glob
+import time
+import logging
+import multiprocessing
+
+# Workers share their metrics through snapshot files so /metrics covers all of them.
+# The directory is this app's own, not a shared temporary one; it is set before
+# config is imported so that config sees it.
+os.environ.setdefault('METRICS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'metrics'))
+from config import GUNICORN_THREADS, METRICS_DIR, METRICS_TOKEN
+
+wsgi_app = 'main:app'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+
+# Face detection and recognition are CPU bound, so one process per core;
+# a few threads per worker overlap the CSV I/O of the other routes.
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+# Live dashboard streams hold a thread each; config caps them at threads - 1 per worker
+threads = GUNICORN_THREADS
+
+# A check-in (decode + detect + recognize + write) finishes in well under a
+# second; anything approaching the timeout is stuck and should be recycled.
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers periodically; with preload a replacement is just a fork.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 200))
+
+preload_app = True
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+def on_starting(server):
+    """Refuse to serve /metrics without a token, and drop metric snapshots left behind by a previous run."""
+    if not METRICS_TOKEN:
+        raise RuntimeError("Set METRICS_TOKEN: /metrics is not served without a bearer token in production")
+    for path in glob.glob(os.path.join(METRICS_DIR, '*.json')):
+        os.remove(path)
+
+def when_ready(server):
+    """Warm shared state in the master, before the first worker is forked."""
+    from startup import warm_shared_state
+    warm_shared_state()
+    if server.cfg.workers > 1:
+        # Only then do the workers need each other's change events
+        from events import share_with_workers
+        share_with_workers()
+    # Move everything loaded so far out of the GC's reach so collections in
+    # the workers do not touch (and un-share) those pages.
+    gc.freeze()
+    server.log.info("Shared state warmed; forking workers")
+
+def post_fork(server, worker):
+    """Reopen per-process resources in the new worker."""
+    worker.fork_started = time.perf_counter()
+    from startup import reopen_after_fork
+    reopen_after_fork()
+
+def post_worker_init(worker):
+    """Log how long the worker took to become ready after forking."""
+    ready_ms = (time.perf_counter() - worker.fork_started) * 1000
+    logging.getLogger('gunicorn.error').info(f"Worker {worker.pid} ready in {ready_ms:.1f}ms")
+
+def worker_exit(server, worker):
+    """Write the exiting worker's last metrics for the master to retire."""
+    from metrics import write_snapshot
+    write_snapshot()
+
+def child_exit(server, worker):
+    """Keep the counters of an exited worker and remove its metrics snapshot."""
+    from metrics import retire_worker
+    retire_worker(worker.pid)
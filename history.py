@@ -0,0 +1,239 @@
+import bisect
+from datetime import datetime, timedelta
+from aggregates import FileAggregate
+from rollups import attendance_cube, first_of_next_month
+from utils import (read_csv, read_partition, read_journal, list_partitions, partition_key, consistent_read,
+                   iter_csv_chunks, lazy_import)
+from config import ATTENDANCE_CSV, STUDENTS_CSV
+
+pd = lazy_import('pandas')
+
+# Rows read at a time when the index is rebuilt
+INDEX_CHUNK_ROWS = 50000
+
+class StudentDirectory(FileAggregate):
+    """Name and roll number per student id, for joining them onto attendance rows."""
+    sources = (STUDENTS_CSV,)
+
+    def __init__(self):
+        super().__init__()
+        self.students = {}
+
+    def rebuild(self):
+        students_df = read_csv(STUDENTS_CSV)
+        self.students = {}
+        for row in students_df.to_dict('records'):
+            self.students[int(row['id'])] = (str(row['name']), str(row['roll_number']))
+
+    def apply(self, file_path, before, after):
+        if before is not None:
+            self.students.pop(int(before['id']), None)
+        if after is not None:
+            self.students[int(after['id'])] = (str(after['name']), str(after['roll_number']))
+
+    def lookup(self, student_id):
+        """Get (name, roll_number) of a student, or None if the student does not exist."""
+        self.ensure_current()
+        return self.students.get(student_id)
+
+    def all(self):
+        """Get (id, name, roll_number) of every student, sorted by name."""
+        self.ensure_current()
+        with self._lock:
+            return sorted(((student_id, name, roll) for student_id, (name, roll) in self.students.items()),
+                          key=lambda student: student[1].lower())
+
+class AttendanceIndex(FileAggregate):
+    """
+    Slot, month and id bounds of the attendance rows, for duplicate checks and history pages.
+
+    Only small maps are kept in memory: the id of the row of each
+    (student_id, date, meal_type) slot, so duplicates are found in O(1), and
+    the month of each id. A history page is a keyset query over the monthly
+    partitions instead: newest month first, skipping months the attendance
+    cube has no matching rows in, until the page is full. So neither memory
+    nor page latency grows with the length of the history.
+    """
+    sources = (ATTENDANCE_CSV,)
+
+    def __init__(self):
+        super().__init__()
+        self.by_slot = {}
+        # Rows beyond the first of their slot, which only older files may hold
+        self.duplicates = {}
+        self.months = {}
+        self.max_id = 0
+        self.first_date = None
+        self.last_date = None
+
+    @staticmethod
+    def _row(record):
+        return {
+            'id': int(record['id']),
+            'student_id': int(record['student_id']),
+            'date': str(record['date']),
+            'time': str(record['time']),
+            'meal_type': str(record['meal_type']),
+            'leftover_weight': float(record['leftover_weight']),
+        }
+
+    @staticmethod
+    def _key(row):
+        return (row['date'], row['time'], row['id'])
+
+    def _add(self, attendance_id, student_id, date, meal_type):
+        self.months[attendance_id] = partition_key(date)
+        self.max_id = max(self.max_id, attendance_id)
+        self.first_date = min(self.first_date or date, date)
+        self.last_date = max(self.last_date or date, date)
+        # Older files may hold duplicates; the slot belongs to the one with the lowest id
+        slot = (student_id, date, meal_type)
+        owner = self.by_slot.get(slot)
+        if owner is None:
+            self.by_slot[slot] = attendance_id
+            return
+        self.by_slot[slot] = min(owner, attendance_id)
+        bisect.insort(self.duplicates.setdefault(slot, []), max(owner, attendance_id))
+
+    def _remove(self, attendance_id, student_id, date, meal_type):
+        if self.months.pop(attendance_id, None) is None:
+            return
+        slot = (student_id, date, meal_type)
+        extra = self.duplicates.get(slot, [])
+        if attendance_id in extra:
+            extra.remove(attendance_id)
+        elif self.by_slot.get(slot) == attendance_id:
+            if extra:
+                # Hand the slot over to a duplicate row
+                self.by_slot[slot] = extra.pop(0)
+            else:
+                del self.by_slot[slot]
+        if not extra:
+            self.duplicates.pop(slot, None)
+
+    def rebuild(self):
+        self.by_slot = {}
+        self.duplicates = {}
+        self.months = {}
+        self.max_id = 0
+        self.first_date = self.last_date = None
+        for chunk in iter_csv_chunks(ATTENDANCE_CSV, INDEX_CHUNK_ROWS):
+            columns = chunk[['id', 'student_id', 'date', 'meal_type']]
+            for attendance_id, student_id, date, meal_type in columns.itertuples(index=False):
+                self._add(int(attendance_id), int(student_id), str(date), str(meal_type))
+
+    def apply(self, file_path, before, after):
+        if before is not None:
+            self._remove(int(before['id']), int(before['student_id']), str(before['date']), str(before['meal_type']))
+        if after is not None:
+            self._add(int(after['id']), int(after['student_id']), str(after['date']), str(after['meal_type']))
+
+    def find(self, student_id, date, meal_type):
+        """Get the id of the attendance row for a student's meal on a date, or None if there is none."""
+        self.ensure_current()
+        return self.by_slot.get((student_id, date, meal_type))
+
+    def get(self, attendance_id):
+        """Get an attendance row by id, or None if there is none; reads the row's month."""
+        self.ensure_current()
+        month = self.months.get(attendance_id)
+        if month is None:
+            return None
+        for row in consistent_read(ATTENDANCE_CSV, lambda: self._read_month(month, read_journal(ATTENDANCE_CSV))):
+            if row['id'] == attendance_id:
+                return row
+        return None
+
+    def next_id(self):
+        """Get the id for a new attendance row, which is unique across all months of the table."""
+        self.ensure_current()
+        return self.max_id + 1
+
+    def _read_month(self, month, journal_df):
+        """Get the rows of one month, its journaled rows included."""
+        frames = [read_partition(ATTENDANCE_CSV, month)]
+        if not journal_df.empty:
+            frames.append(journal_df[journal_df['date'].astype(str).str[:7] == month])
+        frames = [df for df in frames if not df.empty]
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else (frames[0] if frames else pd.DataFrame())
+        return [self._row(record) for record in df.to_dict('records')]
+
+    def _has_rows(self, month, meal_type, student_id):
+        """Check in the attendance cube whether a month can hold rows matching the filters."""
+        if student_id is None and not meal_type:
+            return True
+        start = month + '-01'
+        end = (first_of_next_month(datetime.strptime(start, "%Y-%m-%d")) - timedelta(days=1)).strftime("%Y-%m-%d")
+        if student_id is not None:
+            return student_id in attendance_cube.totals(start, end, 'student_id')
+        return meal_type in attendance_cube.totals(start, end, 'meal_type')
+
+    def _read_page(self, limit, cursor, start_date, end_date, meal_type, student_id):
+        journal_df = read_journal(ATTENDANCE_CSV)
+        months = set(list_partitions(ATTENDANCE_CSV, start_date, end_date))
+        if not journal_df.empty:
+            months.update(journal_df['date'].astype(str).str[:7].unique())
+        highest = min(partition_key(end_date) if end_date else '9999-99', partition_key(cursor[0]) if cursor else '9999-99')
+        lowest = partition_key(start_date) if start_date else ''
+
+        rows = []
+        for month in sorted(months, reverse=True):
+            if len(rows) >= limit:
+                break
+            if not lowest <= month <= highest or not self._has_rows(month, meal_type, student_id):
+                continue
+            matching = [
+                row for row in self._read_month(month, journal_df)
+                if (not start_date or row['date'] >= start_date) and (not end_date or row['date'] <= end_date)
+                and (not meal_type or row['meal_type'] == meal_type)
+                and (student_id is None or row['student_id'] == student_id)
+                and (cursor is None or self._key(row) < tuple(cursor))
+            ]
+            rows.extend(sorted(matching, key=self._key, reverse=True))
+        return rows[:limit]
+
+    def _total(self, start_date, end_date, meal_type, student_id):
+        """Count the matching rows in the attendance cube, or None for a student and meal type together."""
+        if student_id is not None and meal_type:
+            return None
+        with self._lock:
+            first_date, last_date = self.first_date, self.last_date
+        start, end = max(start_date or '', first_date or ''), min(end_date or '9999-12-31', last_date or '')
+        if first_date is None or start > end:
+            return 0
+        if student_id is not None:
+            return attendance_cube.totals(start, end, 'student_id').get(student_id, [0])[0]
+        totals = attendance_cube.totals(start, end, 'meal_type')
+        if meal_type:
+            return totals.get(meal_type, [0])[0]
+        return sum(count for count, _ in totals.values())
+
+    def page(self, limit, cursor=None, start_date=None, end_date=None, meal_type=None, student_id=None):
+        """
+        Get one page of attendance rows, newest first.
+
+        Args:
+            limit: Maximum number of rows
+            cursor: (date, time, id) of the last row of the previous page, or None for the first page
+            start_date, end_date: Inclusive YYYY-MM-DD bounds
+            meal_type, student_id: Optional filters
+
+        Returns:
+            (rows, next_cursor, total) where next_cursor is None on the last page
+            and total is the number of matching rows, or None when a student and
+            a meal type are filtered together.
+        """
+        self.ensure_current()
+        # One row more than the page tells whether there is a next one
+        rows = consistent_read(ATTENDANCE_CSV, lambda: self._read_page(limit + 1, cursor, start_date, end_date,
+                                                                      meal_type, student_id))
+        next_cursor = list(self._key(rows[limit - 1])) if len(rows) > limit else None
+        return rows[:limit], next_cursor, self._total(start_date, end_date, meal_type, student_id)
+
+    def count(self):
+        """Number of attendance rows."""
+        self.ensure_current()
+        return len(self.months)
+
+student_directory = StudentDirectory()
+attendance_index = AttendanceIndex()
@@ -0,0 +1,154 @@
+"""
+Group commit of attendance check-ins.
+
+At the start of a meal, check-ins arrive faster than their month can be
+rewritten for each one. append_rows() appends the new rows to the table's
+journal (data/attendance/_journal.csv) instead and fsyncs it, which costs the
+same however large the table is, and passes them on to the aggregates right
+away, so the duplicate check and today's counts see them at once. read_csv()
+and the other readers include the journal, and other workers apply the rows
+appended to it without rebuilding their aggregates.
+
+flush_journal() moves the journaled rows into their months, rewriting each
+month once for the whole batch. A flusher thread in every process runs it
+JOURNAL_FLUSH_INTERVAL seconds after an append, or as soon as
+JOURNAL_FLUSH_ROWS rows are waiting; the file lock lets one writer flush at a
+time. Rows whose id is already in their month are skipped, so a flush
+interrupted between writing the months and removing the journal is simply
+done again. create_app() flushes what the last run left on startup.
+
+Usage:
+    python journal.py flush     # move every journaled row into its month
+"""
+import os
+import csv
+import logging
+import argparse
+import threading
+from aggregates import notify_write
+from utils import (file_lock, file_signature, journal_path, read_journal, read_partition, write_csv, versioned_write,
+                   record_flush, split_journal, lazy_import)
+from metrics import record_csv_operation, stage_timer
+from config import PARTITIONED_TABLES, JOURNAL_FLUSH_INTERVAL, JOURNAL_FLUSH_ROWS, JOURNAL_FSYNC
+
+pd = lazy_import('pandas')
+
+def append_rows(file_path, rows):
+    """
+    Durably append inserted rows to a partitioned table's journal and pass them on to the aggregates.
+
+    The caller holds file_lock(file_path), e.g. to check for duplicates first.
+
+    Returns:
+        False if the journal could not be written
+    """
+    path = journal_path(file_path)
+    previous_signature = file_signature(file_path)
+    try:
+        record_csv_operation('write', file_path)
+        with stage_timer('storage_write'), versioned_write(file_path, append=True):
+            header = None
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                with open(path, newline='') as f:
+                    header = next(csv.reader(f))
+            with open(path, 'a', newline='') as f:
+                writer = csv.writer(f)
+                if header is None:
+                    header = list(rows[0])
+                    writer.writerow(header)
+                writer.writerows([row.get(column) for column in header] for row in rows)
+                f.flush()
+                if JOURNAL_FSYNC:
+                    os.fsync(f.fileno())
+    except OSError as e:
+        logging.error(f"Error appending to {path}: {e}")
+        return False
+    notify_write(file_path, previous_signature, [(None, row) for row in rows])
+    schedule_flush(len(rows))
+    return True
+
+def flush_journal(file_path):
+    """Move the journaled rows of a partitioned table into their months; returns the number of rows moved."""
+    with file_lock(file_path):
+        return flush_journal_locked(file_path)
+
+def flush_journal_locked(file_path):
+    """flush_journal() for a caller already holding file_lock(file_path), e.g. before rewriting a month."""
+    path = journal_path(file_path)
+    if not os.path.exists(path):
+        return 0
+    previous_signature = file_signature(file_path)
+    journal_df = read_journal(file_path)
+    # One write for readers: they see the rows in the journal or in their months, never both
+    with versioned_write(file_path):
+        if not journal_df.empty:
+            for key, rows in journal_df.groupby(journal_df['date'].astype(str).str[:7]):
+                month_df = read_partition(file_path, key)
+                if not month_df.empty:
+                    rows = rows[~rows['id'].isin(month_df['id'])]
+                    month_df = pd.concat([month_df, rows], ignore_index=True)
+                else:
+                    month_df = rows
+                # Written even when every row was already there, so the months' signatures show the flush
+                if not write_csv(month_df, file_path, key):
+                    logging.error(f"Could not flush the journal of {file_path} into {key}")
+                    return 0
+        # Lets the other workers' aggregates take the flushed rows as appended instead of rebuilding
+        record_flush(file_path, previous_signature, split_journal(file_signature(file_path))[0])
+        os.remove(path)
+    # The table holds the same rows as before, so the aggregates only take note of the new signature
+    notify_write(file_path, previous_signature, [])
+    return len(journal_df)
+
+def flush_all():
+    """Flush the journal of every partitioned table that has one."""
+    flushed = 0
+    for file_path in PARTITIONED_TABLES:
+        if os.path.exists(journal_path(file_path)):
+            try:
+                flushed += flush_journal(file_path)
+            except Exception as e:
+                logging.error(f"Error flushing the journal of {file_path}: {e}")
+    return flushed
+
+# Rows appended by this process since its last flush, and the thread flushing them
+_pending = {'rows': 0}
+_wakeup = threading.Condition()
+_flusher = None
+
+def _run_flusher():
+    while True:
+        with _wakeup:
+            while not _pending['rows']:
+                _wakeup.wait()
+            # Give more check-ins the chance to join the batch, unless it is full already
+            if _pending['rows'] < JOURNAL_FLUSH_ROWS:
+                _wakeup.wait(JOURNAL_FLUSH_INTERVAL)
+            _pending['rows'] = 0
+        try:
+            flush_all()
+        except Exception as e:
+            logging.error(f"Error flushing journals: {e}")
+
+def schedule_flush(rows):
+    """Have the flusher thread flush `rows` newly journaled rows, starting it in this process if needed."""
+    global _flusher
+    with _wakeup:
+        _pending['rows'] += rows
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_run_flusher, daemon=True)
+            _flusher.start()
+        # Wake it for the first rows of a batch, to start the interval, and once the batch is full
+        if _pending['rows'] == rows or _pending['rows'] >= JOURNAL_FLUSH_ROWS:
+            _wakeup.notify()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('flush', help='Move every journaled row into its month')
+    parser.parse_args()
+
+    print(f"Flushed {flush_all()} rows")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""
+Server-Sent Events feed of today's attendance for open dashboards.
+
+The feed subscribes to the attendance change events (see events.py) of
+every worker: each recorded or updated check-in of today is published here,
+and each deleted record publishes the new counts. The publisher builds the
+event once from the daily rollups and puts it on the queue of every open
+stream, so more dashboards do not mean more reads. A stream sees the
+check-ins handled by the other workers within EVENT_POLL_INTERVAL.
+"""
+import json
+import time
+import queue
+import logging
+import itertools
+import threading
+from collections import deque
+from flask import Blueprint, Response, stream_with_context
+from auth import login_required
+from utils import read_csv, get_current_date
+from rollups import daily_rollups
+from history import student_directory
+from events import subscribe
+from metrics import inc_counter
+from config import (ATTENDANCE_CSV, STUDENTS_CSV, MEAL_TYPES, LIVE_FEED_HEARTBEAT, LIVE_FEED_QUEUE_SIZE,
+                    LIVE_FEED_RECENT_CHECK_INS, LIVE_FEED_MAX_STREAMS)
+
+live_bp = Blueprint('live', __name__)
+
+def format_event(event, data, event_id=None):
+    """Encode one SSE message."""
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data)}")
+    return '\n'.join(lines) + '\n\n'
+
+def today_counts():
+    """Get today's attendance count and waste per meal type from the daily rollups."""
+    today = get_current_date()
+    meals = {meal_type: {'count': 0, 'waste': 0.0} for meal_type in MEAL_TYPES}
+    for row in daily_rollups.query(today, today):
+        meals[row['meal_type']] = {'count': row['attendance_count'], 'waste': round(row['leftover_sum'], 3)}
+    return {
+        'date': today,
+        'meals': meals,
+        'total_waste': round(sum(meal['waste'] for meal in meals.values()), 3),
+    }
+
+class LiveFeed:
+    """Fan events out from one in-process publisher to the queues of all open streams."""
+
+    def __init__(self, queue_size, recent_size):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._streams = set()
+        self._ids = itertools.count(1)
+        self._recent = deque(maxlen=recent_size)
+        self._recent_date = None
+
+    def subscribe(self):
+        """Open a stream queue, or return None if LIVE_FEED_MAX_STREAMS are already open."""
+        with self._lock:
+            if len(self._streams) >= LIVE_FEED_MAX_STREAMS:
+                return None
+            stream = queue.Queue(self.queue_size)
+            self._streams.add(stream)
+        return stream
+
+    def unsubscribe(self, stream):
+        with self._lock:
+            self._streams.discard(stream)
+
+    def recent_check_ins(self):
+        """Get today's latest check-ins, newest first, loading them from the attendance file on first use each day."""
+        today = get_current_date()
+        with self._lock:
+            if self._recent_date != today:
+                self._recent_date = today
+                self._recent.clear()
+                self._recent.extendleft(load_check_ins(today, self._recent.maxlen))
+            return list(self._recent)
+
+    def snapshot(self):
+        """Get the state a newly connected dashboard starts from."""
+        data = today_counts()
+        data['check_ins'] = self.recent_check_ins()
+        data['sent_at'] = time.time()
+        return data
+
+    def publish(self, event, data):
+        """Encode an event once and queue it on every open stream."""
+        data['sent_at'] = time.time()
+        message = format_event(event, data, next(self._ids))
+        with self._lock:
+            streams = list(self._streams)
+        inc_counter('live_feed_events_total', {'event': event})
+        for stream in streams:
+            try:
+                stream.put_nowait(message)
+            except queue.Full:
+                # Too far behind: close it; EventSource reconnects and starts from a fresh snapshot
+                self.unsubscribe(stream)
+                inc_counter('live_feed_dropped_streams_total')
+                with stream.mutex:
+                    stream.queue.clear()
+                stream.put_nowait(None)
+
+    def publish_check_in(self, check_in):
+        """Publish a recorded or updated check-in together with the new counts."""
+        self.recent_check_ins()
+        with self._lock:
+            for previous in [c for c in self._recent if c['id'] == check_in['id']]:
+                self._recent.remove(previous)
+            self._recent.appendleft(check_in)
+        data = today_counts()
+        data['check_in'] = check_in
+        self.publish('check_in', data)
+
+    def publish_counts(self):
+        """Publish the counts after a change that is not a check-in (e.g. a deleted record)."""
+        self.publish('counts', today_counts())
+
+def load_check_ins(date, limit):
+    """Read the latest check-ins of a day from the attendance file, oldest first."""
+    attendance_df = read_csv(ATTENDANCE_CSV, date, date)
+    students_df = read_csv(STUDENTS_CSV)
+    if attendance_df.empty or students_df.empty:
+        return []
+    day_df = attendance_df[attendance_df['date'] == date].sort_values(by='time').tail(limit)
+    students = students_df.set_index('id')
+    check_ins = []
+    for row in day_df.to_dict('records'):
+        if row['student_id'] in students.index:
+            student = students.loc[row['student_id']]
+            check_ins.append(check_in_event(row, student['name'], student['roll_number']))
+    return check_ins
+
+def check_in_event(attendance, student_name, student_roll, updated=False):
+    """Build the check-in payload from an attendance row."""
+    return {
+        'id': int(attendance['id']),
+        'student_name': str(student_name),
+        'student_roll': str(student_roll),
+        'meal_type': attendance['meal_type'],
+        'time': attendance['time'],
+        'leftover_weight': float(attendance['leftover_weight']),
+        'updated': updated,
+    }
+
+live_feed = LiveFeed(LIVE_FEED_QUEUE_SIZE, LIVE_FEED_RECENT_CHECK_INS)
+
+@subscribe(tables=(ATTENDANCE_CSV,), workers=True)
+def _publish_attendance_changes(events):
+    today = get_current_date()
+    for event in events:
+        if event.op == 'delete':
+            live_feed.publish_counts()
+        elif event.op in ('insert', 'update') and event.row['date'] == today:
+            student = student_directory.lookup(int(event.row['student_id']))
+            if student is not None:
+                live_feed.publish_check_in(check_in_event(event.row, *student, updated=event.op == 'update'))
+
+@live_bp.route('/api/live')
+@login_required
+def live_stream():
+    """Stream today's counts and check-ins as Server-Sent Events."""
+    stream = live_feed.subscribe()
+    if stream is None:
+        # The dashboard falls back to polling
+        return Response('Too many live streams', status=503, headers={'Retry-After': str(LIVE_FEED_HEARTBEAT)})
+
+    def generate():
+        try:
+            yield f"retry: 5000\n{format_event('snapshot', live_feed.snapshot())}"
+            while True:
+                try:
+                    message = stream.get(timeout=LIVE_FEED_HEARTBEAT)
+                except queue.Empty:
+                    # Keeps proxies from closing an idle stream and detects gone clients
+                    yield ': keepalive\n\n'
+                    continue
+                if message is None:
+                    break
+                yield message
+        except Exception as e:
+            logging.error(f"Error in live stream: {e}")
+        finally:
+            live_feed.unsubscribe(stream)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Also covers a client that disconnects before the generator starts
+    response.call_on_close(lambda: live_feed.unsubscribe(stream))
+    return response
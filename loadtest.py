@@ -0,0 +1,91 @@
+"""
+Simple HTTP load test for a running SmartMessManager server.
+
+Logs in once, then hammers the given paths from several client threads and
+reports throughput and latency percentiles. Used to check that throughput
+scales with the gunicorn worker count (see the README):
+
+    python loadtest.py --url http://127.0.0.1:5000 --clients 16 --duration 20 /dashboard /api/food_waste_data
+"""
+import argparse
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+
+def login(base_url, username, password):
+    """Log in and return the session cookie header."""
+    jar = CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    data = urllib.parse.urlencode({'username': username, 'password': password}).encode()
+    opener.open(f"{base_url}/login", data=data, timeout=30).read()
+    cookies = '; '.join(f"{cookie.name}={cookie.value}" for cookie in jar)
+    if 'session=' not in cookies:
+        raise SystemExit('Login failed: no session cookie returned')
+    return cookies
+
+def run_client(base_url, paths, cookies, deadline, latencies, errors, lock):
+    """Request the paths round-robin until the deadline, recording latencies."""
+    local_latencies = []
+    local_errors = 0
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        request = urllib.request.Request(f"{base_url}{path}", headers={'Cookie': cookies})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+        except (urllib.error.URLError, OSError):
+            local_errors += 1
+            continue
+        local_latencies.append(time.perf_counter() - start)
+    with lock:
+        latencies.extend(local_latencies)
+        errors[0] += local_errors
+
+def percentile(sorted_values, pct):
+    """Get the pct-th percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', default=['/dashboard', '/api/dashboard'])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='admin123')
+    args = parser.parse_args()
+
+    cookies = login(args.url, args.username, args.password)
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+    threads = [
+        threading.Thread(target=run_client, args=(args.url, args.paths, cookies, deadline, latencies, errors, lock))
+        for _ in range(args.clients)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"requests: {len(latencies)}  errors: {errors[0]}  duration: {elapsed:.1f}s")
+    print(f"throughput: {len(latencies) / elapsed:.1f} req/s")
+    print("latency ms: p50={:.1f} p95={:.1f} p99={:.1f} max={:.1f}".format(
+        percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000,
+        percentile(latencies, 99) * 1000, (latencies[-1] if latencies else 0) * 1000))
+
+if __name__ == '__main__':
+    main()
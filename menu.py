@@ -1,9 +1,13 @@
-import pandas as pd
 from datetime import datetime
 from flask import Blueprint, request, render_template, redirect, url_for, flash, session
-from utils import read_csv, write_csv, get_next_id, get_current_date, get_today_attendance_count, get_current_day_of_week, get_current_meal_type
+from utils import read_csv, get_next_id, get_current_date, get_today_attendance_count, get_current_day_of_week, get_current_meal_type, lazy_import, partition_key, read_partition, file_lock
 from config import MENU_CSV, DAYS_OF_WEEK, MEAL_TYPES, ATTENDANCE_CSV
 from auth import login_required, admin_required
+from aggregates import write_csv_with_changes
+from tables import read_table
+from menu_index import menu_index
+
+pd = lazy_import('pandas')
 
 menu_bp = Blueprint('menu', __name__)
 
@@ -11,32 +15,11 @@ menu_bp = Blueprint('menu', __name__)
 @login_required
 def view_menu():
     """View and manage the weekly menu."""
-    menu_df = read_csv(MENU_CSV)
-    days = DAYS_OF_WEEK
-    meal_types = MEAL_TYPES
-    
-    # Organize menu by day and meal type
-    menu_by_day = {}
-    for day in days:
-        menu_by_day[day] = {}
-        for meal_type in meal_types:
-            menu_by_day[day][meal_type] = None
-    
-    if not menu_df.empty:
-        for _, row in menu_df.iterrows():
-            day = row.get('day')
-            meal_type = row.get('meal_type')
-            if day in menu_by_day and meal_type in menu_by_day[day]:
-                menu_by_day[day][meal_type] = {
-                    'id': row.get('id'),
-                    'meal_name': row.get('meal_name'),
-                    'description': row.get('description')
-                }
-    
+    # Menu items by day and meal type, built once per version of the menu
     return render_template('menu.html', 
-                          menu_by_day=menu_by_day, 
-                          days=days, 
-                          meal_types=meal_types)
+                          menu_by_day=menu_index.weekly_grid(), 
+                          days=DAYS_OF_WEEK, 
+                          meal_types=MEAL_TYPES)
 
 @menu_bp.route('/menu/add', methods=['GET', 'POST'])
 @admin_required
@@ -54,40 +37,41 @@ def add_menu_item():
             flash('Please fill in all fields', 'danger')
             return render_template('menu_add.html', days=days, meal_types=meal_types)
         
-        # Generate meal_name (e.g., Mon_Breakfast_1)
-        meal_name = f"{day[:3]}_{meal_type[:5]}_{get_next_id(MENU_CSV)}"
-        
-        # Read existing menu
-        menu_df = read_csv(MENU_CSV)
-        
-        # Check if a menu item already exists for this day and meal type
-        if not menu_df.empty:
-            existing_item = menu_df[(menu_df['day'] == day) & (menu_df['meal_type'] == meal_type)]
-            if not existing_item.empty:
-                flash(f'A menu item already exists for {day} {meal_type}. Edit or delete it first.', 'danger')
-                return render_template('menu_add.html', days=days, meal_types=meal_types)
-        
-        # Create new menu item
-        new_menu_item = {
-            'id': get_next_id(MENU_CSV),
-            'day': day,
-            'meal_type': meal_type,
-            'meal_name': meal_name,
-            'description': description
-        }
-        
-        # Add to dataframe
-        if menu_df.empty:
-            menu_df = pd.DataFrame([new_menu_item])
-        else:
-            menu_df = pd.concat([menu_df, pd.DataFrame([new_menu_item])], ignore_index=True)
-        
-        # Save to CSV
-        if write_csv(menu_df, MENU_CSV):
-            flash(f'Menu item for {day} {meal_type} added successfully', 'success')
-            return redirect(url_for('menu.view_menu'))
-        else:
-            flash('Error adding menu item', 'danger')
+        with file_lock(MENU_CSV):
+            # Generate meal_name (e.g., Mon_Breakfast_1)
+            meal_name = f"{day[:3]}_{meal_type[:5]}_{get_next_id(MENU_CSV)}"
+            
+            # Read existing menu
+            menu_df = read_csv(MENU_CSV)
+            
+            # Check if a menu item already exists for this day and meal type
+            if not menu_df.empty:
+                existing_item = menu_df[(menu_df['day'] == day) & (menu_df['meal_type'] == meal_type)]
+                if not existing_item.empty:
+                    flash(f'A menu item already exists for {day} {meal_type}. Edit or delete it first.', 'danger')
+                    return render_template('menu_add.html', days=days, meal_types=meal_types)
+            
+            # Create new menu item
+            new_menu_item = {
+                'id': get_next_id(MENU_CSV),
+                'day': day,
+                'meal_type': meal_type,
+                'meal_name': meal_name,
+                'description': description
+            }
+            
+            # Add to dataframe
+            if menu_df.empty:
+                menu_df = pd.DataFrame([new_menu_item])
+            else:
+                menu_df = pd.concat([menu_df, pd.DataFrame([new_menu_item])], ignore_index=True)
+            
+            # Save to CSV
+            if write_csv_with_changes(menu_df, MENU_CSV, [(None, new_menu_item)]):
+                flash(f'Menu item for {day} {meal_type} added successfully', 'success')
+                return redirect(url_for('menu.view_menu'))
+            else:
+                flash('Error adding menu item', 'danger')
     
     return render_template('menu_add.html', days=days, meal_types=meal_types)
 
@@ -121,31 +105,37 @@ def edit_menu_item(menu_id):
             flash('Please fill in all fields', 'danger')
             return render_template('menu_edit.html', menu_item=menu_item, days=days, meal_types=meal_types)
         
-        # Check if a different menu item already exists for this day and meal type
-        if not menu_df.empty:
-            existing_item = menu_df[(menu_df['day'] == day) & 
-                                    (menu_df['meal_type'] == meal_type) & 
-                                    (menu_df['id'] != menu_id)]
-            if not existing_item.empty:
-                flash(f'Another menu item already exists for {day} {meal_type}', 'danger')
-                return render_template('menu_edit.html', menu_item=menu_item, days=days, meal_types=meal_types)
-        
-        # Update menu item
-        menu_df.loc[menu_df['id'] == menu_id, 'day'] = day
-        menu_df.loc[menu_df['id'] == menu_id, 'meal_type'] = meal_type
-        menu_df.loc[menu_df['id'] == menu_id, 'description'] = description
-        
-        # Only update meal_name if day or meal_type changed
-        if day != menu_item['day'] or meal_type != menu_item['meal_type']:
-            meal_name = f"{day[:3]}_{meal_type[:5]}_{menu_id}"
-            menu_df.loc[menu_df['id'] == menu_id, 'meal_name'] = meal_name
-        
-        # Save to CSV
-        if write_csv(menu_df, MENU_CSV):
-            flash('Menu item updated successfully', 'success')
-            return redirect(url_for('menu.view_menu'))
-        else:
-            flash('Error updating menu item', 'danger')
+        with file_lock(MENU_CSV):
+            # Read again under the lock, so a change made since the form was loaded is not overwritten
+            menu_df = read_csv(MENU_CSV)
+            
+            # Check if a different menu item already exists for this day and meal type
+            if not menu_df.empty:
+                existing_item = menu_df[(menu_df['day'] == day) & 
+                                        (menu_df['meal_type'] == meal_type) & 
+                                        (menu_df['id'] != menu_id)]
+                if not existing_item.empty:
+                    flash(f'Another menu item already exists for {day} {meal_type}', 'danger')
+                    return render_template('menu_edit.html', menu_item=menu_item, days=days, meal_types=meal_types)
+            
+            # Update menu item
+            before = menu_df[menu_df['id'] == menu_id].to_dict('records')
+            menu_df.loc[menu_df['id'] == menu_id, 'day'] = day
+            menu_df.loc[menu_df['id'] == menu_id, 'meal_type'] = meal_type
+            menu_df.loc[menu_df['id'] == menu_id, 'description'] = description
+            
+            # Only update meal_name if day or meal_type changed
+            if day != menu_item['day'] or meal_type != menu_item['meal_type']:
+                meal_name = f"{day[:3]}_{meal_type[:5]}_{menu_id}"
+                menu_df.loc[menu_df['id'] == menu_id, 'meal_name'] = meal_name
+            
+            # Save to CSV
+            after = menu_df[menu_df['id'] == menu_id].to_dict('records')
+            if write_csv_with_changes(menu_df, MENU_CSV, list(zip(before, after))):
+                flash('Menu item updated successfully', 'success')
+                return redirect(url_for('menu.view_menu'))
+            else:
+                flash('Error updating menu item', 'danger')
     
     return render_template('menu_edit.html', 
                           menu_item=menu_item.to_dict(), 
@@ -156,20 +146,22 @@ def edit_menu_item(menu_id):
 @admin_required
 def delete_menu_item(menu_id):
     """Delete a menu item."""
-    menu_df = read_csv(MENU_CSV)
-    
-    if menu_df.empty:
-        flash('No menu items found', 'danger')
-        return redirect(url_for('menu.view_menu'))
-    
-    # Remove the menu item
-    menu_df = menu_df[menu_df['id'] != menu_id]
-    
-    # Save the updated dataframe
-    if write_csv(menu_df, MENU_CSV):
-        flash('Menu item deleted successfully', 'success')
-    else:
-        flash('Error deleting menu item', 'danger')
+    with file_lock(MENU_CSV):
+        menu_df = read_csv(MENU_CSV)
+        
+        if menu_df.empty:
+            flash('No menu items found', 'danger')
+            return redirect(url_for('menu.view_menu'))
+        
+        # Remove the menu item
+        removed = menu_df[menu_df['id'] == menu_id].to_dict('records')
+        menu_df = menu_df[menu_df['id'] != menu_id]
+        
+        # Save the updated dataframe
+        if write_csv_with_changes(menu_df, MENU_CSV, [(row, None) for row in removed]):
+            flash('Menu item deleted successfully', 'success')
+        else:
+            flash('Error deleting menu item', 'danger')
     
     return redirect(url_for('menu.view_menu'))
 
@@ -177,25 +169,19 @@ def delete_menu_item(menu_id):
 @login_required
 def meal_preparation():
     """Record meal preparation data."""
-    menu_df = read_csv(MENU_CSV)
+    # Get all meal names for dropdown
+    meal_options = menu_index.options()
     
-    if menu_df.empty:
+    if not meal_options:
         flash('No menu items available. Please add menu items first.', 'danger')
         return redirect(url_for('menu.view_menu'))
     
-    # Get all meal names for dropdown
-    meal_options = menu_df[['meal_name', 'day', 'meal_type', 'description']].to_dict('records')
-    
     # Get current day and meal type
     current_day = get_current_day_of_week()
     current_meal_type = get_current_meal_type()
     
-    # Find the current meal in the menu options
-    current_meal = None
-    for meal in meal_options:
-        if meal['day'] == current_day and meal['meal_type'] == current_meal_type:
-            current_meal = meal
-            break
+    # Find the current meal in the menu
+    current_meal = menu_index.lookup(current_day, current_meal_type)
     
     # Get the current date
     today = get_current_date()
@@ -253,58 +239,90 @@ def meal_preparation():
                                  today=today,
                                  actual_attendance=actual_attendance)
         
-        # Read meal preparation data
-        from config import MEAL_PREPARATION_CSV
-        meal_prep_df = read_csv(MEAL_PREPARATION_CSV)
+        # Meal type and day are stored with the record, from the menu entry of the meal
+        menu_entry = menu_index.by_name(meal_name)
+        if menu_entry is None:
+            flash('Please select a meal from the menu', 'danger')
+            return render_template('meal_preparation.html', 
+                                 meal_options=meal_options, 
+                                 current_meal=current_meal,
+                                 today=today,
+                                 actual_attendance=actual_attendance)
+        
+        # Records are stored in the partition of their month, so the date has to be valid
+        try:
+            datetime.strptime(date, "%Y-%m-%d")
+        except ValueError:
+            flash('Date must be in YYYY-MM-DD format', 'danger')
+            return render_template('meal_preparation.html', 
+                                 meal_options=meal_options, 
+                                 current_meal=current_meal,
+                                 today=today,
+                                 actual_attendance=actual_attendance)
         
-        # Check if data already exists for this meal and date
-        if not meal_prep_df.empty:
-            existing_data = meal_prep_df[(meal_prep_df['meal_name'] == meal_name) & (meal_prep_df['date'] == date)]
+        from config import MEAL_PREPARATION_CSV
+        with file_lock(MEAL_PREPARATION_CSV):
+            # Read meal preparation data of the record's month
+            month = partition_key(date)
+            meal_prep_df = read_partition(MEAL_PREPARATION_CSV, month)
             
-            if not existing_data.empty:
-                # Update existing record
-                meal_prep_df.loc[(meal_prep_df['meal_name'] == meal_name) & (meal_prep_df['date'] == date), 
-                                'quantity_prepared'] = quantity_prepared
-                meal_prep_df.loc[(meal_prep_df['meal_name'] == meal_name) & (meal_prep_df['date'] == date), 
-                                'expected_students'] = expected_students
-                meal_prep_df.loc[(meal_prep_df['meal_name'] == meal_name) & (meal_prep_df['date'] == date), 
-                                'leftover_weight'] = leftover_weight
-                meal_prep_df.loc[(meal_prep_df['meal_name'] == meal_name) & (meal_prep_df['date'] == date), 
-                                'actual_consumption'] = consumption
-                meal_prep_df.loc[(meal_prep_df['meal_name'] == meal_name) & (meal_prep_df['date'] == date), 
-                                'actual_attendance'] = actual_attendance
-                
-                if write_csv(meal_prep_df, MEAL_PREPARATION_CSV):
-                    flash('Meal preparation data updated successfully', 'success')
-                else:
-                    flash('Error updating meal preparation data', 'danger')
+            # Check if data already exists for this meal and date
+            if not meal_prep_df.empty:
+                existing_data = meal_prep_df[(meal_prep_df['meal_name'] == meal_name) & (meal_prep_df['date'] == date)]
                 
+                if not existing_data.empty:
+                    before = existing_data.to_dict('records')
+                    
+                    # Update existing record
+                    meal_prep_df.loc[(meal_prep_df['meal_name'] == meal_name) & (meal_prep_df['date'] == date), 
+                                    'quantity_prepared'] = quantity_prepared
+                    meal_prep_df.loc[(meal_prep_df['meal_name'] == meal_name) & (meal_prep_df['date'] == date), 
+                                    'expected_students'] = expected_students
+                    meal_prep_df.loc[(meal_prep_df['meal_name'] == meal_name) & (meal_prep_df['date'] == date), 
+                                    'leftover_weight'] = leftover_weight
+                    meal_prep_df.loc[(meal_prep_df['meal_name'] == meal_name) & (meal_prep_df['date'] == date), 
+                                    'actual_consumption'] = consumption
+                    meal_prep_df.loc[(meal_prep_df['meal_name'] == meal_name) & (meal_prep_df['date'] == date), 
+                                    'actual_attendance'] = actual_attendance
+                    meal_prep_df.loc[(meal_prep_df['meal_name'] == meal_name) & (meal_prep_df['date'] == date), 
+                                    'meal_type'] = menu_entry['meal_type']
+                    meal_prep_df.loc[(meal_prep_df['meal_name'] == meal_name) & (meal_prep_df['date'] == date), 
+                                    'day'] = menu_entry['day']
+                    
+                    after = meal_prep_df.loc[existing_data.index].to_dict('records')
+                    if write_csv_with_changes(meal_prep_df, MEAL_PREPARATION_CSV, list(zip(before, after)), month):
+                        flash('Meal preparation data updated successfully', 'success')
+                    else:
+                        flash('Error updating meal preparation data', 'danger')
+                    
+                    return redirect(url_for('menu.meal_preparation_history'))
+            
+            # Create new meal preparation record
+            new_meal_prep = {
+                'id': get_next_id(MEAL_PREPARATION_CSV),
+                'meal_name': meal_name,
+                'meal_type': menu_entry['meal_type'],
+                'day': menu_entry['day'],
+                'date': date,
+                'quantity_prepared': quantity_prepared,
+                'expected_students': expected_students,
+                'leftover_weight': leftover_weight,
+                'actual_consumption': consumption,
+                'actual_attendance': actual_attendance
+            }
+            
+            # Add to dataframe
+            if meal_prep_df.empty:
+                meal_prep_df = pd.DataFrame([new_meal_prep])
+            else:
+                meal_prep_df = pd.concat([meal_prep_df, pd.DataFrame([new_meal_prep])], ignore_index=True)
+            
+            # Save to CSV
+            if write_csv_with_changes(meal_prep_df, MEAL_PREPARATION_CSV, [(None, new_meal_prep)], month):
+                flash('Meal preparation data recorded successfully', 'success')
                 return redirect(url_for('menu.meal_preparation_history'))
-        
-        # Create new meal preparation record
-        new_meal_prep = {
-            'id': get_next_id(MEAL_PREPARATION_CSV),
-            'meal_name': meal_name,
-            'date': date,
-            'quantity_prepared': quantity_prepared,
-            'expected_students': expected_students,
-            'leftover_weight': leftover_weight,
-            'actual_consumption': consumption,
-            'actual_attendance': actual_attendance
-        }
-        
-        # Add to dataframe
-        if meal_prep_df.empty:
-            meal_prep_df = pd.DataFrame([new_meal_prep])
-        else:
-            meal_prep_df = pd.concat([meal_prep_df, pd.DataFrame([new_meal_prep])], ignore_index=True)
-        
-        # Save to CSV
-        if write_csv(meal_prep_df, MEAL_PREPARATION_CSV):
-            flash('Meal preparation data recorded successfully', 'success')
-            return redirect(url_for('menu.meal_preparation_history'))
-        else:
-            flash('Error recording meal preparation data', 'danger')
+            else:
+                flash('Error recording meal preparation data', 'danger')
     
     return render_template('meal_preparation.html', 
                          meal_options=meal_options, 
@@ -317,35 +335,20 @@ def meal_preparation():
 def meal_preparation_history():
     """View meal preparation history."""
     from config import MEAL_PREPARATION_CSV, ATTENDANCE_CSV
-    meal_prep_df = read_csv(MEAL_PREPARATION_CSV)
-    attendance_df = read_csv(ATTENDANCE_CSV)
-    menu_df = read_csv(MENU_CSV)
+    meal_prep_df = read_table(MEAL_PREPARATION_CSV)
+    attendance_df = read_table(ATTENDANCE_CSV)
+    menu_df = read_table(MENU_CSV)
     
     if meal_prep_df.empty:
         return render_template('meal_preparation_history.html', meal_preps=[])
     
-    # Extract meal type from meal name if not present
-    if 'meal_type' not in meal_prep_df.columns:
-        def extract_meal_type(meal_name):
-            if 'Break' in meal_name:
-                return 'Breakfast'
-            elif 'Lunch' in meal_name:
-                return 'Lunch'
-            elif 'Dinner' in meal_name:
-                return 'Dinner'
-            return 'Unknown'
-        
-        meal_prep_df['meal_type'] = meal_prep_df['meal_name'].apply(extract_meal_type)
-    
-    # Convert date columns to datetime for proper merging
-    meal_prep_df['date'] = pd.to_datetime(meal_prep_df['date'])
-    if not attendance_df.empty:
-        attendance_df['date'] = pd.to_datetime(attendance_df['date'])
+    # Attendance figures stored when a record was written are recomputed from the attendance data below
+    meal_prep_df = meal_prep_df.drop(columns=['actual_attendance', 'total_leftover'], errors='ignore')
     
     # Calculate actual attendance and leftover food from attendance data
     if not attendance_df.empty:
         # Group attendance by date and meal type
-        attendance_stats = attendance_df.groupby(['date', 'meal_type']).agg({
+        attendance_stats = attendance_df.groupby(['date', 'meal_type'], observed=True).agg({
             'student_id': 'count',
             'leftover_weight': 'sum'
         }).reset_index()
@@ -370,33 +373,27 @@ def meal_preparation_history():
         meal_prep_df['actual_attendance'] = 0
         meal_prep_df['total_leftover'] = 0
     
-    # Merge with menu information
+    # Add the menu description; meal type and day are stored on the records
     if not menu_df.empty:
-        merged_df = pd.merge(
-            meal_prep_df,
-            menu_df[['meal_name', 'day', 'meal_type', 'description']],
-            on=['meal_name', 'meal_type'],
-            how='left'
-        )
+        descriptions = menu_df.drop_duplicates('meal_name').set_index('meal_name')['description']
+        meal_prep_df['description'] = meal_prep_df['meal_name'].map(descriptions)
     else:
-        merged_df = meal_prep_df
-        merged_df['day'] = ''
-        merged_df['description'] = ''
+        meal_prep_df['description'] = ''
     
     # Sort by date (newest first)
-    merged_df = merged_df.sort_values('date', ascending=False)
+    meal_prep_df = meal_prep_df.sort_values('date', ascending=False)
     
     # Convert date back to string for template
-    merged_df['date'] = merged_df['date'].dt.strftime('%Y-%m-%d')
+    meal_prep_df['date'] = meal_prep_df['date'].dt.strftime('%Y-%m-%d')
     
     # Calculate total statistics
-    total_prepared = merged_df['quantity_prepared'].sum()
-    total_leftover = merged_df['total_leftover'].sum()
-    total_actual = merged_df['actual_attendance'].sum()
-    total_expected = merged_df['expected_students'].sum()
+    total_prepared = meal_prep_df['quantity_prepared'].sum()
+    total_leftover = meal_prep_df['total_leftover'].sum()
+    total_actual = meal_prep_df['actual_attendance'].sum()
+    total_expected = meal_prep_df['expected_students'].sum()
     
     # Add statistics to the template context
-    meal_preps = merged_df.to_dict('records')
+    meal_preps = meal_prep_df.to_dict('records')
     stats = {
         'total_prepared': total_prepared,
         'total_leftover': total_leftover,
@@ -418,13 +415,22 @@ def delete_meal_preparation(prep_id):
         flash('No meal preparation records found', 'danger')
         return redirect(url_for('menu.meal_preparation_history'))
     
-    # Remove the record
-    meal_prep_df = meal_prep_df[meal_prep_df['id'] != prep_id]
+    record = meal_prep_df[meal_prep_df['id'] == prep_id]
+    if record.empty:
+        flash('Meal preparation record not found', 'danger')
+        return redirect(url_for('menu.meal_preparation_history'))
     
-    # Save the updated dataframe
-    if write_csv(meal_prep_df, MEAL_PREPARATION_CSV):
-        flash('Meal preparation record deleted successfully', 'success')
-    else:
-        flash('Error deleting meal preparation record', 'danger')
+    with file_lock(MEAL_PREPARATION_CSV):
+        # Remove the record from the partition of its month
+        month = partition_key(record.iloc[0]['date'])
+        meal_prep_df = read_partition(MEAL_PREPARATION_CSV, month)
+        removed = meal_prep_df[meal_prep_df['id'] == prep_id].to_dict('records')
+        meal_prep_df = meal_prep_df[meal_prep_df['id'] != prep_id]
+        
+        # Save the updated dataframe
+        if write_csv_with_changes(meal_prep_df, MEAL_PREPARATION_CSV, [(row, None) for row in removed], month):
+            flash('Meal preparation record deleted successfully', 'success')
+        else:
+            flash('Error deleting meal preparation record', 'danger')
     
     return redirect(url_for('menu.meal_preparation_history'))
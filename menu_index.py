@@ -0,0 +1,89 @@
+"""
+Weekly menu index, kept up to date on every menu write.
+
+Every check-in looks up the meal being served, and the menu and meal
+preparation pages show the whole week. MenuIndex keeps the menu items by
+(day, meal_type) and by meal name, and the day x meal type grid of the menu
+page, so none of them reads menu.csv. The lookups and the grid are built once
+per version of the menu: after add_menu_item(), edit_menu_item() or
+delete_menu_item() wrote it, or when it changed behind the index's back.
+"""
+from aggregates import FileAggregate
+from utils import read_csv
+from config import MENU_CSV, DAYS_OF_WEEK, MEAL_TYPES
+
+def menu_item(row):
+    """Get the fields the pages use of a menu row."""
+    return {
+        'id': int(row['id']),
+        'day': row['day'],
+        'meal_type': row['meal_type'],
+        'meal_name': row['meal_name'],
+        'description': row['description'],
+    }
+
+class MenuIndex(FileAggregate):
+    """Menu items by id, with lookups by slot and meal name and the weekly grid derived once per menu version."""
+    sources = (MENU_CSV,)
+
+    def __init__(self):
+        super().__init__()
+        self.items = {}
+        self._views = None
+
+    def rebuild(self):
+        menu_df = read_csv(MENU_CSV)
+        self.items = {}
+        for row in menu_df.to_dict('records') if not menu_df.empty else []:
+            self.items[int(row['id'])] = menu_item(row)
+        self._views = None
+
+    def apply(self, file_path, before, after):
+        if before is not None:
+            self.items.pop(int(before['id']), None)
+        if after is not None:
+            self.items[int(after['id'])] = menu_item(after)
+        self._views = None
+
+    def _derive(self):
+        # In id order, so an incremental update and a rebuild pick the same item when a slot has two
+        options = sorted(self.items.values(), key=lambda item: item['id'])
+        slots = {}
+        by_name = {}
+        for item in options:
+            slots.setdefault((item['day'], item['meal_type']), item)
+            by_name.setdefault(item['meal_name'], item)
+        grid = {day: {meal_type: slots.get((day, meal_type)) for meal_type in MEAL_TYPES} for day in DAYS_OF_WEEK}
+        return {'options': options, 'slots': slots, 'by_name': by_name, 'grid': grid}
+
+    def _current_views(self):
+        self.ensure_current()
+        with self._lock:
+            if self._views is None:
+                self._views = self._derive()
+            return self._views
+
+    def lookup(self, day, meal_type):
+        """Get the menu item served at a day and meal type, or None."""
+        return self._current_views()['slots'].get((day, meal_type))
+
+    def by_name(self, meal_name):
+        """Get the menu item with a meal name, or None."""
+        return self._current_views()['by_name'].get(meal_name)
+
+    def options(self):
+        """Get every menu item, in id order."""
+        return self._current_views()['options']
+
+    def weekly_grid(self):
+        """Get {day: {meal_type: menu item or None}} for the menu page; shared, so not to be modified."""
+        return self._current_views()['grid']
+
+menu_index = MenuIndex()
+
+def get_meal_name_from_menu(day, meal_type):
+    """Get the meal name from the menu based on day and meal type."""
+    item = menu_index.lookup(day, meal_type)
+    if item is None:
+        return f"No {meal_type} menu for {day}"
+    return item['meal_name']
@@ -0,0 +1,326 @@
+"""
+Request, storage and cache metrics in the Prometheus text format.
+
+Each process keeps its own counters and histograms. When METRICS_DIR is set
+(gunicorn.conf.py does this), every worker periodically writes a snapshot
+there and /metrics merges the snapshots of all workers, so a scrape that
+lands on any worker reports the whole deployment. When a worker exits, the
+master folds its counters and histograms into a retired snapshot and removes
+its file (retire_worker()), so totals never go back and the directory does
+not fill up as workers are recycled.
+"""
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from flask import g, request, Response, abort
+from config import METRICS_DIR, METRICS_TOKEN, STAGE_TIMING_HEADER
+from startup import register_after_fork
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the per-request CSV operation count buckets
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+
+# Quantiles reported from the most recent request latencies
+QUANTILES = (0.5, 0.95, 0.99)
+RECENT_SAMPLES = 2048
+
+# Seconds between snapshot writes of a worker
+SNAPSHOT_INTERVAL = 1.0
+
+# Snapshot holding the counters and histograms of the workers that exited
+RETIRED_SNAPSHOT = 'retired.json'
+
+METRIC_HELP = {
+    'http_requests_total': ('counter', 'HTTP requests by endpoint, method and status'),
+    'http_request_errors_total': ('counter', 'HTTP requests that ended in a 5xx response'),
+    'http_request_duration_seconds': ('histogram', 'Request latency by endpoint'),
+    'http_request_duration_recent_seconds': ('summary', 'Latency quantiles over the most recent requests per endpoint'),
+    'csv_operations_total': ('counter', 'CSV file reads and writes'),
+    'csv_operations_per_request': ('histogram', 'CSV reads and writes done while serving one request'),
+    'cache_requests_total': ('counter', 'Cache lookups by namespace and result'),
+    'live_feed_events_total': ('counter', 'Events published to the live dashboard feed'),
+    'live_feed_dropped_streams_total': ('counter', 'Live feed streams closed because the client fell too far behind'),
+    'table_memory_bytes': ('gauge', 'Memory of the last typed load of each table (largest across workers)'),
+    'face_pipeline_stage_seconds': ('histogram', 'Time spent per stage of the attendance and registration flows, by gallery size and frame resolution'),
+}
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_recent = {}
+_last_snapshot = [0.0]
+
+@register_after_fork
+def reset_metrics():
+    """Start a forked worker with empty metrics instead of a copy of the master's."""
+    global _lock
+    _lock = threading.Lock()
+    _counters.clear()
+    _gauges.clear()
+    _histograms.clear()
+    _recent.clear()
+
+def _key(name, labels):
+    return (name, tuple(sorted((labels or {}).items())))
+
+def register_metric(name, metric_type, help_text):
+    """Declare the type and help text of a metric recorded elsewhere."""
+    METRIC_HELP[name] = (metric_type, help_text)
+
+def inc_counter(name, labels=None, amount=1):
+    """Increment a counter."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def set_gauge(name, value, labels=None):
+    """Set a gauge to its current value."""
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+def observe(name, value, labels=None, buckets=LATENCY_BUCKETS):
+    """Record a value in a histogram."""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {'buckets': list(buckets), 'counts': [0] * (len(buckets) + 1), 'sum': 0.0}
+        histogram['counts'][bisect.bisect_left(histogram['buckets'], value)] += 1
+        histogram['sum'] += value
+
+def observe_recent(name, value, labels=None):
+    """Keep a value in the bounded sample used for the quantile summary."""
+    key = _key(name, labels)
+    with _lock:
+        samples = _recent.get(key)
+        if samples is None:
+            samples = _recent[key] = deque(maxlen=RECENT_SAMPLES)
+        samples.append(value)
+
+def record_csv_operation(operation, file_path):
+    """Count a CSV read or write, globally and for the current request."""
+    inc_counter('csv_operations_total', {'operation': operation, 'file': os.path.basename(file_path)})
+    if g:
+        counts = g.setdefault('csv_operations', {})
+        counts[operation] = counts.get(operation, 0) + 1
+
+def record_cache(namespace, hit):
+    """Count a cache hit or miss."""
+    inc_counter('cache_requests_total', {'namespace': namespace, 'result': 'hit' if hit else 'miss'})
+
+def start_stage_timing(flow):
+    """Start collecting per-stage timings for the current request."""
+    g.stage_flow = flow
+    g.stage_timings = {}
+    g.stage_labels = {}
+
+@contextmanager
+def stage_timer(stage):
+    """Time a block as one stage of the current flow; a no-op when no flow is being timed."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if g and 'stage_timings' in g:
+            g.stage_timings[stage] = g.stage_timings.get(stage, 0.0) + (time.perf_counter() - start)
+
+def set_stage_labels(**labels):
+    """Attach labels such as gallery size or frame resolution to the current flow's stage timings."""
+    if g and 'stage_labels' in g:
+        g.stage_labels.update({name: str(value) for name, value in labels.items()})
+
+def _record_stages(response):
+    stage_timings = g.pop('stage_timings', None)
+    if not stage_timings:
+        return
+    labels = {'flow': g.pop('stage_flow'), 'gallery_size': 'n/a', 'resolution': 'n/a'}
+    labels.update(g.pop('stage_labels', {}))
+    for stage, seconds in stage_timings.items():
+        observe('face_pipeline_stage_seconds', seconds, dict(labels, stage=stage))
+    if STAGE_TIMING_HEADER:
+        response.headers['Server-Timing'] = ', '.join(
+            f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in stage_timings.items()
+        )
+
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+def _record_request(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or 'unmatched'
+    inc_counter('http_requests_total', {'endpoint': endpoint, 'method': request.method, 'status': str(response.status_code)})
+    if response.status_code >= 500:
+        inc_counter('http_request_errors_total', {'endpoint': endpoint})
+    observe('http_request_duration_seconds', elapsed, {'endpoint': endpoint})
+    observe_recent('http_request_duration_recent_seconds', elapsed, {'endpoint': endpoint})
+    for operation, count in g.pop('csv_operations', {}).items():
+        observe('csv_operations_per_request', count, {'endpoint': endpoint, 'operation': operation}, buckets=COUNT_BUCKETS)
+    _record_stages(response)
+    if METRICS_DIR and time.monotonic() - _last_snapshot[0] >= SNAPSHOT_INTERVAL:
+        write_snapshot()
+    return response
+
+def _snapshot():
+    with _lock:
+        return {
+            'counters': [[name, labels, value] for (name, labels), value in _counters.items()],
+            'gauges': [[name, labels, value] for (name, labels), value in _gauges.items()],
+            'histograms': [[name, labels, h['buckets'], h['counts'], h['sum']] for (name, labels), h in _histograms.items()],
+            'recent': [[name, labels, list(samples)] for (name, labels), samples in _recent.items()],
+        }
+
+def _write_json(path, data):
+    os.makedirs(METRICS_DIR, mode=0o700, exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_snapshot():
+    """Write this process's metrics to METRICS_DIR for the other workers to merge."""
+    _last_snapshot[0] = time.monotonic()
+    try:
+        _write_json(os.path.join(METRICS_DIR, f"{os.getpid()}.json"), _snapshot())
+    except OSError as e:
+        logging.error(f"Error writing metrics snapshot: {e}")
+
+def _monotonic(snapshot):
+    """Keep only the counters and histograms of a snapshot: the gauges and recent samples of a dead process are stale."""
+    return {'counters': snapshot['counters'], 'histograms': snapshot['histograms']}
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def retire_worker(pid):
+    """Fold an exited worker's counters and histograms into the retired snapshot and remove its file; run by the gunicorn master."""
+    if not METRICS_DIR:
+        return
+    path = os.path.join(METRICS_DIR, f"{pid}.json")
+    snapshot = _read_json(path)
+    try:
+        if snapshot is not None:
+            retired_path = os.path.join(METRICS_DIR, RETIRED_SNAPSHOT)
+            snapshots = [_monotonic(snapshot)]
+            retired = _read_json(retired_path)
+            if retired is not None:
+                snapshots.append(retired)
+            counters, _, histograms, _ = _merge(snapshots)
+            _write_json(retired_path, {
+                'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+                'histograms': [[name, labels, h['buckets'], h['counts'], h['sum']] for (name, labels), h in histograms.items()],
+            })
+        if os.path.exists(path):
+            os.remove(path)
+    except OSError as e:
+        logging.error(f"Error retiring the metrics of worker {pid}: {e}")
+
+def _collect():
+    """Get all metrics, merged across workers when METRICS_DIR is set."""
+    snapshots = [_snapshot()]
+    if METRICS_DIR and os.path.isdir(METRICS_DIR):
+        own = f"{os.getpid()}.json"
+        for filename in os.listdir(METRICS_DIR):
+            if not filename.endswith('.json') or filename == own:
+                continue
+            snapshot = _read_json(os.path.join(METRICS_DIR, filename))
+            if snapshot is None:
+                continue
+            # Retired workers, and any that died without being retired, only count towards the totals
+            pid = filename[:-len('.json')]
+            if filename == RETIRED_SNAPSHOT or not pid.isdigit() or not _is_running(int(pid)):
+                snapshot = _monotonic(snapshot)
+            snapshots.append(snapshot)
+    return _merge(snapshots)
+
+def _merge(snapshots):
+    counters, gauges, histograms, recent = {}, {}, {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, value in snapshot.get('gauges', []):
+            key = (name, tuple(map(tuple, labels)))
+            gauges[key] = max(gauges.get(key, value), value)
+        for name, labels, buckets, counts, total in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, {'buckets': buckets, 'counts': [0] * len(counts), 'sum': 0.0})
+            merged['counts'] = [a + b for a, b in zip(merged['counts'], counts)]
+            merged['sum'] += total
+        for name, labels, samples in snapshot.get('recent', []):
+            recent.setdefault((name, tuple(map(tuple, labels))), []).extend(samples)
+    return counters, gauges, histograms, recent
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in pairs
+    ) + '}'
+
+def render_metrics():
+    """Render all metrics in the Prometheus text exposition format."""
+    counters, gauges, histograms, recent = _collect()
+    by_name = {}
+    for (name, labels), value in sorted(list(counters.items()) + list(gauges.items())):
+        by_name.setdefault(name, []).append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), histogram in sorted(histograms.items(), key=lambda item: item[0]):
+        lines = by_name.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(histogram['buckets'] + ['+Inf'], histogram['counts']):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+        lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    for (name, labels), samples in sorted(recent.items(), key=lambda item: item[0]):
+        lines = by_name.setdefault(name, [])
+        samples = sorted(samples)
+        for quantile in QUANTILES:
+            value = samples[min(len(samples) - 1, int(quantile * len(samples)))]
+            lines.append(f"{name}{_format_labels(labels, [('quantile', quantile)])} {value}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {sum(samples)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {len(samples)}")
+
+    output = []
+    for name in sorted(by_name):
+        metric_type, help_text = METRIC_HELP.get(name, ('untyped', name))
+        output.append(f"# HELP {name} {help_text}")
+        output.append(f"# TYPE {name} {metric_type}")
+        output.extend(by_name[name])
+    return '\n'.join(output) + '\n'
+
+def metrics_endpoint():
+    """Serve the metrics, optionally protected by a bearer token."""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        abort(403)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+def init_metrics(app):
+    """Attach request timing to the app and expose /metrics."""
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
@@ -0,0 +1,123 @@
+"""
+One-off migrations of the CSV data files.
+
+Each migration checks whether it is still needed, so running them again is
+harmless; create_app() runs them after init_data_files().
+
+Usage:
+    python migrations.py        # run every pending migration
+"""
+import os
+import csv
+import logging
+from utils import read_csv, write_csv, file_lock, lazy_import, partition_files
+from config import MENU_CSV, MEAL_PREPARATION_CSV, MEAL_TYPES, DAYS_OF_WEEK, PARTITIONED_TABLES
+
+pd = lazy_import('pandas')
+
+def partition_tables():
+    """
+    Split the single-file attendance and meal preparation tables into monthly partitions.
+
+    The original file is removed once every month has been written.
+
+    Returns:
+        Number of records moved
+    """
+    moved = 0
+    for file_path in PARTITIONED_TABLES:
+        with file_lock(file_path):
+            if not os.path.isfile(file_path):
+                continue
+            # Read the old file directly: read_csv() of a partitioned table only looks at its months
+            legacy_df = pd.read_csv(file_path) if os.path.getsize(file_path) > 0 else pd.DataFrame()
+            if not legacy_df.empty:
+                # Keep any months already written in the new layout
+                existing_df = read_csv(file_path)
+                df = pd.concat([existing_df, legacy_df], ignore_index=True) if not existing_df.empty else legacy_df
+                if not write_csv(df, file_path):
+                    raise RuntimeError(f"Could not partition {file_path}")
+            os.remove(file_path)
+            moved += len(legacy_df)
+    return moved
+
+# Columns meal_preparation.csv gained, inserted after meal_name
+MEAL_PREPARATION_MENU_COLUMNS = ['meal_type', 'day']
+
+def infer_from_meal_name(meal_name):
+    """Guess (meal_type, day) from a meal name such as 'Mon_Lunch_1', for meals no longer on the menu."""
+    parts = str(meal_name).lower().split('_')
+    day = next((day for day in DAYS_OF_WEEK if parts[0] and day.lower().startswith(parts[0])), None)
+    meal_type = None
+    if len(parts) > 1:
+        meal_type = next((meal_type for meal_type in MEAL_TYPES if parts[1] and meal_type.lower().startswith(parts[1])), None)
+    return meal_type, day
+
+def lacks_columns(file_path, columns):
+    """Check from the CSV headers alone whether any file of a table lacks some columns, without loading pandas."""
+    for path in partition_files(file_path) if file_path in PARTITIONED_TABLES else [file_path]:
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            continue
+        with open(path, newline='') as f:
+            header = next(csv.reader(f), [])
+        if any(column not in header for column in columns):
+            return True
+    return False
+
+def backfill_meal_preparation_menu_columns():
+    """
+    Store meal_type and day on every meal preparation record.
+
+    They are taken from the menu entry of the record's meal name, or guessed
+    from the name itself when the menu no longer has it.
+
+    Returns:
+        Number of records backfilled
+    """
+    with file_lock(MEAL_PREPARATION_CSV):
+        # Run on every startup, so the common case (nothing to do) must not read the table
+        if not lacks_columns(MEAL_PREPARATION_CSV, MEAL_PREPARATION_MENU_COLUMNS):
+            return 0
+        meal_prep_df = read_csv(MEAL_PREPARATION_CSV)
+        missing = [column for column in MEAL_PREPARATION_MENU_COLUMNS if column not in meal_prep_df.columns]
+        if meal_prep_df.empty or not missing:
+            return 0
+
+        menu_df = read_csv(MENU_CSV)
+        menu = {}
+        if not menu_df.empty:
+            for row in menu_df.to_dict('records'):
+                menu.setdefault(row['meal_name'], (row['meal_type'], row['day']))
+
+        values = [menu.get(meal_name) or infer_from_meal_name(meal_name) for meal_name in meal_prep_df['meal_name']]
+        unknown = sum(1 for meal_type, day in values if meal_type is None or day is None)
+        if unknown:
+            logging.error(f"Could not determine the meal type or day of {unknown} meal preparation records")
+
+        position = meal_prep_df.columns.get_loc('meal_name') + 1
+        for offset, column in enumerate(MEAL_PREPARATION_MENU_COLUMNS):
+            if column in missing:
+                meal_prep_df.insert(min(position + offset, len(meal_prep_df.columns)), column,
+                                    [value[offset] for value in values])
+
+        if not write_csv(meal_prep_df, MEAL_PREPARATION_CSV):
+            raise RuntimeError(f"Could not write {MEAL_PREPARATION_CSV}")
+        return len(meal_prep_df)
+
+# Run in order; each returns the number of records it changed
+MIGRATIONS = [partition_tables, backfill_meal_preparation_menu_columns]
+
+def run_migrations():
+    """Run every migration that still has work to do."""
+    for migration in MIGRATIONS:
+        try:
+            changed = migration()
+        except Exception as e:
+            logging.error(f"Migration {migration.__name__} failed: {e}")
+            continue
+        if changed:
+            logging.info(f"Migration {migration.__name__} updated {changed} records")
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    run_migrations()
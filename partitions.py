@@ -0,0 +1,139 @@
+"""
+Compaction of the monthly partitions of the attendance and meal preparation tables.
+
+Each table in config.PARTITIONED_TABLES is a directory with one CSV per month
+(data/attendance/2026-10.csv). utils.read_csv() and write_csv() handle the
+layout, and writers only rewrite the month of the records they change.
+
+Once a month is over it is compacted: its rows are sorted by date, time and
+id, and it is recorded as final in the directory's manifest together with its
+row count and id range. A later edit to a final month, such as a deleted
+record, changes its file signature, so the month is compacted again on the
+next run. create_app() compacts on startup.
+
+Usage:
+    python partitions.py status     # months, rows and state per table
+    python partitions.py compact    # compact every month before the current one
+"""
+import os
+import json
+import logging
+import argparse
+from aggregates import write_csv_with_changes
+from utils import (file_lock, file_signature, list_partitions, partition_key, partition_path, read_partition, get_current_date,
+                   replace_atomically)
+from config import ATTENDANCE_CSV, MEAL_PREPARATION_CSV, PARTITIONED_TABLES
+
+# Order of the rows of a compacted month
+SORT_COLUMNS = {
+    ATTENDANCE_CSV: ['date', 'time', 'id'],
+    MEAL_PREPARATION_CSV: ['date', 'id'],
+}
+
+def manifest_path(file_path):
+    return os.path.join(PARTITIONED_TABLES[file_path], '_manifest.json')
+
+def read_manifest(file_path):
+    """Get the {month: entry} manifest of a partitioned table's final months."""
+    try:
+        with open(manifest_path(file_path)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.error(f"Error reading the partition manifest of {file_path}: {e}")
+        return {}
+
+def write_manifest(file_path, manifest):
+    def write(path):
+        with open(path, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+    replace_atomically(manifest_path(file_path), write)
+
+def is_final(manifest, file_path, key):
+    """Check whether a month is compacted and has not been written since."""
+    entry = manifest.get(key)
+    signature = file_signature(partition_path(file_path, key))
+    return entry is not None and signature is not None and tuple(entry['signature']) == signature
+
+def compact_partitions(file_path, before=None):
+    """
+    Compact every month of a partitioned table before `before` (YYYY-MM, default the current month) that is not final.
+
+    Returns:
+        List of the months compacted
+    """
+    before = before or partition_key(get_current_date())
+    compacted = []
+    with file_lock(file_path):
+        manifest = read_manifest(file_path)
+        for key in list_partitions(file_path):
+            if key >= before or is_final(manifest, file_path, key):
+                continue
+            month_df = read_partition(file_path, key)
+            if month_df.empty:
+                continue
+            sorted_df = month_df.sort_values(SORT_COLUMNS[file_path], kind='stable')
+            # Reordering changes no row, so the aggregates only take note of the new signature
+            if not sorted_df.index.equals(month_df.index) and not write_csv_with_changes(sorted_df, file_path, [], key):
+                logging.error(f"Could not compact {partition_path(file_path, key)}")
+                continue
+            manifest[key] = {
+                'rows': len(sorted_df),
+                'min_id': int(sorted_df['id'].min()),
+                'max_id': int(sorted_df['id'].max()),
+                'signature': list(file_signature(partition_path(file_path, key))),
+            }
+            compacted.append(key)
+        # Months that no longer exist drop out of the manifest
+        existing = set(list_partitions(file_path))
+        for key in [key for key in manifest if key not in existing]:
+            del manifest[key]
+        write_manifest(file_path, manifest)
+    return compacted
+
+def compact_all():
+    """Compact the past months of every partitioned table."""
+    for file_path in PARTITIONED_TABLES:
+        try:
+            compacted = compact_partitions(file_path)
+        except Exception as e:
+            logging.error(f"Error compacting {file_path}: {e}")
+            continue
+        if compacted:
+            logging.info(f"Compacted {len(compacted)} months of {file_path}")
+
+def partition_status(file_path):
+    """Get month, rows (for final months), bytes and state of every partition of a table."""
+    manifest = read_manifest(file_path)
+    current = partition_key(get_current_date())
+    status = []
+    for key in list_partitions(file_path):
+        final = is_final(manifest, file_path, key)
+        status.append({
+            'month': key,
+            'rows': manifest[key]['rows'] if final else None,
+            'bytes': os.path.getsize(partition_path(file_path, key)),
+            'state': 'final' if final else 'open' if key >= current else 'pending',
+        })
+    return status
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('status', help='Print the months of each partitioned table')
+    subparsers.add_parser('compact', help='Compact every month before the current one')
+    args = parser.parse_args()
+
+    if args.command == 'compact':
+        logging.basicConfig(level=logging.INFO)
+        compact_all()
+        return
+    for file_path in PARTITIONED_TABLES:
+        print(PARTITIONED_TABLES[file_path])
+        for row in partition_status(file_path):
+            rows = row['rows'] if row['rows'] is not None else '-'
+            print(f"  {row['month']:<10}{rows:>10}{row['bytes']:>14,}  {row['state']}")
+
+if __name__ == '__main__':
+    main()
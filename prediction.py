@@ -1,18 +1,32 @@
-import pandas as pd
-import numpy as np
 import os
 import pickle
 from datetime import datetime, timedelta
-from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_absolute_error
-from utils import read_csv
+from utils import read_csv, lazy_import, file_signature
+from tables import read_table
+from snapshots import read_columns
+from cache import get_cache
 from config import ATTENDANCE_CSV, MENU_CSV, MEAL_PREPARATION_CSV, MEAL_TYPES, DAYS_OF_WEEK, MODEL_DIR
 
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+
 # Model file paths
 ATTENDANCE_MODEL_PATH = os.path.join(MODEL_DIR, 'attendance_model.pkl')
 FOOD_MODEL_PATH = os.path.join(MODEL_DIR, 'food_model.pkl')
 
+# Unpickled models by path, versioned by the signature of the model file
+model_cache = get_cache('prediction_models')
+
+def load_model(model_path):
+    """Load a pickled model file, reusing the loaded copy until the file changes."""
+    signature = file_signature(model_path)
+    model = model_cache.get(model_path, signature)
+    if model is None:
+        with open(model_path, 'rb') as f:
+            model = pickle.load(f)
+        model_cache.set(model_path, model, signature)
+    return model
+
 def get_day_of_week(date_str):
     """Get the day of the week (0=Monday, 6=Sunday) from a date string."""
     dt = datetime.strptime(date_str, "%Y-%m-%d")
@@ -20,21 +34,26 @@ def get_day_of_week(date_str):
 
 def train_prediction_model():
     """Train a model to predict meal attendance based on historical data."""
+    # scikit-learn is only needed for training, so import it on demand
+    from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+    from sklearn.model_selection import train_test_split
+    from sklearn.metrics import mean_absolute_error
+    
     # Make sure the model directory exists
     if not os.path.exists(MODEL_DIR):
         os.makedirs(MODEL_DIR)
     
-    # Read attendance data
-    attendance_df = read_csv(ATTENDANCE_CSV)
+    # Read the attendance columns the model needs
+    attendance_df = read_columns(ATTENDANCE_CSV, ['date', 'meal_type'])
     
     if attendance_df.empty:
         return False
     
     # Count daily attendance by meal type
-    attendance_counts = attendance_df.groupby(['date', 'meal_type']).size().reset_index(name='count')
+    attendance_counts = attendance_df.groupby(['date', 'meal_type'], observed=True).size().reset_index(name='count')
     
     # Add day of week feature
-    attendance_counts['day_of_week'] = attendance_counts['date'].apply(get_day_of_week)
+    attendance_counts['day_of_week'] = attendance_counts['date'].dt.dayofweek
     
     # Check if we have enough data
     if len(attendance_counts) < 14:  # Need at least 2 weeks of data
@@ -95,8 +114,7 @@ def predict_meal_attendance(date_str):
             return None
     
     try:
-        with open(ATTENDANCE_MODEL_PATH, 'rb') as f:
-            models = pickle.load(f)
+        models = load_model(ATTENDANCE_MODEL_PATH)
     except:
         return None
     
@@ -126,10 +144,10 @@ def predict_meal_attendance(date_str):
             predictions[meal_type] = max(0, int(round(predicted_count)))  # Ensure non-negative integer
         else:
             # Use average attendance if no model is available
-            attendance_df = read_csv(ATTENDANCE_CSV)
+            attendance_df = read_columns(ATTENDANCE_CSV, ['date', 'meal_type'])
             if not attendance_df.empty:
                 # Filter for same day of week and meal type
-                mask = (attendance_df['date'].apply(get_day_of_week) == day_of_week) & (attendance_df['meal_type'] == meal_type)
+                mask = (attendance_df['date'].dt.dayofweek == day_of_week) & (attendance_df['meal_type'] == meal_type)
                 avg_attendance = attendance_df[mask].groupby('date').size().mean()
                 predictions[meal_type] = max(0, int(round(avg_attendance))) if not np.isnan(avg_attendance) else 0
             else:
@@ -146,7 +164,7 @@ def generate_meal_recommendations(date_str):
         return None
     
     # Get menu for the day
-    menu_df = read_csv(MENU_CSV)
+    menu_df = read_table(MENU_CSV)
     
     if menu_df.empty:
         return None
@@ -159,26 +177,12 @@ def generate_meal_recommendations(date_str):
     day_menu = menu_df[menu_df['day'] == day_name]
     
     # Get meal preparation history
-    meal_prep_df = read_csv(MEAL_PREPARATION_CSV)
+    meal_prep_df = read_columns(MEAL_PREPARATION_CSV, ['meal_type', 'quantity_prepared', 'expected_students', 'leftover_weight'])
     
     # Calculate average food per student
     food_per_student = {}
     
     if not meal_prep_df.empty and 'leftover_weight' in meal_prep_df.columns:
-        # Extract meal type from meal name
-        def extract_meal_type(meal_name):
-            if 'Break' in meal_name:
-                return 'Breakfast'
-            elif 'Lunch' in meal_name:
-                return 'Lunch'
-            elif 'Dinner' in meal_name:
-                return 'Dinner'
-            return None
-        
-        # Add meal type if not present
-        if 'meal_type' not in meal_prep_df.columns:
-            meal_prep_df['meal_type'] = meal_prep_df['meal_name'].apply(extract_meal_type)
-        
         # Calculate actual consumption
         meal_prep_df['actual_consumption'] = meal_prep_df['quantity_prepared'] - meal_prep_df['leftover_weight']
         
@@ -233,71 +237,29 @@ def generate_meal_recommendations(date_str):
     
     return recommendations
 
-def extract_features_from_meal_name(meal_name):
-    """Extract features from meal name (e.g., 'Mon_Lunch_2' -> 'Monday', 'Lunch')."""
-    parts = meal_name.split('_')
-    
-    # Extract day
-    day_abbr = parts[0].lower()
-    day = None
-    for d in DAYS_OF_WEEK:
-        if d.lower().startswith(day_abbr):
-            day = d
-            break
-    
-    # Extract meal type
-    meal_type = None
-    if len(parts) > 1:
-        meal_part = parts[1].lower()
-        for mt in MEAL_TYPES:
-            if mt.lower().startswith(meal_part):
-                meal_type = mt
-                break
-    
-    return day, meal_type
-
 def train_food_prediction_model():
     """Train a model to predict food quantities based on historical data."""
+    # scikit-learn is only needed for training, so import it on demand
+    from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+    from sklearn.model_selection import train_test_split
+    from sklearn.metrics import mean_absolute_error
+    
     # Ensure model directory exists
     if not os.path.exists(MODEL_DIR):
         os.makedirs(MODEL_DIR)
     
-    # Read meal preparation data
-    meal_prep_df = read_csv(MEAL_PREPARATION_CSV)
-    menu_df = read_csv(MENU_CSV)
-    attendance_df = read_csv(ATTENDANCE_CSV)
+    # Read the meal preparation and attendance columns the models need
+    meal_prep_df = read_columns(MEAL_PREPARATION_CSV, ['date', 'day', 'meal_type', 'quantity_prepared',
+                                                       'expected_students', 'leftover_weight'])
+    attendance_df = read_columns(ATTENDANCE_CSV, ['date', 'meal_type'])
     
     # Check if we have enough data
     if meal_prep_df.empty or len(meal_prep_df) < 14:  # Need at least 2 weeks of data
         return False
     
     # Process meal preparation data
-    meal_prep_df['date'] = pd.to_datetime(meal_prep_df['date'])
     meal_prep_df['day_of_week'] = meal_prep_df['date'].dt.dayofweek
     
-    # Always extract meal type from meal name to ensure it's available
-    def extract_meal_type(meal_name):
-        if 'Break' in meal_name:
-            return 'Breakfast'
-        elif 'Lunch' in meal_name:
-            return 'Lunch'
-        elif 'Dinner' in meal_name:
-            return 'Dinner'
-        return 'Unknown'
-    
-    # Apply the function to extract meal type
-    meal_prep_df['meal_type'] = meal_prep_df['meal_name'].apply(extract_meal_type)
-    
-    # Extract day from the menu data if available and day column is not present
-    if 'day' not in meal_prep_df.columns:
-        if not menu_df.empty:
-            menu_df = menu_df[['meal_name', 'day', 'meal_type']]
-            meal_prep_df = pd.merge(meal_prep_df, menu_df, on='meal_name', how='left')
-        else:
-            # Extract from meal name if menu data is not available
-            extracted = meal_prep_df['meal_name'].apply(extract_features_from_meal_name)
-            meal_prep_df['day'] = extracted.apply(lambda x: x[0])
-    
     # Calculate actual consumption if available
     if 'leftover_weight' in meal_prep_df.columns:
         meal_prep_df['actual_consumption'] = meal_prep_df['quantity_prepared'] - meal_prep_df['leftover_weight']
@@ -308,25 +270,8 @@ def train_food_prediction_model():
     # Add attendance information if available
     if not attendance_df.empty:
         # Count daily attendance by date and meal type
-        attendance_counts = attendance_df.groupby(['date', 'meal_type']).size().reset_index(name='attendance_count')
-        
-        # Convert date to datetime for joining
-        attendance_counts['date'] = pd.to_datetime(attendance_counts['date'])
+        attendance_counts = attendance_df.groupby(['date', 'meal_type'], observed=True).size().reset_index(name='attendance_count')
         
-        # Ensure meal_type exists in meal_prep_df
-        # Extract meal type if it doesn't exist
-        if 'meal_type' not in meal_prep_df.columns:
-            def extract_meal_type(meal_name):
-                if 'Break' in meal_name:
-                    return 'Breakfast'
-                elif 'Lunch' in meal_name:
-                    return 'Lunch'
-                elif 'Dinner' in meal_name:
-                    return 'Dinner'
-                return 'Unknown'
-            
-            meal_prep_df['meal_type'] = meal_prep_df['meal_name'].apply(extract_meal_type)
-            
         # Join with meal preparation data
         meal_prep_df = pd.merge(
             meal_prep_df,
@@ -412,10 +357,9 @@ def predict_food_quantity_for_week():
     # Try to load models only if the file exists
     if os.path.exists(FOOD_MODEL_PATH):
         try:
-            with open(FOOD_MODEL_PATH, 'rb') as f:
-                model_data = pickle.load(f)
-                models = model_data['models']
-                feature_names = model_data['feature_names']
+            model_data = load_model(FOOD_MODEL_PATH)
+            models = model_data['models']
+            feature_names = model_data['feature_names']
         except:
             # If loading fails, models will remain None and we'll use the fallback
             print("Could not load food prediction models, using fallback estimation instead")
@@ -424,10 +368,9 @@ def predict_food_quantity_for_week():
         success = train_food_prediction_model()
         if success:
             try:
-                with open(FOOD_MODEL_PATH, 'rb') as f:
-                    model_data = pickle.load(f)
-                    models = model_data['models']
-                    feature_names = model_data['feature_names']
+                model_data = load_model(FOOD_MODEL_PATH)
+                models = model_data['models']
+                feature_names = model_data['feature_names']
             except:
                 print("Could not load newly trained food prediction models, using fallback estimation instead")
     
@@ -442,14 +385,14 @@ def predict_food_quantity_for_week():
     start_date = today + timedelta(days=days_until_monday)
     
     # Get attendance data from the attendance model
-    attendance_df = read_csv(ATTENDANCE_CSV)
-    menu_df = read_csv(MENU_CSV)
-    meal_prep_df = read_csv(MEAL_PREPARATION_CSV)
+    attendance_df = read_columns(ATTENDANCE_CSV, ['date', 'meal_type'])
+    menu_df = read_table(MENU_CSV)
+    # All columns: the fallback estimate uses actual_consumption where records have it stored
+    meal_prep_df = read_table(MEAL_PREPARATION_CSV)
     
     # Calculate average attendance for each day and meal type
     if not attendance_df.empty:
         # Add day of week
-        attendance_df['date'] = pd.to_datetime(attendance_df['date'])
         attendance_df['day_of_week'] = attendance_df['date'].dt.dayofweek
         
         # Map day of week to day name
@@ -457,39 +400,17 @@ def predict_food_quantity_for_week():
         attendance_df['day'] = attendance_df['day_of_week'].map(day_map)
         
         # Group by day and meal type
-        attendance_counts = attendance_df.groupby(['day', 'meal_type']).size().reset_index(name='attendance_count')
+        attendance_counts = attendance_df.groupby(['day', 'meal_type'], observed=True).size().reset_index(name='attendance_count')
     else:
         # Create empty DataFrame if no attendance data
         attendance_counts = pd.DataFrame(columns=['day', 'meal_type', 'attendance_count'])
     
     # Calculate average expected students for each day and meal type
     if not meal_prep_df.empty:
-        meal_prep_df['date'] = pd.to_datetime(meal_prep_df['date'])
         meal_prep_df['day_of_week'] = meal_prep_df['date'].dt.dayofweek
         
-        # Always extract meal type from meal name
-        def extract_meal_type(meal_name):
-            if 'Break' in meal_name:
-                return 'Breakfast'
-            elif 'Lunch' in meal_name:
-                return 'Lunch'
-            elif 'Dinner' in meal_name:
-                return 'Dinner'
-            return 'Unknown'
-        
-        meal_prep_df['meal_type'] = meal_prep_df['meal_name'].apply(extract_meal_type)
-        
-        # Extract day if needed
-        if 'day' not in meal_prep_df.columns:
-            if not menu_df.empty:
-                menu_df = menu_df[['meal_name', 'day']]
-                meal_prep_df = pd.merge(meal_prep_df, menu_df, on='meal_name', how='left')
-            else:
-                extracted = meal_prep_df['meal_name'].apply(extract_features_from_meal_name)
-                meal_prep_df['day'] = extracted.apply(lambda x: x[0])
-        
         # Group by day and meal type
-        expected_students = meal_prep_df.groupby(['day', 'meal_type'])['expected_students'].mean().reset_index()
+        expected_students = meal_prep_df.groupby(['day', 'meal_type'], observed=True)['expected_students'].mean().reset_index()
     else:
         # Create empty DataFrame if no meal prep data
         expected_students = pd.DataFrame(columns=['day', 'meal_type', 'expected_students'])
@@ -547,21 +468,6 @@ def predict_food_quantity_for_week():
                 # Get menu item description if available
                 meal_description = "Standard meal"
                 if not menu_df.empty:
-                    # Extract meal type from menu if not present
-                    if 'meal_type' not in menu_df.columns:
-                        # First try to get meal type from menu name
-                        def extract_meal_type(meal_name):
-                            if isinstance(meal_name, str):
-                                if 'Break' in meal_name:
-                                    return 'Breakfast'
-                                elif 'Lunch' in meal_name:
-                                    return 'Lunch'
-                                elif 'Dinner' in meal_name:
-                                    return 'Dinner'
-                            return 'Unknown'
-                        
-                        menu_df['meal_type'] = menu_df['meal_name'].apply(extract_meal_type)
-                    
                     # Try to find matching menu item
                     try:
                         menu_item = menu_df[(menu_df['day'] == current_day) & (menu_df['meal_type'] == meal_type)]
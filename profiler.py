@@ -0,0 +1,171 @@
+import os
+import re
+import sys
+import json
+import time
+import cProfile
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from urllib.parse import urlsplit, unquote
+from flask import Blueprint, request, render_template, redirect, url_for, flash, session, g, send_from_directory, abort
+from config import PROFILES_DIR, PROFILES_KEEP, PROFILE_SAMPLE_INTERVAL
+from auth import admin_required
+
+profiler_bp = Blueprint('profiler', __name__)
+
+PROFILE_MODES = {'cprofile': 'cProfile + sampled stacks', 'sample': 'Sampling only (low overhead)'}
+
+class StackSampler(threading.Thread):
+    """Periodically sample one thread's call stack and count the collapsed stacks."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if frames:
+                self.stacks[';'.join(reversed(frames))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+@profiler_bp.before_app_request
+def start_profiling():
+    """Profile this request if an admin armed the profiler for its path."""
+    armed = session.get('profile_next')
+    if not armed or session.get('role') != 'admin' or armed.get('path') != request.path:
+        return
+    session.pop('profile_next')
+
+    g.profile_mode = armed.get('mode', 'cprofile')
+    g.profile_started = time.perf_counter()
+    g.profile_sampler = StackSampler(threading.get_ident(), PROFILE_SAMPLE_INTERVAL)
+    g.profile_sampler.start()
+    if g.profile_mode == 'cprofile':
+        g.profile = cProfile.Profile()
+        g.profile.enable()
+
+@profiler_bp.after_app_request
+def record_profile_status(response):
+    """Remember the status of a profiled request for its metadata."""
+    if 'profile_sampler' in g:
+        g.profile_status = response.status_code
+    return response
+
+@profiler_bp.teardown_app_request
+def stop_profiling(exc):
+    """Stop the profiler started for this request and save its output, even if the view failed."""
+    if 'profile_sampler' not in g:
+        return
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile.disable()
+    sampler = g.pop('profile_sampler')
+    sampler.stop()
+    duration = time.perf_counter() - g.pop('profile_started')
+
+    try:
+        save_profile(g.pop('profile_mode'), duration, g.pop('profile_status', 500), profile, sampler.stacks)
+    except OSError as e:
+        logging.error(f"Error saving profile: {e}")
+
+def save_profile(mode, duration, status_code, profile, stacks):
+    """Write the pstats, collapsed stacks and metadata of one profiled request."""
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    endpoint = re.sub(r'[^A-Za-z0-9_.-]', '_', request.endpoint or 'unmatched')
+    name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}_{endpoint}"
+    base_path = os.path.join(PROFILES_DIR, name)
+
+    files = []
+    if profile is not None:
+        profile.dump_stats(base_path + '.pstats')
+        files.append(name + '.pstats')
+    with open(base_path + '.collapsed', 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    files.append(name + '.collapsed')
+
+    meta = {
+        'name': name,
+        'path': request.full_path.rstrip('?'),
+        'endpoint': request.endpoint,
+        'mode': mode,
+        'status': status_code,
+        'duration_ms': round(duration * 1000, 1),
+        'samples': sum(stacks.values()),
+        'user': session.get('username'),
+        'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'files': files,
+    }
+    with open(base_path + '.json', 'w') as f:
+        json.dump(meta, f)
+    prune_profiles()
+
+def list_profiles():
+    """Get the metadata of the stored profiles, newest first."""
+    if not os.path.isdir(PROFILES_DIR):
+        return []
+    profiles = []
+    for filename in sorted(os.listdir(PROFILES_DIR), reverse=True):
+        if filename.endswith('.json'):
+            try:
+                with open(os.path.join(PROFILES_DIR, filename)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return profiles
+
+def prune_profiles():
+    """Delete all but the PROFILES_KEEP most recent profiles."""
+    for meta in list_profiles()[PROFILES_KEEP:]:
+        for filename in meta['files'] + [meta['name'] + '.json']:
+            try:
+                os.remove(os.path.join(PROFILES_DIR, filename))
+            except OSError:
+                pass
+
+def is_local_path(path):
+    """Check that a path redirects within this site: no scheme or host, and no backslash or control character a browser could read as one."""
+    if not path.startswith('/') or '\\' in path or any(ord(char) < 32 or ord(char) == 127 for char in path):
+        return False
+    parts = urlsplit(path)
+    return not parts.scheme and not parts.netloc
+
+@profiler_bp.route('/admin/profiles', methods=['GET', 'POST'])
+@admin_required
+def profiles():
+    """List recent profiles and arm the profiler for the next request to a page."""
+    if request.method == 'POST':
+        path = request.form.get('path', '').strip()
+        mode = request.form.get('mode', 'cprofile')
+
+        if not is_local_path(path) or mode not in PROFILE_MODES:
+            flash('Please provide a path starting with / and a valid profiling mode', 'danger')
+        else:
+            # The next request this admin makes to the path is profiled; request.path has no query string
+            session['profile_next'] = {'path': unquote(urlsplit(path).path), 'mode': mode}
+            flash(f'Profiling the next request to {path}', 'info')
+            return redirect(path)
+
+    return render_template('profiles.html', profiles=list_profiles(), modes=PROFILE_MODES)
+
+@profiler_bp.route('/admin/profiles/<path:filename>')
+@admin_required
+def download_profile(filename):
+    """Download a stored pstats or collapsed stack file."""
+    if not filename.endswith(('.pstats', '.collapsed')):
+        abort(404)
+    return send_from_directory(os.path.abspath(PROFILES_DIR), filename, as_attachment=True)
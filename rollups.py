@@ -0,0 +1,220 @@
+from functools import lru_cache
+from datetime import datetime, timedelta
+from aggregates import FileAggregate
+from utils import read_csv
+from config import ATTENDANCE_CSV, MEAL_PREPARATION_CSV, MEAL_TYPES
+
+# Fields kept per (date, meal_type)
+ROLLUP_FIELDS = ['attendance_count', 'leftover_sum', 'quantity_prepared', 'expected_students', 'preparations']
+
+class DailyRollups(FileAggregate):
+    """
+    Per (date, meal_type) attendance count, leftover sum, quantity prepared and expected students.
+
+    A slot with several preparations reports the quantity and expected students
+    of its first one (the lowest id), like the wastage figures always have, and
+    counts them in 'preparations'.
+    """
+    sources = (ATTENDANCE_CSV, MEAL_PREPARATION_CSV)
+
+    def __init__(self):
+        super().__init__()
+        self.days = {}
+        # (date, meal_type) -> {preparation id: (quantity_prepared, expected_students)}
+        self.preparations = {}
+
+    def _slot(self, date, meal_type):
+        slot = self.days.get((date, meal_type))
+        if slot is None:
+            slot = self.days[(date, meal_type)] = [0, 0.0, 0.0, 0, 0]
+        return slot
+
+    def _set_preparation(self, date, meal_type, preparation_id, values):
+        preparations = self.preparations.setdefault((date, meal_type), {})
+        if values is None:
+            preparations.pop(preparation_id, None)
+        else:
+            preparations[preparation_id] = values
+        slot = self._slot(date, meal_type)
+        slot[2], slot[3] = preparations[min(preparations)] if preparations else (0.0, 0)
+        slot[4] = len(preparations)
+        if not preparations:
+            del self.preparations[(date, meal_type)]
+
+    def rebuild(self):
+        self.days = {}
+        self.preparations = {}
+        attendance_df = read_csv(ATTENDANCE_CSV)
+        if not attendance_df.empty:
+            grouped = attendance_df.groupby(['date', 'meal_type'])['leftover_weight'].agg(['size', 'sum'])
+            for (date, meal_type), row in grouped.iterrows():
+                slot = self._slot(date, meal_type)
+                slot[0] = int(row['size'])
+                slot[1] = float(row['sum'])
+
+        meal_prep_df = read_csv(MEAL_PREPARATION_CSV)
+        if not meal_prep_df.empty:
+            columns = meal_prep_df[['id', 'date', 'meal_type', 'quantity_prepared', 'expected_students']]
+            for preparation_id, date, meal_type, quantity, expected in columns.itertuples(index=False):
+                self._set_preparation(date, meal_type, int(preparation_id), (float(quantity), int(expected)))
+
+    def apply(self, file_path, before, after):
+        if file_path == ATTENDANCE_CSV:
+            for row, sign in ((before, -1), (after, 1)):
+                if row is not None:
+                    slot = self._slot(row['date'], row['meal_type'])
+                    slot[0] += sign
+                    slot[1] += sign * float(row['leftover_weight'])
+        else:
+            if before is not None:
+                self._set_preparation(before['date'], before['meal_type'], int(before['id']), None)
+            if after is not None:
+                self._set_preparation(after['date'], after['meal_type'], int(after['id']),
+                                      (float(after['quantity_prepared']), int(after['expected_students'])))
+
+    def query(self, start_date=None, end_date=None):
+        """
+        Get the rollup rows in a date range (inclusive, YYYY-MM-DD strings), sorted by date and meal type.
+
+        With both bounds given the work is proportional to the number of days
+        in the window; without them it is proportional to the number of days
+        that have any data.
+        """
+        self.ensure_current()
+        with self._lock:
+            if start_date and end_date:
+                keys = [
+                    (date, meal_type)
+                    for date in date_range(start_date, end_date)
+                    for meal_type in MEAL_TYPES
+                    if (date, meal_type) in self.days
+                ]
+            else:
+                keys = sorted(
+                    key for key in self.days
+                    if (not start_date or key[0] >= start_date) and (not end_date or key[0] <= end_date)
+                )
+            return [
+                dict(zip(['date', 'meal_type'] + ROLLUP_FIELDS, list(key) + list(self.days[key])))
+                for key in keys
+            ]
+
+    def daily_leftover(self, start_date, end_date):
+        """Get (dates, leftover totals) for every day in a window, with 0 for days without data."""
+        self.ensure_current()
+        with self._lock:
+            dates = date_range(start_date, end_date)
+            values = [
+                sum(self.days[(date, meal_type)][1] for meal_type in MEAL_TYPES if (date, meal_type) in self.days)
+                for date in dates
+            ]
+        return dates, values
+
+class AttendanceCube(FileAggregate):
+    """
+    Attendance count and leftover sum per meal type and per student, at day, ISO week and month granularity.
+
+    A date range is answered by merging the coarsest buckets that exactly
+    cover it (a year is about 11 months, a few weeks and a few days), so the
+    cost depends on the number of buckets, not on the number of rows.
+    """
+    sources = (ATTENDANCE_CSV,)
+    dimensions = ('meal_type', 'student_id')
+
+    def __init__(self):
+        super().__init__()
+        self.buckets = {}
+
+    def _add(self, date, meal_type, student_id, count, leftover_sum):
+        for bucket_key in bucket_keys(date):
+            bucket = self.buckets.setdefault(bucket_key, {dimension: {} for dimension in self.dimensions})
+            for dimension, value in (('meal_type', meal_type), ('student_id', student_id)):
+                totals = bucket[dimension].setdefault(value, [0, 0.0])
+                totals[0] += count
+                totals[1] += leftover_sum
+                if totals[0] == 0:
+                    del bucket[dimension][value]
+
+    def rebuild(self):
+        self.buckets = {}
+        attendance_df = read_csv(ATTENDANCE_CSV)
+        if attendance_df.empty:
+            return
+        grouped = attendance_df.groupby(['date', 'meal_type', 'student_id'])['leftover_weight'].agg(['size', 'sum'])
+        for date, meal_type, student_id, size, total in grouped.reset_index().itertuples(index=False):
+            self._add(date, meal_type, int(student_id), int(size), float(total))
+
+    def apply(self, file_path, before, after):
+        for row, sign in ((before, -1), (after, 1)):
+            if row is not None:
+                self._add(row['date'], row['meal_type'], int(row['student_id']), sign, sign * float(row['leftover_weight']))
+
+    def totals(self, start_date, end_date, dimension):
+        """Get {value: [attendance_count, leftover_sum]} of a dimension over a date range (inclusive)."""
+        self.ensure_current()
+        merged = {}
+        with self._lock:
+            for bucket_key in cover(start_date, end_date):
+                bucket = self.buckets.get(bucket_key)
+                if bucket is None:
+                    continue
+                for value, (count, leftover) in bucket[dimension].items():
+                    totals = merged.setdefault(value, [0, 0.0])
+                    totals[0] += count
+                    totals[1] += leftover
+        return merged
+
+    def daily(self, start_date, end_date):
+        """Get (date, meal_type, attendance_count, leftover_sum) for every day and meal with attendance in a range."""
+        self.ensure_current()
+        with self._lock:
+            return [
+                (date, meal_type, count, leftover)
+                for date in date_range(start_date, end_date)
+                for meal_type, (count, leftover) in sorted(self.buckets.get(('day', date), {}).get('meal_type', {}).items())
+            ]
+
+@lru_cache(maxsize=4096)
+def bucket_keys(date):
+    """Get the day, ISO week (keyed by its Monday) and month (keyed by its 1st) buckets of a YYYY-MM-DD date."""
+    day = datetime.strptime(date, "%Y-%m-%d")
+    monday = day - timedelta(days=day.weekday())
+    return (('day', date), ('week', monday.strftime("%Y-%m-%d")), ('month', date[:8] + '01'))
+
+def cover(start_date, end_date):
+    """
+    Split an inclusive date range into few day, week and month buckets that exactly cover it.
+
+    Whole months are taken where they fit; a week is not used if it would
+    run into a month that could otherwise be taken whole.
+    """
+    day = datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d")
+    buckets = []
+    while day <= end:
+        next_month = first_of_next_month(day)
+        week_end = day + timedelta(days=6)
+        if day.day == 1 and next_month - timedelta(days=1) <= end:
+            buckets.append(('month', day.strftime("%Y-%m-%d")))
+            day = next_month
+        elif day.weekday() == 0 and week_end <= end and (
+                week_end < next_month or first_of_next_month(next_month) - timedelta(days=1) > end):
+            buckets.append(('week', day.strftime("%Y-%m-%d")))
+            day = week_end + timedelta(days=1)
+        else:
+            buckets.append(('day', day.strftime("%Y-%m-%d")))
+            day += timedelta(days=1)
+    return buckets
+
+def first_of_next_month(day):
+    """Get the first day of the month after the given datetime's."""
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def date_range(start_date, end_date):
+    """List the YYYY-MM-DD dates from start_date to end_date inclusive."""
+    start = datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d")
+    return [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((end - start).days + 1)]
+
+daily_rollups = DailyRollups()
+attendance_cube = AttendanceCube()
@@ -0,0 +1,240 @@
+"""
+Columnar snapshots of the attendance, meal preparation and student tables.
+
+Analytics and model training need only a few columns of these tables, but a
+CSV can only be parsed whole. A snapshot is a table as tables.read_table()
+loads it (declared types, categoricals as Arrow dictionaries), written as an
+Arrow IPC (Feather v2) file: one per month of a partitioned table, e.g.
+data/snapshots/attendance/2026-10.arrow, and one per other table, e.g.
+data/snapshots/students.arrow.
+
+Each snapshot records the file_signature() of the CSV it was taken from.
+read_columns() memory-maps the snapshots whose CSV is unchanged and decodes
+only the columns asked for; a month written since its snapshot is read from
+the CSV instead. Snapshots are refreshed in a background thread after every
+write, which only rewrites the months that changed, and by `python
+snapshots.py build`.
+
+pyarrow is optional: without it, read_columns() reads the CSVs through
+read_table().
+
+Usage:
+    python snapshots.py build                 # refresh stale snapshots
+    python snapshots.py benchmark [--repeat N]  # time CSV and snapshot reads
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+from events import subscribe
+from utils import (file_signature, list_partitions, partition_path, journal_path, ensure_dir_exists, lazy_import,
+                   consistent_read, replace_atomically)
+from tables import table_files, read_typed_csv, read_columns_for, apply_schema, select_rows, read_table, table_cache
+from metrics import record_cache, stage_timer
+from config import (TABLE_SCHEMAS, PARTITIONED_TABLES, SNAPSHOT_DIR, SNAPSHOT_TABLES, SNAPSHOT_COMPRESSION,
+                    ATTENDANCE_CSV, MEAL_PREPARATION_CSV)
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    # Snapshots are skipped and every read goes to the CSV files
+    pa = feather = None
+
+pd = lazy_import('pandas')
+
+# Schema metadata key holding the signature of the CSV a snapshot was taken from
+SOURCE_SIGNATURE_KEY = b'source_signature'
+
+def table_name(file_path):
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+def snapshot_path(file_path, key=None):
+    """Get the snapshot of a table, or of one month (YYYY-MM key) of a partitioned table."""
+    if key is None:
+        return os.path.join(SNAPSHOT_DIR, table_name(file_path) + '.arrow')
+    return os.path.join(SNAPSHOT_DIR, table_name(file_path), key + '.arrow')
+
+def snapshot_pieces(file_path, start_date=None, end_date=None):
+    """
+    Get (csv_path, snapshot_path) of every piece of a table, limited to the months overlapping a date range.
+
+    A partitioned table's journal comes last, without a snapshot: it only
+    holds the rows of the last few moments.
+    """
+    if file_path in PARTITIONED_TABLES:
+        pieces = [(partition_path(file_path, key), snapshot_path(file_path, key))
+                  for key in list_partitions(file_path, start_date, end_date)]
+        if os.path.exists(journal_path(file_path)):
+            pieces.append((journal_path(file_path), None))
+        return pieces
+    return [(file_path, snapshot_path(file_path))]
+
+def snapshot_signature(path):
+    """Get the CSV signature a snapshot was taken from, or None if there is no readable snapshot."""
+    try:
+        with pa.memory_map(path) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+    signature = metadata.get(SOURCE_SIGNATURE_KEY)
+    return tuple(json.loads(signature)) if signature else None
+
+def write_snapshot(file_path, csv_path, path):
+    """Snapshot one CSV file of a table; returns False if it is empty or could not be read."""
+    signature = file_signature(csv_path)
+    if signature is None or signature[1] == 0:
+        return False
+    df = read_typed_csv(csv_path, TABLE_SCHEMAS[file_path])
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[SOURCE_SIGNATURE_KEY] = json.dumps(signature).encode()
+    ensure_dir_exists(os.path.dirname(path))
+    replace_atomically(path, lambda temp_path: feather.write_feather(
+        table.replace_schema_metadata(metadata), temp_path, compression=SNAPSHOT_COMPRESSION))
+    return True
+
+def refresh_snapshots(file_paths=SNAPSHOT_TABLES):
+    """
+    Bring the snapshots of some tables up to date with their CSV files.
+
+    Only pieces whose CSV changed are rewritten, and snapshots of months that
+    no longer exist are removed.
+
+    Returns:
+        Number of snapshots written
+    """
+    if pa is None:
+        return 0
+    written = 0
+    for file_path in file_paths:
+        pieces = snapshot_pieces(file_path)
+        for csv_path, path in pieces:
+            if path is None or snapshot_signature(path) == file_signature(csv_path):
+                continue
+            try:
+                with stage_timer('snapshot_write'):
+                    written += write_snapshot(file_path, csv_path, path)
+            except (OSError, ValueError, TypeError, pa.ArrowException) as e:
+                logging.error(f"Error writing snapshot of {csv_path}: {e}")
+        if file_path in PARTITIONED_TABLES:
+            current = {path for _, path in pieces}
+            directory = os.path.dirname(snapshot_path(file_path, '0000-00'))
+            for name in os.listdir(directory) if os.path.isdir(directory) else []:
+                if name.endswith('.arrow') and os.path.join(directory, name) not in current:
+                    os.remove(os.path.join(directory, name))
+    return written
+
+def read_columns(file_path, columns=None, start_date=None, end_date=None):
+    """
+    Read some columns of a table with its declared schema, from the snapshots where they are current.
+
+    Returns the same frame as read_table(file_path, start_date, end_date, columns).
+    """
+    if pa is None or file_path not in SNAPSHOT_TABLES:
+        return read_table(file_path, start_date, end_date, columns)
+    schema = TABLE_SCHEMAS[file_path]
+    wanted = None if columns is None else read_columns_for(schema, columns, start_date, end_date)
+
+    def read():
+        frames = []
+        for csv_path, path in snapshot_pieces(file_path, start_date, end_date):
+            if file_signature(csv_path) is None:
+                continue
+            current = path is not None and snapshot_signature(path) == file_signature(csv_path)
+            if path is not None:
+                record_cache('table_snapshots', current)
+            if current:
+                frames.append(feather.read_table(path, columns=wanted, memory_map=True).to_pandas())
+            elif os.path.getsize(csv_path) > 0:
+                frames.append(read_typed_csv(csv_path, schema, wanted))
+        return frames
+
+    try:
+        with stage_timer('storage_read'):
+            frames = consistent_read(file_path, read) if file_path in PARTITIONED_TABLES else read()
+    except (OSError, ValueError, TypeError, pa.ArrowException) as e:
+        logging.error(f"Error reading snapshots of {file_path}: {e}")
+        return read_table(file_path, start_date, end_date, columns)
+    if not frames:
+        return pd.DataFrame()
+    df = apply_schema(pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0], schema)
+    return select_rows(df, start_date, end_date, columns)
+
+# Refreshes requested while one was running; picked up before the thread exits
+_refresh_pending = threading.Event()
+_refresh_lock = threading.Lock()
+
+def _refresh_in_background():
+    try:
+        while _refresh_pending.is_set():
+            _refresh_pending.clear()
+            refresh_snapshots()
+    except Exception as e:
+        logging.error(f"Error refreshing snapshots: {e}")
+    finally:
+        _refresh_lock.release()
+
+def schedule_snapshot_refresh():
+    """Refresh the snapshots in a background thread, unless one is already running (it then runs once more)."""
+    _refresh_pending.set()
+    if pa is not None and _refresh_lock.acquire(blocking=False):
+        threading.Thread(target=_refresh_in_background, daemon=True).start()
+
+@subscribe(tables=SNAPSHOT_TABLES)
+def _refresh_snapshots_on_write(events):
+    schedule_snapshot_refresh()
+
+# Columns read by the analytics and training code, benchmarked by `python snapshots.py benchmark`
+BENCHMARK_READS = [
+    ('attendance counts', ATTENDANCE_CSV, ['date', 'meal_type']),
+    ('meal preparation', MEAL_PREPARATION_CSV, ['date', 'day', 'meal_type', 'quantity_prepared',
+                                               'expected_students', 'leftover_weight']),
+]
+
+def benchmark(repeat):
+    """Get the best time of `repeat` reads of each benchmarked table from CSV and from snapshots."""
+    results = []
+    for name, file_path, columns in BENCHMARK_READS:
+        timings = {}
+        for source, read in (('csv', read_table), ('snapshot', read_columns)):
+            best = None
+            for _ in range(repeat):
+                # read_table() caches its frames; every timed read has to parse the files
+                table_cache.clear()
+                start = time.perf_counter()
+                df = read(file_path, columns=columns)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings[source] = best
+        results.append({'read': name, 'rows': len(df), 'columns': len(columns),
+                        'csv_seconds': timings['csv'], 'snapshot_seconds': timings['snapshot'],
+                        'csv_bytes': sum(os.path.getsize(path) for path in table_files(file_path)),
+                        'snapshot_bytes': sum(os.path.getsize(path) for _, path in snapshot_pieces(file_path)
+                                              if path and os.path.exists(path))})
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('build', help='Refresh the snapshots whose CSV changed')
+    bench = subparsers.add_parser('benchmark', help='Time reads of the analytics columns from CSV and from snapshots')
+    bench.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if pa is None:
+        parser.exit(1, "pyarrow is not installed; snapshots are disabled\n")
+    written = refresh_snapshots()
+    if args.command == 'build':
+        print(f"Wrote {written} snapshots")
+        return
+    print(f"{'read':<20}{'rows':>10}{'csv ms':>10}{'snap ms':>10}{'speedup':>9}{'csv bytes':>14}{'snap bytes':>14}")
+    for row in benchmark(args.repeat):
+        speedup = row['csv_seconds'] / row['snapshot_seconds'] if row['snapshot_seconds'] else 0
+        print(f"{row['read']:<20}{row['rows']:>10}{row['csv_seconds'] * 1000:>10.1f}"
+              f"{row['snapshot_seconds'] * 1000:>10.1f}{speedup:>8.1f}x{row['csv_bytes']:>14,}{row['snapshot_bytes']:>14,}")
+
+if __name__ == '__main__':
+    main()
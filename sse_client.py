@@ -0,0 +1,113 @@
+"""
+Test client for the live dashboard feed (/api/live).
+
+Opens several Server-Sent Events streams against a running server and
+reports how many events each received and how long they took to arrive
+after being published. With --check-in-image it also records check-ins
+from a face image at a steady rate so there is something to fan out:
+
+    python sse_client.py --clients 50 --duration 30 --check-in-image static/student_images/student_5.jpg
+
+Run it on the server machine; delivery latency compares the server's
+publish timestamp with the local clock.
+"""
+import json
+import time
+import base64
+import argparse
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from loadtest import login, percentile
+
+def run_stream(base_url, cookies, stats, lock):
+    """Read one event stream, recording event counts and delivery latencies."""
+    request = urllib.request.Request(f"{base_url}/api/live", headers={'Cookie': cookies, 'Accept': 'text/event-stream'})
+    try:
+        response = urllib.request.urlopen(request, timeout=60)
+    except urllib.error.HTTPError as e:
+        with lock:
+            stats['refused'] += 1 if e.code == 503 else 0
+            stats['errors'] += 0 if e.code == 503 else 1
+        return
+    except (urllib.error.URLError, OSError):
+        with lock:
+            stats['errors'] += 1
+        return
+
+    with lock:
+        stats['connected'] += 1
+    event = None
+    try:
+        for raw_line in response:
+            line = raw_line.decode().rstrip('\n')
+            if line.startswith('event: '):
+                event = line[len('event: '):]
+            elif line.startswith('data: '):
+                data = json.loads(line[len('data: '):])
+                with lock:
+                    stats['events'][event] += 1
+                    if event != 'snapshot':
+                        stats['latencies'].append(time.time() - data['sent_at'])
+    except OSError:
+        with lock:
+            stats['disconnected'] += 1
+
+def run_check_ins(base_url, cookies, image_path, interval, deadline, stats, lock):
+    """Post check-ins with the same face image every interval seconds until the deadline."""
+    with open(image_path, 'rb') as f:
+        image_data = 'data:image/jpeg;base64,' + base64.b64encode(f.read()).decode()
+    i = 0
+    while time.perf_counter() < deadline:
+        i += 1
+        data = urllib.parse.urlencode({'image_data': image_data, 'leftover_weight': f"{i % 10 / 10:.1f}"}).encode()
+        request = urllib.request.Request(f"{base_url}/attendance", data=data, headers={'Cookie': cookies})
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+            with lock:
+                stats['check_ins'] += 1
+        except (urllib.error.URLError, OSError):
+            with lock:
+                stats['errors'] += 1
+        time.sleep(interval)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='admin123')
+    parser.add_argument('--check-in-image', help='Face image to record check-ins with while listening')
+    parser.add_argument('--check-in-interval', type=float, default=1.0)
+    args = parser.parse_args()
+
+    cookies = login(args.url, args.username, args.password)
+    stats = {'connected': 0, 'refused': 0, 'disconnected': 0, 'errors': 0, 'check_ins': 0,
+             'events': Counter(), 'latencies': []}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    # Streams never end on their own; daemon threads are dropped at exit
+    for _ in range(args.clients):
+        threading.Thread(target=run_stream, args=(args.url, cookies, stats, lock), daemon=True).start()
+    if args.check_in_image:
+        threading.Thread(target=run_check_ins, daemon=True, args=(
+            args.url, cookies, args.check_in_image, args.check_in_interval, deadline, stats, lock)).start()
+    time.sleep(args.duration)
+
+    with lock:
+        latencies = sorted(stats['latencies'])
+        events = dict(stats['events'])
+        print(f"streams: {stats['connected']} connected, {stats['refused']} refused (503), "
+              f"{stats['disconnected']} dropped, {stats['errors']} errors")
+        print(f"check-ins posted: {stats['check_ins']}  events received: {events}")
+        print("delivery latency ms: p50={:.1f} p95={:.1f} p99={:.1f} max={:.1f}".format(
+            percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000,
+            percentile(latencies, 99) * 1000, (latencies[-1] if latencies else 0) * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import os
+import time
+import logging
+from contextlib import contextmanager
+
+# Seconds spent in each startup phase, in the order they ran
+STARTUP_TIMINGS = {}
+
+# Callbacks that reopen per-process resources in a freshly forked worker
+_after_fork_callbacks = []
+
+@contextmanager
+def startup_phase(name):
+    """Record how long a startup phase takes in STARTUP_TIMINGS."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_TIMINGS[name] = STARTUP_TIMINGS.get(name, 0.0) + (time.perf_counter() - start)
+
+def log_startup_timings():
+    """Log the startup-time breakdown recorded so far."""
+    total = sum(STARTUP_TIMINGS.values())
+    breakdown = ', '.join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in STARTUP_TIMINGS.items())
+    logging.info(f"Startup took {total * 1000:.1f}ms ({breakdown})")
+
+def warm_up():
+    """
+    Load heavy dependencies and shared resources ahead of the first request.
+
+    Importing the app only creates lazy module placeholders; calling this
+    resolves them up front, e.g. once per worker at boot, so that no request
+    pays for importing pandas, OpenCV or scikit-learn.
+    """
+    with startup_phase('warm_pandas'):
+        from utils import pd
+        pd.DataFrame
+    with startup_phase('warm_face_detector'):
+        from face_recognition_utils import get_face_cascade
+        get_face_cascade()
+    with startup_phase('warm_sklearn'):
+        import sklearn.ensemble
+
+def warm_shared_state():
+    """
+    Load the face gallery, menu index, attendance index and prediction models, refresh the table
+    snapshots and load the analysis payload.
+
+    Run in the gunicorn master before workers fork so that every worker
+    starts with these already in memory, shared copy-on-write.
+    """
+    warm_up()
+    with startup_phase('warm_face_gallery'):
+        from face_recognition_utils import load_face_gallery
+        load_face_gallery()
+    with startup_phase('warm_menu_index'):
+        from menu_index import menu_index
+        menu_index.weekly_grid()
+    with startup_phase('warm_attendance_index'):
+        from history import attendance_index, student_directory
+        from rollups import attendance_cube
+        attendance_index.ensure_current()
+        student_directory.ensure_current()
+        attendance_cube.ensure_current()
+        from student_stats import student_stats
+        student_stats.ensure_current()
+        from attendance_bitmap import attendance_bitmap
+        attendance_bitmap.ensure_current()
+    with startup_phase('warm_prediction_models'):
+        from prediction import load_model, ATTENDANCE_MODEL_PATH, FOOD_MODEL_PATH
+        for model_path in (ATTENDANCE_MODEL_PATH, FOOD_MODEL_PATH):
+            if os.path.exists(model_path):
+                try:
+                    load_model(model_path)
+                except Exception as e:
+                    logging.error(f"Error preloading model {model_path}: {e}")
+    with startup_phase('warm_snapshots'):
+        from snapshots import refresh_snapshots
+        refresh_snapshots()
+    with startup_phase('warm_analysis_payload'):
+        from analytics import get_analysis_payload
+        get_analysis_payload()
+    log_startup_timings()
+
+def register_after_fork(callback):
+    """Register a callback that reopens a per-process resource after a worker forks."""
+    _after_fork_callbacks.append(callback)
+    return callback
+
+def reopen_after_fork():
+    """Run the registered after-fork callbacks in a freshly forked worker."""
+    for callback in _after_fork_callbacks:
+        try:
+            callback()
+        except Exception as e:
+            logging.error(f"Error in after-fork callback {callback.__name__}: {e}")
@@ -0,0 +1,116 @@
+/**
+ * Smart Mess Management System
+ * Attendance history: virtual-scrolling table over the paginated history API
+ */
+
+// Fixed row height (px, matches the page CSS) and rows rendered beyond the visible ones
+const HISTORY_ROW_HEIGHT = 49;
+const HISTORY_OVERSCAN = 10;
+
+document.addEventListener('DOMContentLoaded', function() {
+    const container = document.getElementById('history-container');
+    const tbody = document.getElementById('history-rows');
+    const initial = document.getElementById('history-data');
+    if (!container || !tbody || !initial) return;
+
+    const data = JSON.parse(initial.textContent);
+    const records = data.records;
+    let nextCursor = data.next_cursor;
+    let loading = false;
+
+    /**
+     * Fetch the page after the last loaded row and append it
+     */
+    function loadMore() {
+        if (loading || !nextCursor) return;
+        loading = true;
+        const separator = HISTORY_API_URL.includes('?') ? '&' : '?';
+        const url = `${HISTORY_API_URL}${separator}limit=${HISTORY_PAGE_SIZE}&cursor=${encodeURIComponent(nextCursor)}`;
+        fetch(url)
+            .then(response => {
+                if (!response.ok) throw new Error(`Request failed with status ${response.status}`);
+                return response.json();
+            })
+            .then(page => {
+                records.push(...page.records);
+                nextCursor = page.next_cursor;
+                render();
+            })
+            .catch(error => {
+                console.error('Error loading attendance history:', error);
+            })
+            .finally(() => {
+                loading = false;
+            });
+    }
+
+    function cell(text) {
+        const td = document.createElement('td');
+        td.textContent = text;
+        return td;
+    }
+
+    function spacer(height) {
+        const tr = document.createElement('tr');
+        tr.style.height = `${height}px`;
+        const td = document.createElement('td');
+        td.colSpan = 8;
+        td.style.padding = '0';
+        tr.appendChild(td);
+        return tr;
+    }
+
+    function row(record) {
+        const tr = document.createElement('tr');
+        tr.append(
+            cell(record.id), cell(record.name), cell(record.roll_number), cell(record.date),
+            cell(record.time), cell(record.meal_type), cell(record.leftover_weight)
+        );
+        const actions = document.createElement('td');
+        const form = document.createElement('form');
+        form.method = 'POST';
+        form.action = HISTORY_DELETE_URL.replace(/0$/, record.id);
+        form.className = 'd-inline';
+        form.innerHTML = '<button type="submit" class="btn btn-sm btn-danger btn-delete"><i class="fas fa-trash"></i> Delete</button>';
+        form.addEventListener('submit', e => {
+            if (!confirm('Are you sure you want to delete this item? This action cannot be undone.')) {
+                e.preventDefault();
+            }
+        });
+        actions.appendChild(form);
+        tr.appendChild(actions);
+        return tr;
+    }
+
+    /**
+     * Render only the rows in view (plus overscan), with spacers standing in for the rest
+     */
+    function render() {
+        const first = Math.max(0, Math.floor(container.scrollTop / HISTORY_ROW_HEIGHT) - HISTORY_OVERSCAN);
+        const visible = Math.ceil(container.clientHeight / HISTORY_ROW_HEIGHT) + 2 * HISTORY_OVERSCAN;
+        const last = Math.min(records.length, first + visible);
+
+        const fragment = document.createDocumentFragment();
+        if (first > 0) fragment.appendChild(spacer(first * HISTORY_ROW_HEIGHT));
+        for (let i = first; i < last; i++) {
+            fragment.appendChild(row(records[i]));
+        }
+        if (last < records.length) fragment.appendChild(spacer((records.length - last) * HISTORY_ROW_HEIGHT));
+        tbody.replaceChildren(fragment);
+
+        // Prefetch while the end of the loaded rows is still a screen away
+        if (records.length - last < HISTORY_OVERSCAN + visible) loadMore();
+    }
+
+    let scheduled = false;
+    container.addEventListener('scroll', () => {
+        if (scheduled) return;
+        scheduled = true;
+        requestAnimationFrame(() => {
+            scheduled = false;
+            render();
+        });
+    });
+
+    render();
+});
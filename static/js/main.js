@@ -3,6 +3,16 @@
  * Main JavaScript File
  */
 
+// How often open dashboards revalidate their chart data (ms); the live feed
+// updates the counts in between, so check-ins do not trigger refetches
+const DASHBOARD_REFRESH_INTERVAL = 30000;
+
+// ETag of the last response seen per API URL
+const apiETags = {};
+
+// Chart.js instances drawn from API data, destroyed before redrawing
+const apiCharts = {};
+
 // Execute when DOM is fully loaded
 document.addEventListener('DOMContentLoaded', function() {
     // Initialize tooltips if Bootstrap is available
@@ -107,162 +117,287 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
-    // Initialize food waste charts if present
-    initFoodWasteChart();
-    initTodaysWasteAnalysis();
 });
 
 /**
- * Initialize the food waste chart for the last 7 days
+ * Fetch JSON from an API endpoint, revalidating with the ETag of the last response.
+ * Resolves to the data, or to null when it has not changed since the last call.
  */
-function initFoodWasteChart() {
-    const chartContainer = document.getElementById('food-waste-chart');
-    if (!chartContainer) return;
+function fetchJSONIfChanged(url) {
+    const headers = apiETags[url] ? { 'If-None-Match': apiETags[url] } : {};
+    // Handle the 304 here rather than letting the browser cache answer it
+    return fetch(url, { headers: headers, cache: 'no-store' })
+        .then(response => {
+            if (response.status === 304) return null;
+            if (!response.ok) throw new Error(`Request failed with status ${response.status}`);
+            return response.json().then(data => {
+                const etag = response.headers.get('ETag');
+                if (etag) apiETags[url] = etag;
+                return data;
+            });
+        });
+}
+
+/**
+ * Load the dashboard widgets and keep revalidating them while the page is visible
+ */
+function initDashboard() {
+    refreshDashboard();
+    setInterval(() => {
+        if (!document.hidden) refreshDashboard();
+    }, DASHBOARD_REFRESH_INTERVAL);
+}
 
-    // Fetch data from the API
-    fetch('/api/food_waste_data')
-        .then(response => response.json())
+/**
+ * Fetch every dashboard widget from /api/dashboard in one request and redraw them
+ * if the data changed; unchanged data costs a 304 and no redraw
+ */
+function refreshDashboard() {
+    fetchJSONIfChanged('/api/dashboard')
         .then(data => {
-            if (!data.dates || !data.values || data.dates.length === 0) {
-                chartContainer.innerHTML = '<div class="alert alert-info">No waste data available for the last 7 days.</div>';
-                return;
+            if (data === null) return;
+
+            const setText = (id, text) => {
+                const element = document.getElementById(id);
+                if (element) element.textContent = text;
+            };
+            setText('live-total-students', data.total_students);
+            Object.entries(data.meal_counts).forEach(([mealType, count]) => {
+                setText(`live-${mealType.toLowerCase()}-count`, count);
+            });
+            setText('live-total-waste', data.total_waste.toFixed(2));
+
+            const predictionsAvailable = document.getElementById('predictions-available');
+            const predictionsMissing = document.getElementById('predictions-missing');
+            if (predictionsAvailable && predictionsMissing) {
+                predictionsAvailable.hidden = !data.predictions.available;
+                predictionsMissing.hidden = data.predictions.available;
             }
 
-            // Use formatted dates from API if available, otherwise format them ourselves
-            const formattedDates = data.formatted_dates || data.dates.map(date => {
-                const parts = date.split('-');
-                return `${parts[1]}/${parts[2]}`; // MM/DD format
+            renderFoodWasteChart(data.food_waste);
+            renderTodaysWasteAnalysis(data.todays_waste);
+        })
+        .catch(error => {
+            console.error('Error fetching dashboard data:', error);
+            ['food-waste-chart', 'todays-waste-analysis'].forEach(id => {
+                const chartContainer = document.getElementById(id);
+                if (chartContainer) {
+                    chartContainer.innerHTML = '<div class="alert alert-danger">Error parsing chart data. Please try refreshing the page.</div>';
+                }
             });
+        });
+}
+
+/**
+ * Draw the food waste chart for the last 7 days
+ */
+function renderFoodWasteChart(data) {
+    const chartContainer = document.getElementById('food-waste-chart');
+    if (!chartContainer) return;
+
+    if (apiCharts.foodWaste) { apiCharts.foodWaste.destroy(); apiCharts.foodWaste = null; }
+
+    if (!data.dates || !data.values || data.dates.length === 0) {
+        chartContainer.innerHTML = '<div class="alert alert-info">No waste data available for the last 7 days.</div>';
+        return;
+    }
 
-            // Create chart using Chart.js
-            const ctx = document.createElement('canvas');
-            chartContainer.innerHTML = '';
-            chartContainer.appendChild(ctx);
-
-            new Chart(ctx, {
-                type: 'bar',
-                data: {
-                    labels: formattedDates,
-                    datasets: [{
-                        label: 'Food Waste (kg)',
-                        data: data.values,
-                        backgroundColor: 'rgba(7, 122, 125, 0.7)',
-                        borderColor: 'rgba(7, 122, 125, 1)',
-                        borderWidth: 1
-                    }]
+    // Use formatted dates from API if available, otherwise format them ourselves
+    const formattedDates = data.formatted_dates || data.dates.map(date => {
+        const parts = date.split('-');
+        return `${parts[1]}/${parts[2]}`; // MM/DD format
+    });
+
+    // Create chart using Chart.js
+    const ctx = document.createElement('canvas');
+    chartContainer.innerHTML = '';
+    chartContainer.appendChild(ctx);
+
+    apiCharts.foodWaste = new Chart(ctx, {
+        type: 'bar',
+        data: {
+            labels: formattedDates,
+            datasets: [{
+                label: 'Food Waste (kg)',
+                data: data.values,
+                backgroundColor: 'rgba(7, 122, 125, 0.7)',
+                borderColor: 'rgba(7, 122, 125, 1)',
+                borderWidth: 1
+            }]
+        },
+        options: {
+            responsive: true,
+            maintainAspectRatio: false,
+            scales: {
+                y: {
+                    beginAtZero: true,
+                    title: {
+                        display: true,
+                        text: 'Weight (kg)'
+                    }
                 },
-                options: {
-                    responsive: true,
-                    maintainAspectRatio: false,
-                    scales: {
-                        y: {
-                            beginAtZero: true,
-                            title: {
-                                display: true,
-                                text: 'Weight (kg)'
-                            }
-                        },
-                        x: {
-                            title: {
-                                display: true,
-                                text: 'Date'
-                            }
-                        }
+                x: {
+                    title: {
+                        display: true,
+                        text: 'Date'
                     }
                 }
-            });
-        })
-        .catch(error => {
-            console.error('Error fetching food waste data:', error);
-            chartContainer.innerHTML = '<div class="alert alert-danger">Error parsing chart data. Please try refreshing the page.</div>';
-        });
+            }
+        }
+    });
 }
 
 /**
- * Initialize today's waste analysis chart
+ * Draw today's waste analysis table and chart
  */
-function initTodaysWasteAnalysis() {
+function renderTodaysWasteAnalysis(data) {
     const chartContainer = document.getElementById('todays-waste-analysis');
     if (!chartContainer) return;
 
-    // Fetch data from the API
-    fetch('/api/todays_waste_analysis')
-        .then(response => response.json())
-        .then(data => {
-            if (!data.available) {
-                chartContainer.innerHTML = `<div class="alert alert-info">${data.message || 'No waste data available for today.'}</div>`;
-                chartContainer.innerHTML += '<p>Add waste data to see analytics and recommendations.</p>';
-                return;
-            }
+    if (apiCharts.todaysWaste) { apiCharts.todaysWaste.destroy(); apiCharts.todaysWaste = null; }
 
-            // Create HTML to display the data
-            let html = '<h4>Today\'s Waste Summary</h4>';
-            html += `<p>Total waste recorded: <strong>${data.total_waste.toFixed(2)} kg</strong></p>`;
-            
-            html += '<table class="table table-striped">';
-            html += '<thead><tr><th>Meal</th><th>Waste (kg)</th><th>Prepared (kg)</th><th>Waste %</th></tr></thead>';
-            html += '<tbody>';
-            
-            data.waste_by_meal.forEach(meal => {
-                html += '<tr>';
-                html += `<td>${meal.meal_type}</td>`;
-                html += `<td>${meal.leftover_weight.toFixed(2)}</td>`;
-                html += `<td>${meal.quantity_prepared ? meal.quantity_prepared.toFixed(2) : 'N/A'}</td>`;
-                html += `<td>${meal.wastage_percentage ? meal.wastage_percentage.toFixed(2) + '%' : 'N/A'}</td>`;
-                html += '</tr>';
-            });
-            
-            html += '</tbody></table>';
-            
-            chartContainer.innerHTML = html;
-            
-            // Add a pie chart if we have enough meal types
-            if (data.waste_by_meal.length >= 2) {
-                const canvas = document.createElement('canvas');
-                canvas.id = 'waste-by-meal-chart';
-                chartContainer.appendChild(canvas);
-                
-                const labels = data.waste_by_meal.map(meal => meal.meal_type);
-                const values = data.waste_by_meal.map(meal => meal.leftover_weight);
-                
-                new Chart(canvas, {
-                    type: 'pie',
-                    data: {
-                        labels: labels,
-                        datasets: [{
-                            data: values,
-                            backgroundColor: [
-                                'rgba(7, 122, 125, 0.7)',
-                                'rgba(122, 226, 207, 0.7)',
-                                'rgba(245, 238, 221, 0.7)'
-                            ],
-                            borderColor: [
-                                'rgba(7, 122, 125, 1)',
-                                'rgba(122, 226, 207, 1)',
-                                'rgba(245, 238, 221, 1)'
-                            ],
-                            borderWidth: 1
-                        }]
+    if (!data.available) {
+        chartContainer.innerHTML = `<div class="alert alert-info">${data.message || 'No waste data available for today.'}</div>`;
+        chartContainer.innerHTML += '<p>Add waste data to see analytics and recommendations.</p>';
+        return;
+    }
+
+    // Create HTML to display the data
+    let html = '<h4>Today\'s Waste Summary</h4>';
+    html += `<p>Total waste recorded: <strong>${data.total_waste.toFixed(2)} kg</strong></p>`;
+
+    html += '<table class="table table-striped">';
+    html += '<thead><tr><th>Meal</th><th>Waste (kg)</th><th>Prepared (kg)</th><th>Waste %</th></tr></thead>';
+    html += '<tbody>';
+
+    data.waste_by_meal.forEach(meal => {
+        html += '<tr>';
+        html += `<td>${meal.meal_type}</td>`;
+        html += `<td>${meal.leftover_weight.toFixed(2)}</td>`;
+        html += `<td>${meal.quantity_prepared ? meal.quantity_prepared.toFixed(2) : 'N/A'}</td>`;
+        html += `<td>${meal.wastage_percentage ? meal.wastage_percentage.toFixed(2) + '%' : 'N/A'}</td>`;
+        html += '</tr>';
+    });
+
+    html += '</tbody></table>';
+
+    chartContainer.innerHTML = html;
+
+    // Add a pie chart if we have enough meal types
+    if (data.waste_by_meal.length >= 2) {
+        const canvas = document.createElement('canvas');
+        canvas.id = 'waste-by-meal-chart';
+        chartContainer.appendChild(canvas);
+
+        const labels = data.waste_by_meal.map(meal => meal.meal_type);
+        const values = data.waste_by_meal.map(meal => meal.leftover_weight);
+
+        apiCharts.todaysWaste = new Chart(canvas, {
+            type: 'pie',
+            data: {
+                labels: labels,
+                datasets: [{
+                    data: values,
+                    backgroundColor: [
+                        'rgba(7, 122, 125, 0.7)',
+                        'rgba(122, 226, 207, 0.7)',
+                        'rgba(245, 238, 221, 0.7)'
+                    ],
+                    borderColor: [
+                        'rgba(7, 122, 125, 1)',
+                        'rgba(122, 226, 207, 1)',
+                        'rgba(245, 238, 221, 1)'
+                    ],
+                    borderWidth: 1
+                }]
+            },
+            options: {
+                responsive: true,
+                plugins: {
+                    legend: {
+                        position: 'right',
                     },
-                    options: {
-                        responsive: true,
-                        plugins: {
-                            legend: {
-                                position: 'right',
-                            },
-                            title: {
-                                display: true,
-                                text: 'Waste Distribution by Meal Type'
-                            }
-                        }
+                    title: {
+                        display: true,
+                        text: 'Waste Distribution by Meal Type'
                     }
-                });
+                }
             }
-        })
-        .catch(error => {
-            console.error('Error fetching today\'s waste analysis:', error);
-            chartContainer.innerHTML = '<div class="alert alert-danger">Error parsing chart data. Please try refreshing the page.</div>';
         });
+    }
+}
+
+/**
+ * Subscribe the dashboard to the live attendance feed (Server-Sent Events)
+ */
+function initLiveFeed() {
+    const checkInList = document.getElementById('live-check-ins');
+    if (!checkInList || typeof EventSource === 'undefined') return;
+    const status = document.getElementById('live-status');
+
+    const setStatus = (text, className) => {
+        if (!status) return;
+        status.textContent = text;
+        status.className = `badge ${className}`;
+    };
+
+    const updateCounts = data => {
+        Object.entries(data.meals).forEach(([mealType, meal]) => {
+            const counter = document.getElementById(`live-${mealType.toLowerCase()}-count`);
+            if (counter) counter.textContent = meal.count;
+        });
+        const waste = document.getElementById('live-total-waste');
+        if (waste) waste.textContent = data.total_waste.toFixed(2);
+    };
+
+    const checkInItem = checkIn => {
+        const item = document.createElement('li');
+        item.className = 'list-group-item d-flex justify-content-between';
+        item.dataset.id = checkIn.id;
+        const who = document.createElement('span');
+        who.textContent = `${checkIn.student_name} (${checkIn.student_roll}) - ${checkIn.meal_type}`;
+        const detail = document.createElement('span');
+        detail.className = 'text-muted';
+        detail.textContent = `${checkIn.time} · ${checkIn.leftover_weight.toFixed(2)} kg${checkIn.updated ? ' (updated)' : ''}`;
+        item.append(who, detail);
+        return item;
+    };
+
+    const source = new EventSource('/api/live');
+
+    source.addEventListener('open', () => setStatus('Live', 'bg-success'));
+
+    source.addEventListener('snapshot', event => {
+        const data = JSON.parse(event.data);
+        updateCounts(data);
+        if (data.check_ins.length) {
+            checkInList.innerHTML = '';
+            data.check_ins.forEach(checkIn => checkInList.appendChild(checkInItem(checkIn)));
+        }
+    });
+
+    source.addEventListener('check_in', event => {
+        const data = JSON.parse(event.data);
+        updateCounts(data);
+        const previous = checkInList.querySelector(`[data-id="${data.check_in.id}"]`);
+        if (previous) previous.remove();
+        if (!checkInList.querySelector('[data-id]')) checkInList.innerHTML = '';
+        checkInList.prepend(checkInItem(data.check_in));
+        while (checkInList.children.length > 10) checkInList.lastElementChild.remove();
+    });
+
+    // The event carries the new counts; the charts catch up on the dashboard's own interval
+    source.addEventListener('counts', event => updateCounts(JSON.parse(event.data)));
+
+    source.addEventListener('error', () => {
+        // EventSource retries by itself unless the server refused the stream;
+        // the dashboard keeps revalidating on its own interval either way
+        if (source.readyState === EventSource.CLOSED) {
+            setStatus('Polling', 'bg-secondary');
+        } else {
+            setStatus('Reconnecting...', 'bg-warning');
+        }
+    });
 }
 
 /**
@@ -1,10 +1,14 @@
 import os
-import pandas as pd
+import logging
 from flask import Blueprint, request, render_template, redirect, url_for, flash, session, jsonify
-from utils import read_csv, write_csv, get_next_id, get_current_date, get_current_time
+from utils import read_csv, get_current_date, get_current_time, lazy_import, file_lock
 from config import STUDENTS_CSV, STUDENT_IMAGES_DIR
 from face_recognition_utils import detect_face, save_face_image, decode_base64_image
 from auth import login_required
+from aggregates import write_csv_with_changes
+from metrics import start_stage_timing, stage_timer
+
+pd = lazy_import('pandas')
 
 student_bp = Blueprint('student', __name__)
 
@@ -12,14 +16,19 @@ student_bp = Blueprint('student', __name__)
 @login_required
 def register_student():
     """Register a new student with face image capture."""
+    def render_page():
+        with stage_timer('render'):
+            return render_template('student_registration.html')
+    
     if request.method == 'POST':
+        start_stage_timing('registration')
         name = request.form.get('name')
         roll_number = request.form.get('roll_number')
         image_data = request.form.get('image_data')
         
         if not name or not roll_number or not image_data:
             flash('Please provide name, roll number, and capture an image', 'danger')
-            return render_template('student_registration.html')
+            return render_page()
         
         # Read existing students
         students_df = read_csv(STUDENTS_CSV)
@@ -28,52 +37,67 @@ def register_student():
         if not students_df.empty and 'roll_number' in students_df.columns:
             if (students_df['roll_number'] == roll_number).any():
                 flash('A student with this roll number already exists', 'danger')
-                return render_template('student_registration.html')
+                return render_page()
         
         # Decode base64 image
         img = decode_base64_image(image_data)
         if img is None:
             flash('Error processing the captured image', 'danger')
-            return render_template('student_registration.html')
+            return render_page()
         
         # Detect face in the image
         face_img, face_rect = detect_face(img)
         if face_img is None:
             flash('No face detected in the image. Please try again.', 'danger')
-            return render_template('student_registration.html')
-        
-        # Get next student ID
-        student_id = get_next_id(STUDENTS_CSV)
-        
-        # Save face image
-        image_path = save_face_image(face_img, student_id)
-        if not image_path:
-            flash('Error saving the student image', 'danger')
-            return render_template('student_registration.html')
-        
-        # Create new student record
-        new_student = {
-            'id': student_id,
-            'name': name,
-            'roll_number': roll_number,
-            'image_path': image_path,
-            'registration_date': get_current_date()
-        }
-        
-        # Add to dataframe
-        if students_df.empty:
-            students_df = pd.DataFrame([new_student])
-        else:
-            students_df = pd.concat([students_df, pd.DataFrame([new_student])], ignore_index=True)
+            return render_page()
         
-        # Save to CSV
-        if write_csv(students_df, STUDENTS_CSV):
-            flash(f'Student {name} registered successfully', 'success')
-            return redirect(url_for('student.students_list'))
-        else:
-            flash('Error registering student', 'danger')
-    
-    return render_template('student_registration.html')
+        with file_lock(STUDENTS_CSV):
+            # Read again under the lock, so a student registered meanwhile is kept
+            students_df = read_csv(STUDENTS_CSV)
+
+            # Check the roll number again, another registration may have taken it meanwhile
+            if not students_df.empty and 'roll_number' in students_df.columns:
+                if (students_df['roll_number'] == roll_number).any():
+                    flash('A student with this roll number already exists', 'danger')
+                    return render_page()
+
+            # Get next student ID from the table just read, instead of reading it a third time
+            student_id = int(students_df['id'].max()) + 1 if not students_df.empty and 'id' in students_df.columns else 1
+            
+            # Save face image before the record, so the face gallery finds it when the student is published
+            image_path = save_face_image(face_img, student_id)
+            if not image_path:
+                flash('Error saving the student image', 'danger')
+                return render_page()
+            
+            # Create new student record
+            new_student = {
+                'id': student_id,
+                'name': name,
+                'roll_number': roll_number,
+                'image_path': image_path,
+                'registration_date': get_current_date()
+            }
+            
+            # Add to dataframe
+            if students_df.empty:
+                students_df = pd.DataFrame([new_student])
+            else:
+                students_df = pd.concat([students_df, pd.DataFrame([new_student])], ignore_index=True)
+            
+            # Save to CSV
+            if write_csv_with_changes(students_df, STUDENTS_CSV, [(None, new_student)]):
+                flash(f'Student {name} registered successfully', 'success')
+                return redirect(url_for('student.students_list'))
+            else:
+                # No record points to the image, and the next registration would reuse its id
+                try:
+                    os.remove(image_path)
+                except OSError as e:
+                    logging.error(f"Error removing {image_path}: {e}")
+                flash('Error registering student', 'danger')
+    
+    return render_page()
 
 @student_bp.route('/students')
 @login_required
@@ -91,37 +115,39 @@ def students_list():
 @login_required
 def delete_student(student_id):
     """Delete a student."""
-    students_df = read_csv(STUDENTS_CSV)
-    
-    if students_df.empty:
-        flash('No students found', 'danger')
-        return redirect(url_for('student.students_list'))
-    
-    # Find the student
-    student = students_df[students_df['id'] == student_id]
-    
-    if student.empty:
-        flash('Student not found', 'danger')
-        return redirect(url_for('student.students_list'))
-    
-    # Get the image path
-    image_path = student.iloc[0]['image_path']
-    
-    # Remove the image file
-    if os.path.exists(image_path):
-        try:
-            os.remove(image_path)
-        except Exception as e:
-            flash(f'Error removing student image: {e}', 'warning')
-    
-    # Remove the student from the dataframe
-    students_df = students_df[students_df['id'] != student_id]
-    
-    # Save the updated dataframe
-    if write_csv(students_df, STUDENTS_CSV):
-        flash('Student deleted successfully', 'success')
-    else:
-        flash('Error deleting student', 'danger')
+    with file_lock(STUDENTS_CSV):
+        students_df = read_csv(STUDENTS_CSV)
+        
+        if students_df.empty:
+            flash('No students found', 'danger')
+            return redirect(url_for('student.students_list'))
+        
+        # Find the student
+        student = students_df[students_df['id'] == student_id]
+        
+        if student.empty:
+            flash('Student not found', 'danger')
+            return redirect(url_for('student.students_list'))
+        
+        # Get the image path
+        removed = student.iloc[0].to_dict()
+        image_path = removed['image_path']
+        
+        # Remove the image file
+        if os.path.exists(image_path):
+            try:
+                os.remove(image_path)
+            except Exception as e:
+                flash(f'Error removing student image: {e}', 'warning')
+        
+        # Remove the student from the dataframe
+        students_df = students_df[students_df['id'] != student_id]
+        
+        # Save the updated dataframe
+        if write_csv_with_changes(students_df, STUDENTS_CSV, [(removed, None)]):
+            flash('Student deleted successfully', 'success')
+        else:
+            flash('Error deleting student', 'danger')
     
     return redirect(url_for('student.students_list'))
 
@@ -160,8 +186,7 @@ def edit_student(student_id):
             return render_template('student_edit.html', student=student.to_dict())
         
         # Update basic info
-        students_df.at[student_idx[0], 'name'] = name
-        students_df.at[student_idx[0], 'roll_number'] = roll_number
+        updates = {'name': name, 'roll_number': roll_number}
         
         # If new image is provided, update the face image
         if image_data:
@@ -172,7 +197,7 @@ def edit_student(student_id):
                     # Save new face image
                     image_path = save_face_image(face_img, student_id)
                     if image_path:
-                        students_df.at[student_idx[0], 'image_path'] = image_path
+                        updates['image_path'] = image_path
                     else:
                         flash('Error saving the new student image', 'warning')
                 else:
@@ -180,11 +205,23 @@ def edit_student(student_id):
             else:
                 flash('Error processing the new image', 'warning')
         
-        # Save the updated dataframe
-        if write_csv(students_df, STUDENTS_CSV):
-            flash('Student updated successfully', 'success')
-            return redirect(url_for('student.students_list'))
-        else:
-            flash('Error updating student', 'danger')
+        with file_lock(STUDENTS_CSV):
+            # Apply the changes to the current file, so a student registered meanwhile is kept
+            students_df = read_csv(STUDENTS_CSV)
+            student_idx = students_df.index[students_df['id'] == student_id].tolist()
+            if not student_idx:
+                flash('Student not found', 'danger')
+                return redirect(url_for('student.students_list'))
+            before = students_df.loc[student_idx[0]].to_dict()
+            for column, value in updates.items():
+                students_df.at[student_idx[0], column] = value
+            after = students_df.loc[student_idx[0]].to_dict()
+            
+            # Save the updated dataframe
+            if write_csv_with_changes(students_df, STUDENTS_CSV, [(before, after)]):
+                flash('Student updated successfully', 'success')
+                return redirect(url_for('student.students_list'))
+            else:
+                flash('Error updating student', 'danger')
     
     return render_template('student_edit.html', student=student.to_dict())
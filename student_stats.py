@@ -0,0 +1,184 @@
+"""
+Per-student attendance statistics, kept up to date on every attendance write.
+
+Run as a script to check the incrementally maintained table against a
+rebuild from attendance.csv, or to print the top students:
+
+    python student_stats.py check
+    python student_stats.py top --by rolling_leftover -k 10
+"""
+import heapq
+import argparse
+from datetime import datetime, timedelta
+from aggregates import FileAggregate
+from utils import read_csv
+from history import student_directory
+from config import ATTENDANCE_CSV, MEAL_TYPES, STUDENT_STATS_WINDOW_DAYS
+
+# Columns top_k() can rank students by
+RANKINGS = ('total_leftover', 'rolling_leftover', 'meals_attended', 'last_seen')
+
+def new_stats():
+    return {
+        'meals': {meal_type: 0 for meal_type in MEAL_TYPES},
+        'total_leftover': 0.0,
+        'rolling_leftover': 0.0,
+        'last_seen': None,
+        # date -> [meals, leftover]; lets the rolling window and last_seen be recomputed
+        'days': {},
+    }
+
+class StudentStats(FileAggregate):
+    """
+    Meals attended per meal type, cumulative and rolling leftover weight and last-seen date per student.
+
+    An insert, update or delete adjusts only the student's own entry. The
+    rolling window is moved once per day on the first read of that day.
+    """
+    sources = (ATTENDANCE_CSV,)
+
+    def __init__(self):
+        super().__init__()
+        self.students = {}
+        self.window_start = None
+
+    def _in_window(self, date):
+        return self.window_start is not None and date >= self.window_start
+
+    def _add(self, student_id, date, meal_type, meals, leftover):
+        stats = self.students.get(student_id)
+        if stats is None:
+            stats = self.students[student_id] = new_stats()
+        stats['meals'][meal_type] = stats['meals'].get(meal_type, 0) + meals
+        stats['total_leftover'] += leftover
+        if self._in_window(date):
+            stats['rolling_leftover'] += leftover
+
+        day = stats['days'].setdefault(date, [0, 0.0])
+        day[0] += meals
+        day[1] += leftover
+        if day[0] == 0:
+            del stats['days'][date]
+            if not stats['days']:
+                del self.students[student_id]
+            elif stats['last_seen'] == date:
+                stats['last_seen'] = max(stats['days'])
+        elif stats['last_seen'] is None or date > stats['last_seen']:
+            stats['last_seen'] = date
+
+    def _move_window(self):
+        """Start the rolling window STUDENT_STATS_WINDOW_DAYS before today, recomputing the rolling sums if it moved."""
+        window_start = (datetime.now() - timedelta(days=STUDENT_STATS_WINDOW_DAYS - 1)).strftime("%Y-%m-%d")
+        if window_start == self.window_start:
+            return
+        self.window_start = window_start
+        for stats in self.students.values():
+            stats['rolling_leftover'] = sum(leftover for date, (meals, leftover) in stats['days'].items() if date >= window_start)
+
+    def rebuild(self):
+        self.students = {}
+        self.window_start = None
+        attendance_df = read_csv(ATTENDANCE_CSV)
+        if not attendance_df.empty:
+            grouped = attendance_df.groupby(['student_id', 'date', 'meal_type'])['leftover_weight'].agg(['size', 'sum'])
+            for student_id, date, meal_type, size, total in grouped.reset_index().itertuples(index=False):
+                self._add(int(student_id), date, meal_type, int(size), float(total))
+        self._move_window()
+
+    def apply(self, file_path, before, after):
+        for row, sign in ((before, -1), (after, 1)):
+            if row is not None:
+                self._add(int(row['student_id']), row['date'], row['meal_type'], sign, sign * float(row['leftover_weight']))
+
+    def _current(self):
+        self.ensure_current()
+        self._move_window()
+
+    def _public(self, student_id, stats):
+        name, roll_number = student_directory.lookup(student_id) or (None, None)
+        return {
+            'student_id': student_id,
+            'name': name,
+            'roll_number': roll_number,
+            'meals': dict(stats['meals']),
+            'meals_attended': sum(stats['meals'].values()),
+            'total_leftover': stats['total_leftover'],
+            'rolling_leftover': stats['rolling_leftover'],
+            'last_seen': stats['last_seen'],
+        }
+
+    def get(self, student_id):
+        """Get the statistics of one student, or None if the student never attended."""
+        with self._lock:
+            self._current()
+            stats = self.students.get(student_id)
+            return self._public(student_id, stats) if stats else None
+
+    def top_k(self, k, by='total_leftover'):
+        """Get the k registered students with the highest value of a RANKINGS column, highest first."""
+        if by not in RANKINGS:
+            raise ValueError(f"Unknown ranking {by}")
+        with self._lock:
+            self._current()
+            rows = (
+                self._public(student_id, stats)
+                for student_id, stats in self.students.items()
+                if student_directory.lookup(student_id) is not None
+            )
+            # Only last_seen can be None (ranked last); 0.0 leftovers must stay numbers
+            return heapq.nlargest(k, rows, key=lambda row: (row[by] is not None, row[by]))
+
+    def snapshot(self):
+        """Get the whole table as plain data, for comparing two builds."""
+        with self._lock:
+            self._current()
+            return {
+                student_id: {
+                    'meals': {meal_type: count for meal_type, count in stats['meals'].items() if count},
+                    'total_leftover': round(stats['total_leftover'], 6),
+                    'rolling_leftover': round(stats['rolling_leftover'], 6),
+                    'last_seen': stats['last_seen'],
+                }
+                for student_id, stats in self.students.items()
+            }
+
+def check_consistency():
+    """
+    Replay every attendance row as an incremental insert and compare the result with a rebuild.
+
+    Returns the ids of the students whose statistics differ.
+    """
+    rebuilt = StudentStats()
+    rebuilt.ensure_current()
+
+    replayed = StudentStats()
+    replayed._move_window()
+    for row in read_csv(ATTENDANCE_CSV).to_dict('records'):
+        replayed.apply(ATTENDANCE_CSV, None, row)
+
+    expected, actual = rebuilt.snapshot(), replayed.snapshot()
+    return sorted(student_id for student_id in set(expected) | set(actual) if expected.get(student_id) != actual.get(student_id))
+
+student_stats = StudentStats()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('check', help='Compare incremental updates with a rebuild from attendance.csv')
+    top_parser = subparsers.add_parser('top', help='Print the top students')
+    top_parser.add_argument('--by', choices=RANKINGS, default='total_leftover')
+    top_parser.add_argument('-k', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == 'check':
+        mismatched = check_consistency()
+        if mismatched:
+            raise SystemExit(f"Inconsistent statistics for {len(mismatched)} students: {mismatched[:20]}")
+        print(f"Student statistics consistent for {len(student_stats.snapshot())} students")
+    else:
+        for rank, row in enumerate(student_stats.top_k(args.k, args.by), 1):
+            value = row[args.by]
+            print(f"{rank:>3}. {row['name']} ({row['roll_number']}): {round(value, 2) if isinstance(value, float) else value}")
+
+if __name__ == '__main__':
+    main()
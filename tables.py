@@ -0,0 +1,147 @@
+"""
+Typed loading of the CSV tables.
+
+Each table has a declared schema in config.TABLE_SCHEMAS: 32-bit ids and
+counts, dates parsed once into datetime64, and categoricals for meal types,
+days and other repetitive strings. read_table() enforces it, so analytics
+and prediction code get compact frames and never convert columns themselves.
+Like utils.read_csv(), it takes a date range and then reads only the months
+of a partitioned table that the range overlaps.
+Writers keep using utils.read_csv(), which round-trips the file unchanged.
+
+Usage:
+    python tables.py report     # memory per table, inferred vs declared types
+"""
+import os
+import logging
+import argparse
+from config import TABLE_SCHEMAS, PARTITIONED_TABLES, MEAL_TYPES, DAYS_OF_WEEK
+from utils import read_csv, lazy_import, partition_files, consistent_read, file_signature, table_version
+from metrics import record_csv_operation, stage_timer, set_gauge
+from cache import get_cache
+
+pd = lazy_import('pandas')
+
+# Typed frames by table, date range and columns, versioned by the table's files and version counter
+table_cache = get_cache('tables')
+
+# Categories of the categorical column kinds, in display order
+CATEGORIES = {'meal_type': MEAL_TYPES, 'day': DAYS_OF_WEEK}
+
+def read_dtypes(schema):
+    """Get the dtypes to hand to pd.read_csv for a schema; dates are read as strings and parsed afterwards."""
+    return {column: 'category' if kind in CATEGORIES else 'str' if kind == 'date' else kind
+            for column, kind in schema.items()}
+
+def apply_schema(df, schema):
+    """Parse the date columns and order the categoricals of a frame read with read_dtypes()."""
+    for column, kind in schema.items():
+        if column not in df.columns:
+            continue
+        if kind == 'date':
+            if not pd.api.types.is_datetime64_any_dtype(df[column]):
+                df[column] = pd.to_datetime(df[column], format='%Y-%m-%d', errors='coerce')
+            continue
+        if (kind in CATEGORIES or kind == 'category') and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            # Months read separately come back as object columns when their categories differ
+            df[column] = df[column].astype('category')
+        if kind in CATEGORIES:
+            # Unexpected values are kept as extra categories rather than turned into NaN
+            extra = sorted(set(df[column].cat.categories) - set(CATEGORIES[kind]))
+            df[column] = df[column].cat.set_categories(list(CATEGORIES[kind]) + extra)
+    return df
+
+def table_files(file_path, start_date=None, end_date=None):
+    """Get the non-empty CSV files of a table; for a partitioned one, those of the months overlapping [start_date, end_date] and its journal."""
+    paths = partition_files(file_path, start_date, end_date) if file_path in PARTITIONED_TABLES else [file_path]
+    return [path for path in paths if os.path.exists(path) and os.path.getsize(path) > 0]
+
+def read_typed_csv(path, schema, columns=None):
+    """Read one CSV file with a schema, optionally only some columns; raises ValueError or TypeError if it does not fit."""
+    return apply_schema(pd.read_csv(path, dtype=read_dtypes(schema), usecols=columns), schema)
+
+def read_columns_for(schema, columns, start_date=None, end_date=None):
+    """Get the columns to read for `columns`: the date column is needed to filter on, even if it is not asked for."""
+    dated = (start_date or end_date) and 'date' in schema
+    return list(dict.fromkeys(columns + (['date'] if dated else [])))
+
+def select_rows(df, start_date=None, end_date=None, columns=None):
+    """Keep the rows of a typed frame dated within [start_date, end_date], then the given columns."""
+    if (start_date or end_date) and 'date' in df.columns and not df.empty:
+        mask = pd.Series(True, index=df.index)
+        if start_date:
+            mask &= df['date'] >= pd.Timestamp(start_date)
+        if end_date:
+            mask &= df['date'] <= pd.Timestamp(end_date)
+        df = df[mask].reset_index(drop=True)
+    return df[columns] if columns is not None else df
+
+def read_table(file_path, start_date=None, end_date=None, columns=None):
+    """
+    Read a CSV file with its declared schema, optionally only the rows dated within [start_date, end_date].
+
+    With `columns`, only those columns are parsed and returned. Returns an
+    empty DataFrame if the file is missing or empty, and falls back to default
+    type inference (with an error logged) if the file does not fit its schema,
+    e.g. a missing id. Frames are cached until the table is written; callers
+    get a copy they may modify.
+    """
+    schema = TABLE_SCHEMAS.get(file_path, {})
+    # Taken before reading, so a write during the read leaves the entry outdated rather than wrong
+    version = (file_signature(file_path), table_version(file_path))
+    key = (file_path, start_date, end_date, None if columns is None else tuple(columns))
+    df = table_cache.get(key, version)
+    if df is not None:
+        return df.copy()
+    if not table_files(file_path, start_date, end_date):
+        return pd.DataFrame()
+    usecols = None if columns is None else read_columns_for(schema, columns, start_date, end_date)
+
+    def read():
+        # Listed again on every attempt: a write may have added or removed files
+        paths = table_files(file_path, start_date, end_date)
+        if not paths:
+            return pd.DataFrame()
+        frames = [read_typed_csv(path, schema, usecols) for path in paths]
+        df = frames[0] if len(frames) == 1 else apply_schema(pd.concat(frames, ignore_index=True), schema)
+        return select_rows(df, start_date, end_date, columns)
+
+    try:
+        record_csv_operation('read', file_path)
+        with stage_timer('storage_read'):
+            df = consistent_read(file_path, read) if file_path in PARTITIONED_TABLES else read()
+    except (ValueError, TypeError, OSError) as e:
+        logging.error(f"Error reading {file_path} with its schema: {e}")
+        df = read_csv(file_path, start_date, end_date)
+        return df[[column for column in columns if column in df.columns]] if columns is not None else df
+    set_gauge('table_memory_bytes', int(df.memory_usage(deep=True).sum()), {'table': os.path.basename(file_path)})
+    table_cache.set(key, df, version)
+    return df.copy()
+
+def memory_report():
+    """Get rows and in-memory bytes of every table, loaded with inferred and with declared types."""
+    report = []
+    for file_path in TABLE_SCHEMAS:
+        inferred = read_csv(file_path)
+        typed = read_table(file_path)
+        report.append({
+            'table': os.path.basename(file_path),
+            'rows': len(typed),
+            'inferred_bytes': int(inferred.memory_usage(deep=True).sum()),
+            'typed_bytes': int(typed.memory_usage(deep=True).sum()),
+        })
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('report', help='Print the memory used by each table with inferred and declared types')
+    parser.parse_args()
+
+    print(f"{'table':<22}{'rows':>10}{'inferred':>14}{'typed':>14}{'ratio':>8}")
+    for row in memory_report():
+        ratio = row['inferred_bytes'] / row['typed_bytes'] if row['typed_bytes'] else 0
+        print(f"{row['table']:<22}{row['rows']:>10}{row['inferred_bytes']:>14,}{row['typed_bytes']:>14,}{ratio:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
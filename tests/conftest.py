@@ -0,0 +1,14 @@
+import os
+import sys
+import pytest
+
+# The modules live at the top level of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Run a test in an empty scratch copy of the data directories (config paths are relative)."""
+    monkeypatch.chdir(tmp_path)
+    from utils import init_data_files
+    init_data_files()
+    return tmp_path
@@ -0,0 +1,100 @@
+"""
+Local stand-in for a Redis server, for testing cache.RedisBackend.
+
+Speaks RESP over TCP and implements the commands the backend uses (GET, SET
+with EX/PX, DEL, SCAN) plus EXPIRE, AUTH (password or username and password)
+and SELECT, keeping keys in a dict.
+"""
+import time
+import fnmatch
+import threading
+import socketserver
+
+def bulk(value):
+    return b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value), value)
+
+class RESPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, password=None, username=None):
+        super().__init__(('127.0.0.1', 0), RESPHandler)
+        self.password = password
+        self.username = username
+        self.lock = threading.Lock()
+        # key -> (value, expiry time or None)
+        self.store = {}
+        self.commands = []
+
+    @property
+    def url(self):
+        credentials = f"{self.username or ''}:{self.password}@" if self.password else ''
+        return f"redis://{credentials}127.0.0.1:{self.server_address[1]}/1"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def live(self, key):
+        item = self.store.get(key)
+        if item is not None and item[1] is not None and item[1] <= time.time():
+            del self.store[key]
+            return None
+        return item
+
+class RESPHandler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        authenticated = self.server.password is None
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            name = args[0].upper().decode()
+            self.server.commands.append([name] + args[1:])
+            if name == 'AUTH':
+                expected = ([self.server.username.encode()] if self.server.username else []) + [self.server.password.encode()]
+                authenticated = args[1:] == expected
+                reply = b'+OK\r\n' if authenticated else b'-WRONGPASS invalid username-password pair\r\n'
+            elif not authenticated:
+                reply = b'-NOAUTH Authentication required.\r\n'
+            else:
+                with self.server.lock:
+                    reply = self.execute(name, args[1:])
+            self.wfile.write(reply)
+
+    def execute(self, name, args):
+        server = self.server
+        if name == 'SELECT':
+            return b'+OK\r\n'
+        if name == 'GET':
+            item = server.live(args[0])
+            return bulk(item[0] if item else None)
+        if name == 'SET':
+            expires = None
+            if len(args) > 3 and args[2].upper() in (b'EX', b'PX'):
+                expires = time.time() + int(args[3]) / (1 if args[2].upper() == b'EX' else 1000)
+            server.store[args[0]] = (args[1], expires)
+            return b'+OK\r\n'
+        if name == 'DEL':
+            return b':%d\r\n' % sum(server.store.pop(key, None) is not None for key in args)
+        if name == 'EXPIRE':
+            item = server.live(args[0])
+            if item is None:
+                return b':0\r\n'
+            server.store[args[0]] = (item[0], time.time() + int(args[1]))
+            return b':1\r\n'
+        if name == 'SCAN':
+            pattern = args[args.index(b'MATCH') + 1].decode() if b'MATCH' in args else '*'
+            keys = [key for key in list(server.store) if server.live(key) and fnmatch.fnmatchcase(key.decode(), pattern)]
+            return b'*2\r\n' + bulk(b'0') + b'*%d\r\n' % len(keys) + b''.join(bulk(key) for key in keys)
+        return b'-ERR unknown command\r\n'
@@ -0,0 +1,78 @@
+import pandas as pd
+import aggregates
+from aggregates import FileAggregate, write_csv_with_changes
+from journal import append_rows, flush_journal
+from utils import file_lock
+from config import ATTENDANCE_CSV
+
+class AttendanceIds(FileAggregate):
+    sources = (ATTENDANCE_CSV,)
+
+    def __init__(self):
+        super().__init__()
+        self.ids = []
+        self.rebuilds = 0
+
+    def rebuild(self):
+        from utils import read_csv
+        df = read_csv(ATTENDANCE_CSV)
+        self.ids = sorted(int(row_id) for row_id in df['id']) if not df.empty else []
+        self.rebuilds += 1
+
+    def apply(self, file_path, before, after):
+        if before is not None:
+            self.ids.remove(int(before['id']))
+        if after is not None:
+            self.ids = sorted(self.ids + [int(after['id'])])
+
+def attendance_row(row_id, date):
+    return {'id': row_id, 'date': date, 'time': '12:00:00', 'meal_type': 'Lunch', 'student_id': row_id, 'leftover_weight': 0.1}
+
+def append(row_ids, date='2026-10-01'):
+    with file_lock(ATTENDANCE_CSV):
+        append_rows(ATTENDANCE_CSV, [attendance_row(row_id, date) for row_id in row_ids])
+
+def test_other_workers_follow_a_journal_flush_without_rebuilding(data_dir, monkeypatch):
+    this_worker = AttendanceIds()
+    other_worker = AttendanceIds()
+    # The other worker is only told about writes through the files, like another process
+    monkeypatch.setattr(aggregates, '_registry', [this_worker])
+
+    with file_lock(ATTENDANCE_CSV):
+        rows = [attendance_row(1, '2026-09-01')]
+        write_csv_with_changes(pd.DataFrame(rows), ATTENDANCE_CSV, [(None, row) for row in rows])
+    append([2, 3])
+    this_worker.ensure_current()
+    other_worker.ensure_current()
+    assert other_worker.rebuilds == 1
+
+    # Rows appended and flushed before the other worker looked again, then a new journal
+    append([4])
+    assert flush_journal(ATTENDANCE_CSV) == 3
+    append([5], '2026-09-02')
+    for aggregate in (this_worker, other_worker):
+        aggregate.ensure_current()
+        assert aggregate.ids == [1, 2, 3, 4, 5]
+    assert (this_worker.rebuilds, other_worker.rebuilds) == (1, 1)
+
+    # Two flushes in between: only the last one is recorded, so that is a rebuild
+    assert flush_journal(ATTENDANCE_CSV) == 1
+    append([6])
+    assert flush_journal(ATTENDANCE_CSV) == 1
+    other_worker.ensure_current()
+    assert other_worker.ids == [1, 2, 3, 4, 5, 6]
+    assert other_worker.rebuilds == 2
+
+def test_a_real_month_rewrite_still_rebuilds(data_dir, monkeypatch):
+    this_worker = AttendanceIds()
+    other_worker = AttendanceIds()
+    monkeypatch.setattr(aggregates, '_registry', [this_worker])
+    append([1, 2])
+    assert flush_journal(ATTENDANCE_CSV) == 2
+    other_worker.ensure_current()
+    with file_lock(ATTENDANCE_CSV):
+        rows = [attendance_row(1, '2026-10-01')]
+        write_csv_with_changes(pd.DataFrame(rows), ATTENDANCE_CSV, [(attendance_row(2, '2026-10-01'), None)], partition='2026-10')
+    other_worker.ensure_current()
+    assert other_worker.ids == [1]
+    assert other_worker.rebuilds == 2
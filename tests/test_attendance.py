@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+import attendance
+from journal import flush_journal
+from utils import read_csv, write_csv
+from config import ATTENDANCE_CSV, STUDENTS_CSV
+
+@pytest.fixture
+def client(data_dir, monkeypatch):
+    from app import create_app
+    face = np.zeros((50, 50, 3), dtype=np.uint8)
+    monkeypatch.setattr(attendance, 'decode_base64_image', lambda image_data: face)
+    monkeypatch.setattr(attendance, 'detect_face', lambda img: (face, (0, 0, 50, 50)))
+    monkeypatch.setattr(attendance, 'recognize_face', lambda face_img, images_dir: 1)
+    write_csv(pd.DataFrame([{'id': 1, 'name': 'Student', 'roll_number': 'R1', 'image_path': '',
+                             'registration_date': '2026-10-01'}]), STUDENTS_CSV)
+    client = create_app().test_client()
+    with client.session_transaction() as session:
+        session['username'] = 'admin'
+        session['role'] = 'admin'
+    return client
+
+def check_in(client, leftover_weight):
+    return client.post('/attendance', data={'image_data': 'x', 'meal_type': 'Lunch', 'leftover_weight': leftover_weight})
+
+def test_second_check_in_updates_the_leftover_weight(client):
+    check_in(client, '0.1')
+    response = check_in(client, '0.3')
+    assert b'Updated leftover weight for Student' in response.data
+    flush_journal(ATTENDANCE_CSV)
+    assert list(read_csv(ATTENDANCE_CSV)['leftover_weight']) == [0.3]
+
+def test_check_in_with_a_stale_index_records_the_meal(client, monkeypatch):
+    # The index still has a record another worker deleted
+    monkeypatch.setattr(attendance.attendance_index, 'find', lambda student_id, date, meal_type: 7)
+    response = check_in(client, '0.2')
+    assert b'Attendance recorded for Student' in response.data
+    flush_journal(ATTENDANCE_CSV)
+    assert list(read_csv(ATTENDANCE_CSV)['leftover_weight']) == [0.2]
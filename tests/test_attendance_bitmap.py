@@ -0,0 +1,7 @@
+from attendance_bitmap import AttendanceBitmap
+
+def test_students_where_with_registered_students_and_no_attendance(data_dir):
+    bitmap = AttendanceBitmap()
+    assert bitmap.students_where('2026-10-01', '2026-10-07', [1, 2], attended='none') == [1, 2]
+    assert bitmap.students_where('2026-10-01', '2026-10-07', [1, 2], attended='any') == []
+    assert bitmap.students_where('2026-10-01', '2026-10-07', [1, 2], ['Lunch'], attended='all') == []
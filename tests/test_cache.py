@@ -0,0 +1,85 @@
+import time
+import pytest
+from cache import Cache, LRUBackend, SQLiteBackend, RedisBackend, RedisError
+from resp_server import RESPServer
+
+@pytest.fixture
+def redis_server():
+    server = RESPServer(password='secret', username='app').start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture(params=['lru', 'sqlite', 'redis'])
+def cache(request, tmp_path):
+    if request.param == 'lru':
+        backend = LRUBackend('test')
+    elif request.param == 'sqlite':
+        backend = SQLiteBackend(str(tmp_path / 'cache.sqlite'))
+    else:
+        backend = RedisBackend(request.getfixturevalue('redis_server').url)
+    return Cache('test', backend)
+
+def test_get_set_with_versions(cache):
+    assert cache.get('menu') is None
+    cache.set('menu', {'Monday': ['Lunch']}, version=(1, 2))
+    assert cache.get('menu', (1, 2)) == {'Monday': ['Lunch']}
+    # Any other version is a miss
+    assert cache.get('menu', (1, 3)) is None
+    cache.set('menu', 'new', version=(1, 3))
+    assert cache.get('menu', (1, 3)) == 'new'
+
+def test_delete_and_clear(cache):
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.delete('a')
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+    cache.clear()
+    assert cache.get('b') is None
+
+def test_entries_expire(cache):
+    cache.set('short', 'value', ttl=0.05)
+    assert cache.get('short') == 'value'
+    time.sleep(0.1)
+    assert cache.get('short') is None
+
+def test_lru_evicts_least_recently_used():
+    cache = Cache('test', LRUBackend('test', max_entries=2))
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
+
+def test_redis_commands(redis_server):
+    backend = RedisBackend(redis_server.url)
+    cache = Cache('ns', backend)
+    cache.set('key', 'value', ttl=60)
+    assert cache.get('key') == 'value'
+    # Only the documented subset, with AUTH sent as username and password
+    assert {command[0] for command in redis_server.commands} <= {'AUTH', 'SELECT', 'GET', 'SET', 'DEL', 'SCAN'}
+    assert redis_server.commands[0] == ['AUTH', b'app', b'secret']
+    set_command = next(command for command in redis_server.commands if command[0] == 'SET')
+    assert set_command[3:] == [b'PX', b'60000']
+    assert backend.stats()['ns'][0] == 1
+    # EXPIRE on a stored entry
+    assert backend.command('EXPIRE', backend._key('ns', 'key'), 0) == 1
+    assert cache.get('key') is None
+    cache.set('gone', 1)
+    cache.delete('gone')
+    assert backend.command('GET', backend._key('ns', 'gone')) is None
+
+def test_redis_authentication(redis_server):
+    with pytest.raises(RedisError):
+        RedisBackend(redis_server.url.replace('secret', 'wrong')).command('GET', 'x')
+    # A backend that cannot authenticate answers misses
+    assert Cache('ns', RedisBackend(redis_server.url.replace('app:secret@', ''))).get('key') is None
+
+def test_redis_down_is_a_miss():
+    server = RESPServer()
+    port = server.server_address[1]
+    server.server_close()
+    cache = Cache('ns', RedisBackend(f"redis://127.0.0.1:{port}/0"))
+    cache.set('key', 1)
+    assert cache.get('key') is None
@@ -0,0 +1,27 @@
+import os
+import json
+import multiprocessing
+import events
+from config import EVENT_LOG, STUDENTS_CSV
+
+def publish_many(count):
+    for i in range(count):
+        events.publish(STUDENTS_CSV, [(None, {'id': i, 'name': 'x' * 5000})])
+
+def test_concurrent_appends_stay_whole_lines(data_dir, monkeypatch):
+    monkeypatch.setattr(events, '_log', {'shared': True})
+    monkeypatch.setattr(events, 'EVENT_LOG_MAX_BYTES', 1 << 30)
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=publish_many, args=(50,)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    with open(EVENT_LOG) as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 200
+    assert len({record['pid'] for record in records}) == 4
+
+def test_single_process_keeps_no_log(data_dir):
+    events.publish(STUDENTS_CSV, [(None, {'id': 1, 'name': 'x'})])
+    assert not os.path.exists(EVENT_LOG)
@@ -0,0 +1,23 @@
+import pandas as pd
+from utils import iter_csv_chunks, file_lock
+from aggregates import write_csv_with_changes
+from journal import append_rows, flush_journal
+from config import ATTENDANCE_CSV
+
+def attendance_row(row_id, date):
+    return {'id': row_id, 'date': date, 'time': '12:00:00', 'meal_type': 'Lunch', 'student_id': row_id, 'leftover_weight': 0.1}
+
+def test_chunks_are_a_snapshot_across_writes(data_dir):
+    with file_lock(ATTENDANCE_CSV):
+        rows = [attendance_row(row_id, '2026-09-%02d' % row_id) for row_id in range(1, 4)]
+        write_csv_with_changes(pd.DataFrame(rows), ATTENDANCE_CSV, [(None, row) for row in rows])
+        append_rows(ATTENDANCE_CSV, [attendance_row(row_id, '2026-10-01') for row_id in range(4, 7)])
+
+    chunks = iter_csv_chunks(ATTENDANCE_CSV, 1)
+    ids = list(next(chunks)['id'])
+    # Moves the journal into the October month and removes it, while the export is half way
+    assert flush_journal(ATTENDANCE_CSV) == 3
+    with file_lock(ATTENDANCE_CSV):
+        append_rows(ATTENDANCE_CSV, [attendance_row(7, '2026-10-02')])
+    ids += [row_id for chunk in chunks for row_id in chunk['id']]
+    assert sorted(ids) == [1, 2, 3, 4, 5, 6]
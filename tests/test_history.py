@@ -0,0 +1,44 @@
+import pandas as pd
+from aggregates import write_csv_with_changes
+from journal import append_rows
+from history import AttendanceIndex
+from utils import file_lock
+from config import ATTENDANCE_CSV
+
+def attendance_row(row_id, date, meal_type='Lunch', student_id=1):
+    return {'id': row_id, 'date': date, 'time': '12:00:00', 'meal_type': meal_type, 'student_id': student_id,
+            'leftover_weight': 0.1}
+
+def test_pages_read_months_newest_first_with_the_journal(data_dir):
+    september = [attendance_row(1, '2026-09-01'), attendance_row(2, '2026-09-02', 'Dinner'),
+                 attendance_row(3, '2026-09-30', student_id=2)]
+    october = [attendance_row(4, '2026-10-01'), attendance_row(5, '2026-10-02', 'Dinner')]
+    with file_lock(ATTENDANCE_CSV):
+        for month, rows in (('2026-09', september), ('2026-10', october)):
+            write_csv_with_changes(pd.DataFrame(rows), ATTENDANCE_CSV, [(None, row) for row in rows], month)
+        append_rows(ATTENDANCE_CSV, [attendance_row(6, '2026-10-03'), attendance_row(7, '2026-09-03')])
+
+    index = AttendanceIndex()
+    assert index.count() == 7
+    assert index.find(1, '2026-10-03', 'Lunch') == 6
+    assert index.next_id() == 8
+    assert index.get(7)['date'] == '2026-09-03'
+
+    ids, cursor = [], None
+    while True:
+        rows, cursor, total = index.page(2, cursor)
+        ids += [row['id'] for row in rows]
+        assert total == 7
+        if cursor is None:
+            break
+    assert ids == [6, 5, 4, 3, 7, 2, 1]
+
+    rows, cursor, total = index.page(10, meal_type='Dinner')
+    assert ([row['id'] for row in rows], cursor, total) == ([5, 2], None, 2)
+    rows, cursor, total = index.page(1, student_id=2, end_date='2026-09-30')
+    assert ([row['id'] for row in rows], cursor, total) == ([3], None, 1)
+    rows, cursor, total = index.page(10, start_date='2026-09-02', end_date='2026-10-01')
+    assert [row['id'] for row in rows] == [4, 3, 7, 2] and total == 4
+
+    # Only the slot and month maps are kept, not the rows
+    assert not hasattr(index, 'rows')
@@ -0,0 +1,31 @@
+import json
+import metrics
+
+def write(directory, name, counter, gauge, recent):
+    snapshot = {
+        'counters': [['http_requests_total', [['endpoint', 'home']], counter]],
+        'gauges': [['table_memory_bytes', [['table', 'students']], gauge]],
+        'histograms': [['http_request_duration_seconds', [['endpoint', 'home']], [0.1], [counter, 0], 0.01 * counter]],
+        'recent': [['http_request_duration_recent_seconds', [['endpoint', 'home']], recent]],
+    }
+    (directory / name).write_text(json.dumps(snapshot))
+
+def test_exited_workers_only_count_towards_totals(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_DIR', str(tmp_path))
+    metrics.reset_metrics()
+    # A pid that cannot be running, and one retired by the master
+    write(tmp_path, '999999999.json', 3, 100, [5.0])
+    write(tmp_path, '999999998.json', 2, 200, [6.0])
+    metrics.retire_worker(999999998)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['999999999.json', metrics.RETIRED_SNAPSHOT]
+
+    counters, gauges, histograms, recent = metrics._collect()
+    assert counters[('http_requests_total', (('endpoint', 'home'),))] == 5
+    assert histograms[('http_request_duration_seconds', (('endpoint', 'home'),))]['counts'] == [5, 0]
+    assert gauges == {}
+    assert recent == {}
+
+    # Retiring more workers adds up
+    write(tmp_path, '999999997.json', 4, 300, [7.0])
+    metrics.retire_worker(999999997)
+    assert metrics._collect()[0][('http_requests_total', (('endpoint', 'home'),))] == 9
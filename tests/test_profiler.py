@@ -0,0 +1,25 @@
+import pytest
+from profiler import list_profiles
+
+@pytest.fixture
+def admin_client(data_dir):
+    # app.py creates an app, and with it the data files, when imported: only once in data_dir
+    from app import create_app
+    client = create_app().test_client()
+    with client.session_transaction() as session:
+        session['username'] = 'admin'
+        session['role'] = 'admin'
+    return client
+
+def test_armed_path_with_query_string_is_profiled(admin_client):
+    response = admin_client.post('/admin/profiles', data={'path': '/admin/profiles?page=2', 'mode': 'sample'})
+    assert response.headers['Location'] == '/admin/profiles?page=2'
+    admin_client.get('/admin/profiles?page=2')
+    assert [profile['path'] for profile in list_profiles()] == ['/admin/profiles?page=2']
+
+@pytest.mark.parametrize('path', ['//evil.example', '/\\evil.example', '/\\/evil.example', '/\t/evil.example', 'https://evil.example'])
+def test_arming_rejects_paths_off_the_site(admin_client, path):
+    response = admin_client.post('/admin/profiles', data={'path': path, 'mode': 'sample'})
+    assert response.status_code == 200
+    with admin_client.session_transaction() as session:
+        assert 'profile_next' not in session
@@ -0,0 +1,33 @@
+import pandas as pd
+import aggregates
+from aggregates import write_csv_with_changes
+from rollups import DailyRollups
+from utils import file_lock
+from config import MEAL_PREPARATION_CSV
+
+def preparation(row_id, quantity, expected):
+    return {'id': row_id, 'date': '2026-10-01', 'meal_name': 'Lunch', 'meal_type': 'Lunch', 'day': 'Thursday',
+            'quantity_prepared': quantity, 'expected_students': expected, 'leftover_weight': 1.0}
+
+def write(rows, changes):
+    with file_lock(MEAL_PREPARATION_CSV):
+        write_csv_with_changes(pd.DataFrame(rows), MEAL_PREPARATION_CSV, changes, '2026-10')
+
+def lunch(rollups):
+    row = rollups.query('2026-10-01', '2026-10-01')[0]
+    return row['quantity_prepared'], row['expected_students'], row['preparations']
+
+def test_two_preparations_in_one_slot_report_the_first(data_dir, monkeypatch):
+    rollups = DailyRollups()
+    monkeypatch.setattr(aggregates, '_registry', [rollups])
+    rollups.ensure_current()
+    first, second = preparation(1, 20.0, 40), preparation(2, 5.0, 10)
+    write([first], [(None, first)])
+    write([first, second], [(None, second)])
+    # Updated incrementally and rebuilt from the file alike
+    assert lunch(rollups) == (20.0, 40, 2)
+    assert lunch(DailyRollups()) == (20.0, 40, 2)
+
+    write([second], [(first, None)])
+    assert lunch(rollups) == (5.0, 10, 1)
+    assert lunch(DailyRollups()) == (5.0, 10, 1)
@@ -0,0 +1,47 @@
+import os
+import numpy as np
+import pytest
+import student
+from utils import read_csv
+from config import STUDENTS_CSV, STUDENT_IMAGES_DIR
+
+@pytest.fixture
+def client(data_dir, monkeypatch):
+    # app.py creates an app, and with it the data files, when imported: only once in data_dir
+    from app import create_app
+    face = np.zeros((50, 50, 3), dtype=np.uint8)
+    monkeypatch.setattr(student, 'decode_base64_image', lambda image_data: face)
+    monkeypatch.setattr(student, 'detect_face', lambda img: (face, (0, 0, 50, 50)))
+    client = create_app().test_client()
+    with client.session_transaction() as session:
+        session['username'] = 'admin'
+        session['role'] = 'admin'
+    return client
+
+def register(client, roll_number):
+    return client.post('/student/register', data={'name': 'Student', 'roll_number': roll_number, 'image_data': 'x'})
+
+def test_ids_follow_the_registered_students(client):
+    register(client, 'R1')
+    register(client, 'R2')
+    assert list(read_csv(STUDENTS_CSV)['id']) == [1, 2]
+    assert sorted(os.listdir(STUDENT_IMAGES_DIR)) == ['student_1.jpg', 'student_2.jpg']
+
+def test_failed_write_leaves_no_image(client, monkeypatch):
+    monkeypatch.setattr(student, 'write_csv_with_changes', lambda *args: False)
+    response = register(client, 'R1')
+    assert b'Error registering student' in response.data
+    assert os.listdir(STUDENT_IMAGES_DIR) == []
+
+def test_roll_number_taken_during_registration(client, monkeypatch):
+    def detect_face_while_registering(img):
+        # Another registration with the same roll number lands between the first check and the lock
+        monkeypatch.setattr(student, 'detect_face', lambda img: (face, (0, 0, 50, 50)))
+        register(client, 'R1')
+        return face, (0, 0, 50, 50)
+    face = np.zeros((50, 50, 3), dtype=np.uint8)
+    monkeypatch.setattr(student, 'detect_face', detect_face_while_registering)
+    response = register(client, 'R1')
+    assert b'A student with this roll number already exists' in response.data
+    assert list(read_csv(STUDENTS_CSV)['roll_number']) == ['R1']
+    assert os.listdir(STUDENT_IMAGES_DIR) == ['student_1.jpg']
@@ -0,0 +1,20 @@
+import pandas as pd
+from student_stats import StudentStats, RANKINGS
+from utils import get_current_date
+from config import STUDENTS_CSV, ATTENDANCE_CSV
+
+def test_top_k_with_a_clean_plate(data_dir):
+    pd.DataFrame([
+        {'id': 1, 'name': 'Asha', 'roll_number': 'R1', 'image_path': '', 'registration_date': '2026-10-01'},
+        {'id': 2, 'name': 'Ben', 'roll_number': 'R2', 'image_path': '', 'registration_date': '2026-10-01'},
+    ]).to_csv(STUDENTS_CSV, index=False)
+    today = get_current_date()
+    pd.DataFrame([
+        {'id': 1, 'date': today, 'time': '08:00:00', 'meal_type': 'Breakfast', 'student_id': 1, 'leftover_weight': 0.0},
+        {'id': 2, 'date': today, 'time': '13:00:00', 'meal_type': 'Lunch', 'student_id': 2, 'leftover_weight': 0.25},
+    ]).to_csv(f"{data_dir}/data/attendance/{today[:7]}.csv", index=False)
+
+    stats = StudentStats()
+    for by in RANKINGS:
+        assert sorted(row['student_id'] for row in stats.top_k(5, by)) == [1, 2]
+    assert [row['total_leftover'] for row in stats.top_k(5, 'total_leftover')] == [0.25, 0.0]
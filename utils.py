@@ -1,9 +1,46 @@
+import io
 import os
+import re
+import sys
 import csv
+import json
+import time
+import hashlib
 import logging
-import pandas as pd
+import functools
+import threading
+import contextlib
+import importlib.util
 from datetime import datetime
-from config import DATA_DIR, USERS_CSV, STUDENTS_CSV, ATTENDANCE_CSV, MENU_CSV, MEAL_PREPARATION_CSV, STUDENT_IMAGES_DIR
+from flask import request, make_response
+from config import (DATA_DIR, USERS_CSV, STUDENTS_CSV, ATTENDANCE_CSV, MENU_CSV, STUDENT_IMAGES_DIR, PARTITIONED_TABLES,
+                    VERSION_DIR, CONSISTENT_READ_ATTEMPTS, CONSISTENT_READ_BACKOFF)
+from metrics import record_csv_operation, stage_timer
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; file_lock() then only serializes threads of one process
+    fcntl = None
+
+def lazy_import(name):
+    """
+    Return a module that is only executed on first attribute access.
+
+    Used for heavy dependencies (pandas, numpy, OpenCV) so importing the app
+    stays cheap; startup.warm_up() resolves them before workers serve traffic.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+pd = lazy_import('pandas')
 
 def ensure_dir_exists(directory):
     """Ensure a directory exists, creating it if necessary."""
@@ -30,43 +67,474 @@ def init_data_files():
             writer = csv.writer(f)
             writer.writerow(['id', 'name', 'roll_number', 'image_path', 'registration_date'])
     
-    # Initialize attendance.csv if it doesn't exist
-    if not os.path.exists(ATTENDANCE_CSV):
-        with open(ATTENDANCE_CSV, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['id', 'student_id', 'date', 'time', 'meal_type', 'leftover_weight'])
-    
     # Initialize menu.csv if it doesn't exist
     if not os.path.exists(MENU_CSV):
         with open(MENU_CSV, 'w', newline='') as f:
             writer = csv.writer(f)
             writer.writerow(['id', 'day', 'meal_type', 'meal_name', 'description'])
     
-    # Initialize meal_preparation.csv if it doesn't exist
-    if not os.path.exists(MEAL_PREPARATION_CSV):
-        with open(MEAL_PREPARATION_CSV, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['id', 'meal_name', 'date', 'quantity_prepared', 'expected_students'])
+    # Attendance and meal preparation are stored as monthly partitions; an empty directory is an empty table
+    for directory in PARTITIONED_TABLES.values():
+        ensure_dir_exists(directory)
+
+# Partition files are named after their month, e.g. 2026-10.csv
+PARTITION_FILE = re.compile(r'^(\d{4}-\d{2})\.csv$')
+
+# Journal of a partitioned table, and its entry in the table's file_signature()
+JOURNAL_FILE = '_journal.csv'
+JOURNAL_KEY = 'journal'
+
+# Record of a partitioned table's last journal flush (see record_flush())
+FLUSH_MARKER_FILE = '_flushed.json'
+
+def partition_key(date):
+    """Get the YYYY-MM partition of a YYYY-MM-DD date."""
+    return str(date)[:7]
 
-def read_csv(file_path):
-    """Read a CSV file into a pandas DataFrame."""
+def partition_path(file_path, key):
+    """Get the file of one month of a partitioned table."""
+    return os.path.join(PARTITIONED_TABLES[file_path], key + '.csv')
+
+def journal_path(file_path):
+    """Get the journal of a partitioned table: rows appended but not yet flushed into their months (see journal.py)."""
+    return os.path.join(PARTITIONED_TABLES[file_path], JOURNAL_FILE)
+
+def list_partitions(file_path, start_date=None, end_date=None):
+    """Get the sorted YYYY-MM keys of a partitioned table's months, limited to those overlapping [start_date, end_date]."""
+    try:
+        names = os.listdir(PARTITIONED_TABLES[file_path])
+    except OSError:
+        return []
+    keys = sorted(match.group(1) for match in map(PARTITION_FILE.match, names) if match)
+    return [key for key in keys
+            if (not start_date or key >= partition_key(start_date)) and (not end_date or key <= partition_key(end_date))]
+
+def filter_date_range(df, start_date=None, end_date=None):
+    """Keep the rows of a DataFrame whose YYYY-MM-DD 'date' lies within [start_date, end_date]."""
+    if df.empty or 'date' not in df.columns or not (start_date or end_date):
+        return df
+    mask = pd.Series(True, index=df.index)
+    if start_date:
+        mask &= df['date'] >= start_date
+    if end_date:
+        mask &= df['date'] <= end_date
+    return df[mask].reset_index(drop=True)
+
+def partition_files(file_path, start_date=None, end_date=None):
+    """Get the files of the months of a partitioned table overlapping [start_date, end_date], then its journal if it has one."""
+    paths = [partition_path(file_path, key) for key in list_partitions(file_path, start_date, end_date)]
+    if os.path.exists(journal_path(file_path)):
+        paths.append(journal_path(file_path))
+    return paths
+
+def read_csv(file_path, start_date=None, end_date=None):
+    """
+    Read a CSV file into a pandas DataFrame, optionally only the rows dated within [start_date, end_date].
+
+    A partitioned table is read from the months overlapping the range only
+    (without a range, from all of them) and its journal.
+    """
+    if file_path in PARTITIONED_TABLES:
+        return consistent_read(file_path, lambda: read_partitions(file_path, start_date, end_date))
     try:
         if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
-            return pd.read_csv(file_path)
+            record_csv_operation('read', file_path)
+            with stage_timer('storage_read'):
+                return filter_date_range(pd.read_csv(file_path), start_date, end_date)
         return pd.DataFrame()
     except Exception as e:
         logging.error(f"Error reading CSV file {file_path}: {e}")
         return pd.DataFrame()
 
-def write_csv(df, file_path):
-    """Write a pandas DataFrame to a CSV file."""
+def read_partitions(file_path, start_date=None, end_date=None):
+    frames = [read_piece(file_path, path) for path in partition_files(file_path, start_date, end_date)]
+    frames = [df for df in frames if not df.empty]
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    return filter_date_range(df, start_date, end_date)
+
+def read_partition(file_path, key):
+    """
+    Read one month of a partitioned table, e.g. to change it and write it back with write_csv(df, file_path, key).
+
+    Rows still in the journal are not included; flush it first (journal.flush_journal_locked()).
+    """
+    return read_piece(file_path, partition_path(file_path, key))
+
+def read_journal(file_path):
+    """Read the rows of a partitioned table's journal."""
+    return read_piece(file_path, journal_path(file_path))
+
+def read_piece(file_path, path):
+    """Read one file of a partitioned table."""
+    try:
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            record_csv_operation('read', file_path)
+            with stage_timer('storage_read'):
+                return pd.read_csv(path)
+        return pd.DataFrame()
+    except FileNotFoundError:
+        # Removed by a write since it was listed; consistent_read() sees the write and reads again
+        return pd.DataFrame()
+    except Exception as e:
+        logging.error(f"Error reading CSV file {path}: {e}")
+        return pd.DataFrame()
+
+def close_files(files):
+    """Close the files opened by open_table_files()."""
+    for f in files:
+        f.close()
+
+def open_table_files(file_path, start_date=None, end_date=None):
+    """
+    Open the files of a table holding rows within [start_date, end_date], all from the same layout.
+
+    Open files keep their contents when a write replaces or removes them, so
+    the caller reads a snapshot of the table however long it takes; it closes
+    the files.
+    """
+    if file_path not in PARTITIONED_TABLES:
+        try:
+            return [open(file_path, newline='')]
+        except FileNotFoundError:
+            return []
+
+    def open_all():
+        files = []
+        try:
+            for path in partition_files(file_path, start_date, end_date):
+                files.append(open(path, newline=''))
+        except BaseException:
+            close_files(files)
+            raise
+        return files
+
+    return consistent_read(file_path, open_all, discard=close_files)
+
+def iter_csv_chunks(file_path, chunksize, start_date=None, end_date=None):
+    """
+    Read a CSV file as a sequence of DataFrames of at most chunksize rows, so memory stays bounded.
+
+    Only rows dated within [start_date, end_date] are kept; of a partitioned
+    table, only the months overlapping that range are opened. The files are
+    opened up front (see open_table_files()), so writes made while the chunks
+    are consumed neither fail the read nor make it skip or repeat rows.
+    """
+    files = open_table_files(file_path, start_date, end_date)
+    try:
+        for f in files:
+            if os.fstat(f.fileno()).st_size == 0:
+                continue
+            record_csv_operation('read', file_path)
+            with pd.read_csv(f, chunksize=chunksize) as reader:
+                for chunk in reader:
+                    chunk = filter_date_range(chunk, start_date, end_date)
+                    if not chunk.empty:
+                        yield chunk
+    finally:
+        close_files(files)
+
+def file_signature(file_path):
+    """
+    Return (mtime_ns, size) for a file, or None if it does not exist; used to detect changes.
+
+    A partitioned table's signature holds (month, mtime_ns, size) of every
+    month, then (JOURNAL_KEY, mtime_ns, size) of its journal if it has one.
+    """
+    if file_path in PARTITIONED_TABLES:
+        if not os.path.isdir(PARTITIONED_TABLES[file_path]):
+            return None
+        signatures = [(key, file_signature(partition_path(file_path, key))) for key in list_partitions(file_path)]
+        signatures.append((JOURNAL_KEY, file_signature(journal_path(file_path))))
+        return tuple((key,) + signature for key, signature in signatures if signature is not None)
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def flush_marker_path(file_path):
+    """Get the record of a partitioned table's last journal flush (see record_flush())."""
+    return os.path.join(PARTITIONED_TABLES[file_path], FLUSH_MARKER_FILE)
+
+def split_journal(signature):
+    """Split a partitioned table's file_signature() into its months and its journal entry (None without a journal)."""
+    if signature and signature[-1][0] == JOURNAL_KEY:
+        return signature[:-1], signature[-1]
+    return tuple(signature or ()), None
+
+def record_flush(file_path, before_signature, months_after):
+    """
+    Record a journal flush about to remove the journal: the months before and after it and the rows it moved.
+
+    journal_growth() reads it to take an aggregate across the flush: the
+    table holds the same rows, so only the journal rows the aggregate had
+    not seen yet are new to it. The caller holds file_lock(file_path).
+    """
+    months_before, journal = split_journal(before_signature)
+    try:
+        with open(journal_path(file_path), 'rb') as f:
+            data = f.read(journal[2])
+        marker = {'before': months_before, 'journal': journal, 'after': months_after, 'data': data.decode()}
+
+        def write(path):
+            with open(path, 'w') as f:
+                json.dump(marker, f)
+        replace_atomically(flush_marker_path(file_path), write)
+    except OSError as e:
+        # The other workers rebuild their aggregates instead
+        logging.error(f"Error recording the journal flush of {file_path}: {e}")
+
+def read_flush(file_path):
+    try:
+        with open(flush_marker_path(file_path)) as f:
+            marker = json.load(f)
+    except (OSError, ValueError):
+        return None
+    for name in ('before', 'after'):
+        marker[name] = tuple(map(tuple, marker[name]))
+    marker['journal'] = tuple(marker['journal'])
+    return marker
+
+def journal_rows(data, start, end):
+    """Parse the rows between two byte offsets of a journal's contents, under its header line."""
+    if b'\n' not in data:
+        return []
+    header = data[:data.index(b'\n') + 1]
+    start = max(start, len(header))
+    if end <= start:
+        return []
+    return pd.read_csv(io.BytesIO(header + data[start:end])).to_dict('records')
+
+def journal_growth(file_path, old_signature, new_signature):
+    """
+    Get the rows appended to a partitioned table's journal between two of its file_signature()s.
+
+    A flush in between (see record_flush()) is followed across: the journal
+    rows moved into the months since the old signature count as appended.
+    Returns a list of row dicts, or None unless the journal only grew and
+    was flushed and nothing else changed (its months must then be read again).
+    """
+    if file_path not in PARTITIONED_TABLES or old_signature is None or not new_signature:
+        return None
+    old_months, old_journal = split_journal(old_signature)
+    new_months, new_journal = split_journal(new_signature)
+    rows = []
+    if old_months != new_months:
+        flush = read_flush(file_path)
+        if (flush is None or flush['before'] != old_months or flush['after'] != new_months
+                or (old_journal and old_journal[2] > flush['journal'][2]) or new_journal == flush['journal']):
+            # Not the last flush, or its journal was left behind, e.g. by a crash
+            return None
+        rows = journal_rows(flush['data'].encode(), old_journal[2] if old_journal else 0, flush['journal'][2])
+        old_journal = None
+    if new_journal is None:
+        return rows if old_journal is None else None
+    if old_journal and old_journal[2] >= new_journal[2]:
+        return None
+    try:
+        with open(journal_path(file_path), 'rb') as f:
+            data = f.read(new_journal[2])
+    except OSError:
+        return None
+    if len(data) < new_journal[2]:
+        return None
+    record_csv_operation('read', file_path)
+    return rows + journal_rows(data, old_journal[2] if old_journal else 0, new_journal[2])
+
+def data_version(*file_paths):
+    """
+    Return a hash of today's date and the signatures and versions of the given files, which changes whenever data derived from them can.
+
+    The version counter catches rewrites a signature can miss: same size within the file system's timestamp granularity.
+    """
+    parts = [get_current_date()] + [(file_signature(path), table_version(path)) for path in file_paths]
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+def conditional_get(*file_paths):
+    """
+    Decorator for GET endpoints whose response is derived from the given files.
+
+    The response carries a strong ETag from data_version(); a request whose
+    If-None-Match still matches gets a 304 without the view running at all.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = data_version(*file_paths)
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+            response.set_etag(etag)
+            # Browsers may keep the response but must revalidate it before reuse
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+@contextlib.contextmanager
+def file_lock(file_path):
+    """
+    Hold an exclusive lock on a data file for a read-modify-write, across threads and worker processes.
+
+    The lock is taken on a separate `<file>.lock` file, so plain readers are not blocked.
+    """
+    with _thread_locks_guard:
+        thread_lock = _thread_locks.setdefault(file_path, threading.Lock())
+    with thread_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(file_path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def replace_atomically(path, write):
+    """
+    Write a file through write(temp_path), then rename it over `path`.
+
+    Readers see the old or the new file, never half of one, and keep reading
+    the one they opened.
+    """
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def version_path(file_path):
+    return os.path.join(VERSION_DIR, os.path.basename(file_path))
+
+def read_versions(file_path):
+    """
+    Get (version, layout) of a table.
+
+    version is raised by every write made through write_csv() or the journal.
+    layout is odd while a write is replacing or removing the table's files,
+    for consistent_read().
+    """
     try:
-        df.to_csv(file_path, index=False)
+        with open(version_path(file_path)) as f:
+            version, layout = f.read().split()
+        return int(version), int(layout)
+    except (OSError, ValueError):
+        return 0, 0
+
+def table_version(file_path):
+    """Get the version counter of a table, raised by every write to it; e.g. to invalidate what was derived from it."""
+    return read_versions(file_path)[0]
+
+def _set_versions(file_path, version, layout):
+    def write(path):
+        with open(path, 'w') as f:
+            f.write(f"{version} {layout}")
+    ensure_dir_exists(VERSION_DIR)
+    replace_atomically(version_path(file_path), write)
+
+# Tables this thread is writing, so nested versioned_write()s count as one write
+_writing = threading.local()
+
+@contextlib.contextmanager
+def versioned_write(file_path, append=False):
+    """
+    Raise a table's version once a write to its files is done.
+
+    Unless the write only appends rows to a file (`append`), the layout is
+    also odd while it is under way. The caller holds file_lock(file_path). A
+    write left unfinished by a crash leaves the layout odd until the next one.
+    """
+    writing = _writing.__dict__.setdefault('tables', set())
+    if file_path in writing:
+        yield
+        return
+    version, layout = read_versions(file_path)
+    if not append:
+        layout += 2 if layout % 2 else 1
+        _set_versions(file_path, version, layout)
+    writing.add(file_path)
+    try:
+        yield
+    finally:
+        writing.discard(file_path)
+        _set_versions(file_path, version + 1, layout + 1 if layout % 2 else layout)
+
+def consistent_read(file_path, read, discard=None):
+    """
+    Run read() until no write replaced or removed files of the table meanwhile, so it never mixes two layouts.
+
+    Readers never wait for the write lock; a read such a write overlapped is
+    done again, and after CONSISTENT_READ_ATTEMPTS the last read is used anyway.
+    discard(result) is called on the results of the reads done again, e.g. to
+    close what they opened.
+    """
+    for _ in range(CONSISTENT_READ_ATTEMPTS):
+        layout = read_versions(file_path)[1]
+        if layout % 2 == 0:
+            try:
+                result = read()
+            except FileNotFoundError:
+                # Removed by a write since it was listed, e.g. a flushed journal
+                pass
+            else:
+                if read_versions(file_path)[1] == layout:
+                    return result
+                if discard:
+                    discard(result)
+        time.sleep(CONSISTENT_READ_BACKOFF)
+    return read()
+
+def write_csv(df, file_path, partition=None):
+    """
+    Write a pandas DataFrame to a CSV file.
+
+    For a partitioned table, pass the YYYY-MM `partition` when df holds just
+    that month; otherwise df is the whole table, journal included, and is
+    split by month. A month left without rows is removed, as is the journal
+    after a whole-table write.
+
+    Every file is replaced atomically and the table's version raised (see
+    versioned_write()), so the caller holds file_lock(file_path).
+    """
+    try:
+        record_csv_operation('write', file_path)
+        with stage_timer('storage_write'), versioned_write(file_path):
+            if file_path in PARTITIONED_TABLES:
+                write_partitions(df, file_path, partition)
+            else:
+                replace_atomically(file_path, lambda path: df.to_csv(path, index=False))
         return True
     except Exception as e:
         logging.error(f"Error writing to CSV file {file_path}: {e}")
         return False
 
+def write_partitions(df, file_path, partition=None):
+    """Write one month (or, without `partition`, every month) of a partitioned table."""
+    ensure_dir_exists(PARTITIONED_TABLES[file_path])
+    if partition is not None:
+        months = {partition: df}
+    else:
+        months = {key: month_df for key, month_df in df.groupby(df['date'].astype(str).str[:7])} if not df.empty else {}
+        for key in list_partitions(file_path):
+            months.setdefault(key, df.iloc[0:0])
+    for key, month_df in months.items():
+        path = partition_path(file_path, key)
+        if not month_df.empty:
+            replace_atomically(path, lambda temp_path: month_df.to_csv(temp_path, index=False))
+        elif os.path.exists(path):
+            os.remove(path)
+    if partition is None and os.path.exists(journal_path(file_path)):
+        os.remove(journal_path(file_path))
+
 def get_next_id(file_path):
     """Get the next available ID for a CSV file."""
     df = read_csv(file_path)
@@ -109,11 +577,11 @@ def get_students_count():
 
 def get_today_attendance_count(meal_type):
     """Get the count of students who attended a specific meal today."""
-    attendance_df = read_csv(ATTENDANCE_CSV)
+    today = get_current_date()
+    attendance_df = read_csv(ATTENDANCE_CSV, today, today)
     if attendance_df.empty:
         return 0
-    today = get_current_date()
-    return len(attendance_df[(attendance_df['date'] == today) & (attendance_df['meal_type'] == meal_type)])
+    return int((attendance_df['meal_type'] == meal_type).sum())
 
 def format_date(date_str):
     """Format a date string from YYYY-MM-DD to a more readable format."""
@@ -122,17 +590,3 @@ def format_date(date_str):
         return date_obj.strftime("%B %d, %Y")
     except:
         return date_str
-        
-def get_meal_name_from_menu(day, meal_type):
-    """Get the meal name from the menu based on day and meal type."""
-    menu_df = read_csv(MENU_CSV)
-    if menu_df.empty:
-        return f"No {meal_type} menu for {day}"
-    
-    # Find the menu item for the given day and meal type
-    menu_item = menu_df[(menu_df['day'] == day) & (menu_df['meal_type'] == meal_type)]
-    
-    if menu_item.empty:
-        return f"No {meal_type} menu for {day}"
-    
-    return menu_item.iloc[0]['meal_name']